@@ -0,0 +1,89 @@
+#!/usr/bin/python
+"""
+Benchmark: Groupon deal extraction, string XPath calls (before) vs. compiled SelectorPlan (after).
+Runs on the (generated) deal pages of bench/corpus/deals.
+
+"""
+import glob
+import os
+import sys
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(BENCH_DIR, '..')))
+sys.path.append(os.path.abspath(os.path.join(BENCH_DIR, '../libscraper')))
+
+from lxml import etree
+from libscraper import scraper, utils
+from libscraper.exceptions import ElementMissing
+
+URL = 'http://www.groupon.co.uk/deals/london/cafe-rouge/12345'
+
+
+def legacy_get_deal(parser, root, url):
+    """ Groupon extraction as it was before SelectorPlan (string XPath expressions). """
+    deal = {}
+    try:
+        tag = root.xpath('//input[@id="currentTimeLeft"]').pop()
+        deal['status'] = 1
+    except IndexError:
+        deal['status'] = 0
+        return deal
+    info = parser.urlinfo(url)
+    try:
+        tag = root.xpath('//div[@class="merchantContact"]').pop()
+    except IndexError:
+        raise ElementMissing('{:s}:://div[@class="merchantContact"]'.format(url))
+    try:
+        deal['merchant'] = utils.get_text(tag.xpath('//h2[@class="subHeadline"]')[0])
+    except IndexError:
+        raise ElementMissing('{:s}:merchant://h2[@class="subHeadline"]'.format(url))
+    try:
+        deal['merchant_url'] = tag.xpath('a').pop().get('href')
+    except IndexError:
+        pass
+    address = parser._Parser__extract_address_lines(tag, deal, info)
+    if address:
+        deal['addresses'] = [address]
+    try:
+        tag = root.xpath('//div[@id="contentDealBuyBox"]/span[@class="price"]/span[@class="noWrap"]').pop()
+    except IndexError:
+        raise ElementMissing('{:s}:price://div[@id="contentDealBuyBox"]/span[@class="price"]/span[@class="noWrap"]'.format(url))
+    price = utils.extract_float_from_tag(tag)
+    deal['price'] = price
+    try:
+        tag = root.xpath('//div[@id="contentDealBuyBox"]/div[contains(@class, "savings")]/*[contains(@class, "_saving")]')[0]
+        _savings = utils.extract_float_from_tag(tag)
+    except IndexError:
+        _savings = 0.0
+    deal['rrp'] = price + _savings
+    try:
+        tag = root.xpath('//span[@id="jDealSoldAmount"]').pop()
+    except IndexError:
+        raise ElementMissing('{:s}:sales://span[@id="jDealSoldAmount"]'.format(url))
+    deal['volume'] = int(utils.extract_float_from_tag(tag))
+    return deal
+
+
+def main(number=200):
+    scrpr = scraper.Scraper()
+    parser = scrpr.model(URL)
+    for path in sorted(glob.glob(os.path.join(BENCH_DIR, 'corpus', 'deals', '*.html'))):
+        tree = parser.make_tree(open(path, 'rb').read(), url=URL)
+
+        def after():
+            parser.prefetch(URL, tree)
+            return parser.get_deal(URL)
+
+        def before():
+            return legacy_get_deal(parser, tree._root, URL)
+
+        assert before() == after(), path
+        t_before = timeit.timeit(before, number=number) / number
+        t_after = timeit.timeit(after, number=number) / number
+        print "{:24s} before {:8.3f} ms  after {:8.3f} ms  speedup x{:.2f}".format(
+            os.path.basename(path), t_before * 1000, t_after * 1000, t_before / t_after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+"""
+Import time benchmark: startup budget of the CLI's lightweight actions.
+
+Every case runs in fresh interpreters; its time is measured once the
+interpreter has started (site imports excluded). A case fails when its median
+time exceeds its budget, or when it imports one of its forbidden modules
+(heavy dependencies it has no use for, e.g. lxml to list targets). Exits
+with status 1 when a case fails.
+
+    bench/bench_import.py
+    bench/bench_import.py --repeat 20 --budget-scale 2     # slower machines
+
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+SCRIPT = os.path.join(ROOT_DIR, 'bin', 'scraper')
+
+# Heavy dependencies of the parsing and network code paths
+HEAVY = ('lxml.etree', 'pkg_resources', 'urllib2', 'httplib', 'hashlib', 'multiprocessing', 'sqlite3')
+
+# Runs a statement (or the CLI) and reports the elapsed time and imported modules on the last line of stderr
+RUNNER = r"""
+import sys, time
+start = time.time()
+code = sys.argv[1]
+if code == '--cli':
+    import runpy
+    sys.argv = [%(script)r] + sys.argv[2:]
+    try:
+        runpy.run_path(sys.argv[0], run_name='__main__')
+    except SystemExit:
+        pass
+else:
+    exec(code)
+sys.stdout.flush()
+elapsed = time.time() - start
+import json
+sys.stderr.write('\n' + json.dumps({'elapsed': elapsed,
+                                    'modules': sorted(k for k, v in sys.modules.items() if v is not None)}) + '\n')
+""" % {'script': SCRIPT}
+
+
+class Case(object):
+    """
+    An import time case.
+
+        -- name         case name
+        -- args         runner arguments: a Python statement, or '--cli' followed by bin/scraper arguments
+        -- budget       maximum median time in milliseconds
+        -- forbidden    modules the case must not import
+
+    """
+
+    def __init__(self, name, args, budget, forbidden=HEAVY):
+        self.name = name
+        self.args = args
+        self.budget = budget
+        self.forbidden = forbidden
+
+    def run_once(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([ROOT_DIR, os.path.join(ROOT_DIR, 'libscraper')])
+        process = subprocess.Popen([sys.executable, '-c', RUNNER] + self.args, env=env, cwd=ROOT_DIR,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        try:
+            return json.loads(stderr.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            raise RuntimeError('{:s} failed:\n{:s}'.format(self.name, stderr))
+
+    def run(self, repeat):
+        times = []
+        modules = set()
+        for _ in range(repeat):
+            result = self.run_once()
+            times.append(result['elapsed'] * 1000)
+            modules.update(result['modules'])
+        times.sort()
+        return {
+            'median': times[len(times) // 2],
+            'min': times[0],
+            'modules': len(modules),
+            'forbidden': sorted(name for name in self.forbidden if name in modules),
+        }
+
+
+CASES = [
+    Case('import libscraper.scraper', ['import libscraper.scraper'], budget=40),
+    Case('Scraper()', ['from libscraper.scraper import Scraper; Scraper()._targets[0].tostring()'], budget=40),
+    Case('import libscraper.worker', ['import libscraper.worker'], budget=40),
+    Case('cli --help', ['--cli', '--help'], budget=40),
+    Case('cli show-targets', ['--cli', 'show-targets'], budget=60),
+    # Resolving a URL to its target must not compile other hosts' patterns, nor load models
+    Case('router lookup', ['from libscraper.scraper import Scraper; '
+                           'Scraper().router.route("http://www.groupon.co.uk/deals/london/spa/1")'],
+         budget=40),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time benchmark.')
+    parser.add_argument('--cases', nargs='*', choices=[case.name for case in CASES], help='cases to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=7, help='interpreter runs per case')
+    parser.add_argument('--budget-scale', type=float, default=1.0, help='multiplies every budget')
+    args = parser.parse_args()
+
+    print "{:<28s}{:>10s}{:>10s}{:>10s}{:>9s}  {:s}".format('case', 'median ms', 'min ms', 'budget', 'modules', 'status')
+    failed = False
+    for case in CASES:
+        if args.cases and case.name not in args.cases:
+            continue
+        result = case.run(args.repeat)
+        budget = case.budget * args.budget_scale
+        problems = []
+        if result['median'] > budget:
+            problems.append('over budget')
+        if result['forbidden']:
+            problems.append('imports ' + ', '.join(result['forbidden']))
+        failed = failed or bool(problems)
+        print "{:<28s}{:>10.1f}{:>10.1f}{:>10.0f}{:>9d}  {:s}".format(
+            case.name, result['median'], result['min'], budget, result['modules'],
+            'FAIL: ' + '; '.join(problems) if problems else 'ok')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
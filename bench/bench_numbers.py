@@ -0,0 +1,201 @@
+#!/usr/bin/python
+"""
+Benchmark: numbers parsing, legacy utils.extract_float_from_tag / extract_float_from_string
+(before) vs. libscraper.numeric batch parsing (after).
+
+Results must be identical on the regression corpus:
+
+    - the price, savings and sold amount elements of the live deal pages of bench/corpus/deals,
+      with the en_GB format
+    - every element of the deal pages of bench/corpus/deals, and generated elements
+      (prices, amounts, entities, non-ASCII text, nested tags, tails), with the guessing format
+    - generated strings of digits, separators, currency signs and words, with the guessing format
+    - generated prices and amounts written as the en_GB and fr_FR pages write them, with the
+      explicit formats of these locales: those the guessing format reads right (below a million,
+      one character separators) must give its results, and all of them their written amount
+
+"""
+import glob
+import os
+import random
+import re
+import sys
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(BENCH_DIR, '..')))
+sys.path.append(os.path.abspath(os.path.join(BENCH_DIR, '../libscraper')))
+
+from lxml import etree
+from libscraper import numeric, utils
+
+DEAL_XPATHS = [
+    '//div[@id="contentDealBuyBox"]/span[@class="price"]/span[@class="noWrap"]',
+    '//div[@id="contentDealBuyBox"]/div[contains(@class, "savings")]/*[contains(@class, "_saving")]',
+    '//span[@id="jDealSoldAmount"]',
+]
+
+
+def legacy_extract_float_from_tag(tag):
+    entities = ['&#13;', '&#160;', '&#163;', '&#8364;']
+    pattern = "|".join("{:s}".format(re.escape(entity)) for entity in entities)
+    data = utils.strip_white_spaces(re.sub(pattern, '', etree.tostring(tag)))
+    pattern = re.compile(r'<.*?>')
+    data = pattern.sub(' ', data)
+    return legacy_extract_float_from_string(data)
+
+def legacy_extract_float_from_string(data):
+    data = data.replace('. ', '.')
+    decimals = digits = thousands = '0'
+    pattern = re.compile(r"""
+        \b(\d+)
+        \D?(\d{0,3})
+        \D?(\d{0,2})
+    """, re.VERBOSE)
+    matches = pattern.search(data)
+    if matches is not None:
+        results = matches.groups()
+        has_group_1 = len(results[0]) > 0 and True or False
+        has_group_2 = len(results[1]) > 0 and True or False
+        has_group_3 = len(results[2]) > 0 and True or False
+        decimals = has_group_3 and results[2] or '0'
+        digits = has_group_2 and results[1] or '0'
+        if has_group_2:
+            if len(digits) >= 3 or decimals != '0':
+                pass
+            else:
+                decimals = digits
+                digits = '0'
+        if len(decimals) < 2:
+            decimals += '0'
+        if not has_group_2 and not has_group_3:
+            digits = results[0]
+        elif has_group_2 and not has_group_3:
+            if digits == '0':
+                digits = results[0]
+            else:
+                thousands = results[0]
+        else:
+            thousands = results[0]
+        return ( float(thousands) * 1000 ) + float(digits) + ( float(decimals) / 100 )
+    else:
+        return 0.0
+
+
+def random_strings(count=5000, seed=42):
+    pieces = ['1', '12', '025', '9', '0', '00', '1234', ',', '.', '. ', ' ', '  ', '\xc2\xa0', '\t', '\n',
+              '\xc2\xa3', '\xe2\x82\xac', 'EUR', 'sold', '_', '-', '%', '\x00', u'\xa0', u'\u202f', u'caf\xe9']
+    rnd = random.Random(seed)
+    strings = ['', ' ', u'', '10. 00', '1,234,567.00', '0.9', '12.0', '1.5 0']
+    for _ in range(count):
+        parts = [rnd.choice(pieces) for _ in range(rnd.randint(0, 8))]
+        if any(isinstance(part, unicode) for part in parts):
+            strings.append(u''.join(part.decode('utf-8') if isinstance(part, str) else part for part in parts))
+        else:
+            strings.append(''.join(parts))
+    return strings
+
+
+def corpus_elements(seed=42):
+    elements = []
+    for path in sorted(glob.glob(os.path.join(BENCH_DIR, 'corpus', 'deals', '*.html'))):
+        root = etree.fromstring(open(path, 'rb').read(), etree.HTMLParser())
+        elements.extend(root.iter())
+    rnd = random.Random(seed)
+    html = ['<span class="noWrap">&#163;{:,.2f}</span>', '<span>{:,.2f}&#160;&#8364;</span> &amp; more',
+            '<b>{:,.0f}</b> bought\r\n', '<p>Save <i>{:.2f}</i> &lt;today&gt;</p>', '<em>\xc2\xa3{:.1f} \xe2\x80\x99</em>',
+            '<span>{:,.2f}<!-- was 12 --></span>  \t tail 3', '<td title="a  5">{:.0f}\r%</td>', '<br/>{:.2f}']
+    for _ in range(1000):
+        value = rnd.choice([rnd.randint(0, 99), rnd.randint(0, 99999) / 100.0, rnd.randint(0, 999999)])
+        root = etree.fromstring('<div>{:s}</div>'.format(rnd.choice(html).format(value)), etree.HTMLParser())
+        elements.extend(root.find('.//div'))
+    return elements
+
+
+def deal_elements():
+    """ Price, savings and sold amount elements of the live deal pages of bench/corpus/deals (en_GB). """
+    deals = []
+    for path in sorted(glob.glob(os.path.join(BENCH_DIR, 'corpus', 'deals', 'live-*.html'))):
+        root = etree.fromstring(open(path, 'rb').read(), etree.HTMLParser())
+        deals.append([root.xpath(xpath)[0] for xpath in DEAL_XPATHS])
+    return deals
+
+
+def locale_strings(count=5000, seed=42):
+    """
+    Prices and amounts as written on en_GB and fr_FR pages, by locale: [(string, amount, readable)],
+    readable strings being those the guessing format reads right (amounts below a million, one character separators).
+
+    """
+    rnd = random.Random(seed)
+    formats = {
+        'en_GB': ['\xc2\xa3{:s}', '{:s}', 'Sold {:s}', '\xc2\xa3{:s} off', u'\xa3{:s}'],
+        'fr_FR': ['{:s} \xe2\x82\xac', '{:s}\xc2\xa0\xe2\x82\xac', '{:s}', u'{:s}\xa0\u20ac', '{:s} vendus'],
+    }
+    groups = {'en_GB': [','], 'fr_FR': [' ', '', '\xc2\xa0', '\xe2\x80\xaf']}
+    corpus = {}
+    for locale, templates in sorted(formats.items()):
+        strings = []
+        for _ in range(count):
+            integer = rnd.choice([rnd.randint(0, 999), rnd.randint(1000, 999999), rnd.randint(0, 99999999)])
+            decimals = rnd.choice(['', str(rnd.randint(0, 9)), '{:02d}'.format(rnd.randint(0, 99))])
+            separator = rnd.choice(groups[locale])
+            number = '{:,d}'.format(integer).replace(',', separator)
+            if decimals:
+                number += ('.' if locale == 'en_GB' else ',') + decimals
+            template = rnd.choice(templates)
+            if isinstance(template, unicode):
+                number = number.decode('utf-8')
+            amount = float(integer) + float(decimals) / 10 ** len(decimals) if decimals else float(integer)
+            readable = integer < 1000000 and len(separator.decode('utf-8') if isinstance(template, unicode) else separator) < 2
+            strings.append((template.format(number), amount, readable))
+        corpus[locale] = strings
+    return corpus
+
+
+def report(name, before, after, number):
+    t_before = timeit.timeit(before, number=number) / number
+    t_after = timeit.timeit(after, number=number) / number
+    print "{:26s} before {:8.3f} ms  after {:8.3f} ms  speedup x{:.2f}".format(
+        name, t_before * 1000, t_after * 1000, t_before / t_after)
+
+
+def main(number=5):
+    strings = random_strings()
+    elements = corpus_elements()
+    locales = locale_strings()
+    deals = deal_elements() * 100
+
+    expected = [legacy_extract_float_from_string(s) for s in strings]
+    assert expected == list(numeric.parse_numbers(strings))
+    assert expected == [utils.extract_float_from_string(s) for s in strings]
+    expected = [legacy_extract_float_from_tag(e) for e in elements]
+    assert expected == list(numeric.parse_tags(elements))
+    assert expected == [utils.extract_float_from_tag(e) for e in elements]
+    assert ([[legacy_extract_float_from_tag(tag) for tag in tags] for tags in deals] ==
+            [list(numeric.parse_tags(tags, 'en_GB')) for tags in deals])
+    for locale, values in sorted(locales.items()):
+        readable = [s for s, amount, readable in values if readable]
+        expected = [legacy_extract_float_from_string(s) for s in readable]
+        assert expected == list(numeric.parse_numbers(readable, locale)), locale
+        assert expected == [numeric.parse_number(s, locale) for s in readable], locale
+        assert [amount for s, amount, readable in values] == list(numeric.parse_numbers([s for s, _, _ in values], locale)), locale
+
+    report('extract_float_from_string',
+           lambda: [legacy_extract_float_from_string(s) for s in strings],
+           lambda: numeric.parse_numbers(strings), number)
+    report('extract_float_from_tag',
+           lambda: [legacy_extract_float_from_tag(e) for e in elements],
+           lambda: numeric.parse_tags(elements), number)
+    report('deal price/savings/volume',
+           lambda: [[legacy_extract_float_from_tag(tag) for tag in tags] for tags in deals],
+           lambda: [numeric.parse_tags(tags, 'en_GB') for tags in deals], number)
+    for locale, values in sorted(locales.items()):
+        values = [s for s, _, _ in values]
+        report('parse_numbers ' + locale,
+               lambda: [legacy_extract_float_from_string(s) for s in values],
+               lambda: numeric.parse_numbers(values, locale), number)
+
+
+if __name__ == "__main__":
+    main()
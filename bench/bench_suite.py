@@ -0,0 +1,222 @@
+#!/usr/bin/python
+"""
+Offline benchmark suite.
+
+Every stage runs against the local HTTP stand-in (bench/standin.py) serving
+bench/corpus, in a forked process of its own so that its peak memory is
+measured separately. Reports per stage: throughput, latency percentiles
+and peak RSS; --json saves the results, --compare prints the change against
+results saved by a previous run (e.g. of another version).
+
+    bench/bench_suite.py --json before.json
+    bench/bench_suite.py --compare before.json
+
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import traceback
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(BENCH_DIR, '..')))
+sys.path.append(os.path.abspath(os.path.join(BENCH_DIR, '../libscraper')))
+
+from standin import StandIn, CORPUS_DIR
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile of sorted values. """
+    if not values:
+        return 0.0
+    rank = int(round(p / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+def peak_rss():
+    """ Peak resident set size of the current process, in KB. """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage // 1024 if sys.platform == 'darwin' else usage
+
+
+class Stage(object):
+    """
+    A benchmark stage.
+
+        -- name     stage name
+        -- setup    callable(server, scraper) returning the list of calls to time
+        -- items    callable(result) returning the number of items processed by a call (defaults to 1)
+
+    """
+
+    def __init__(self, name, setup, items=None):
+        self.name = name
+        self.setup = setup
+        self.items = items
+
+    def run(self, server, repeat):
+        from libscraper import scraper
+        scrpr = scraper.Scraper()
+        calls = self.setup(server, scrpr)
+        calls[0]() # warm up (imports, models, connections)
+        rss_before = peak_rss()
+        latencies = []
+        items = 0
+        start = time.time()
+        for _ in range(repeat):
+            for call in calls:
+                t = time.time()
+                result = call()
+                latencies.append(time.time() - t)
+                items += self.items(result) if self.items else 1
+        elapsed = time.time() - start
+        latencies.sort()
+        return {
+            'calls': len(latencies),
+            'items': items,
+            'seconds': elapsed,
+            'calls_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+            'items_per_sec': items / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p90_ms': percentile(latencies, 90) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'max_ms': latencies[-1] * 1000,
+            'peak_rss_kb': peak_rss(),
+            'rss_growth_kb': peak_rss() - rss_before,
+        }
+
+    def run_forked(self, server, repeat):
+        """ Runs the stage in a child process; returns its results. """
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = 0
+            try:
+                output = json.dumps(self.run(server, repeat))
+            except Exception:
+                output = json.dumps({'error': traceback.format_exc()})
+                status = 1
+            with os.fdopen(write_fd, 'w') as f:
+                f.write(output)
+            os._exit(status)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            output = f.read()
+        os.waitpid(pid, 0)
+        return json.loads(output)
+
+
+# Stages
+
+def urlinfo_stage(server, scrpr):
+    from lxml import etree
+    root = etree.parse(os.path.join(CORPUS_DIR, 'feeds', 'medium.xml')).getroot()
+    urls = [link.text for link in root.iter('link')]
+    return [lambda url=url: scrpr.urlinfo(url) for url in urls]
+
+def parse_stage(feed):
+    def setup(server, scrpr):
+        url = server.feed_url(feed)
+        return [lambda: scrpr.parse(url)]
+    return setup
+
+def get_deals_stage(feed):
+    def setup(server, scrpr):
+        url = server.feed_url(feed)
+        return [lambda: scrpr.get_deals(url)]
+    return setup
+
+def get_deal_stage(server, scrpr):
+    pages = sorted(os.path.basename(path)[:-5] for path in glob.glob(os.path.join(CORPUS_DIR, 'deals', '*.html')))
+    return [lambda url=server.deal_url(page): scrpr.get_deal(url) for page in pages]
+
+def utils_stage(server, scrpr):
+    from lxml import etree
+    from libscraper import utils
+    elements = []
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, 'deals', '*.html'))):
+        elements.extend(etree.parse(path, etree.HTMLParser()).getroot().iter())
+    contacts = [e for e in elements if e.get('class') == 'merchantContact']
+    address_lines = [utils.extract_lines_from_tag(e) for e in contacts]
+    return [
+        lambda: utils.get_texts(elements),
+        lambda: utils.extract_lines_from_tags(contacts),
+        lambda: utils.clean_addresses(address_lines, 'en_GB'),
+    ]
+
+def count(result):
+    return len(result)
+
+STAGES = [
+    Stage('urlinfo', urlinfo_stage),
+    Stage('parse-feed-small', parse_stage('small')),
+    Stage('parse-feed-medium', parse_stage('medium')),
+    Stage('parse-feed-10k', parse_stage('synthetic-10000')),
+    Stage('get_deals-small', get_deals_stage('small'), items=count),
+    Stage('get_deals-medium', get_deals_stage('medium'), items=count),
+    Stage('get_deals-10k', get_deals_stage('synthetic-10000'), items=count),
+    Stage('get_deal', get_deal_stage),
+    Stage('utils', utils_stage),
+]
+
+REPEAT = {'parse-feed-10k': 3, 'get_deals-10k': 1}
+
+
+def report(results, baseline=None):
+    print "{:20s} {:>9s} {:>11s} {:>9s} {:>9s} {:>9s} {:>10s}{:s}".format(
+        'stage', 'calls/s', 'items/s', 'p50 ms', 'p90 ms', 'p99 ms', 'peak KB', '  vs. baseline' if baseline else '')
+    for name, stats in results.items():
+        if 'error' in stats:
+            print "{:20s} FAILED\n{:s}".format(name, stats['error'])
+            continue
+        line = "{:20s} {calls_per_sec:9.1f} {items_per_sec:11.1f} {p50_ms:9.3f} {p90_ms:9.3f} {p99_ms:9.3f} {peak_rss_kb:10d}".format(
+            name, **stats)
+        base = (baseline or {}).get(name)
+        if base and 'error' not in base and base['p50_ms']:
+            line += "  p50 x{:.2f}, peak {:+d} KB".format(stats['p50_ms'] / base['p50_ms'],
+                                                         stats['peak_rss_kb'] - base['peak_rss_kb'])
+        print line
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark suite.')
+    parser.add_argument('--stages', nargs='*', help='stages to run (default: all)',
+                        choices=[stage.name for stage in STAGES])
+    parser.add_argument('--repeat', type=int, default=20, help='repetitions of each stage')
+    parser.add_argument('--json', help='saves the results to this file')
+    parser.add_argument('--compare', help='results file of a previous run to compare with')
+    args = parser.parse_args()
+
+    server = StandIn().start()
+    server.install()
+    from collections import OrderedDict
+    results = OrderedDict()
+    for stage in STAGES:
+        if args.stages and stage.name not in args.stages:
+            continue
+        results[stage.name] = stage.run_forked(server, min(args.repeat, REPEAT.get(stage.name, args.repeat)))
+    server.stop()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['stages']
+    report(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'repeat': args.repeat,
+                'stages': results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
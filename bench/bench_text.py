@@ -0,0 +1,120 @@
+#!/usr/bin/python
+"""
+Benchmark: text normalization helpers of libscraper.utils, legacy implementations (before)
+vs. current ones (after). Both must give identical output on the golden corpus: every
+element of the deal pages of bench/corpus/deals, and generated strings mixing tabs,
+line breaks, non-breaking spaces and non-ASCII text.
+
+"""
+import glob
+import os
+import random
+import re
+import sys
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(BENCH_DIR, '..')))
+sys.path.append(os.path.abspath(os.path.join(BENCH_DIR, '../libscraper')))
+
+from lxml import etree
+from libscraper import utils
+
+
+def legacy_strip_white_spaces(data):
+    value = utils.bytestr(data)
+    value = re.sub(r'\r|\n|\xc2\xa0', ' ', value)
+    value = re.sub(r'\s\s+', ' ', value)
+    if value:
+        return value.strip()
+    return ''
+
+def legacy_get_text(element, with_tail=False):
+    value = etree.tostring(element, method='text', with_tail=with_tail, encoding='utf-8')
+    value = legacy_strip_white_spaces(value)
+    return utils.bytestr(value)
+
+def legacy_extract_lines_from_tag(tag, exclude_tags=('a','iframe'), include_tags=None):
+    lines = []
+    value = utils.bytestr(legacy_strip_white_spaces(tag.text))
+    if value and value != 'None':
+        lines.append(value)
+    value = utils.bytestr(legacy_strip_white_spaces(tag.tail))
+    if value and value != 'None':
+        lines.append(value)
+    for e in tag:
+        if include_tags:
+            if e.tag not in include_tags:
+                continue
+        elif e.tag in exclude_tags:
+            continue
+        value = utils.bytestr(legacy_strip_white_spaces(e.text))
+        if value and value != 'None':
+            lines.append(value)
+        value = utils.bytestr(legacy_strip_white_spaces(e.tail))
+        if value and value != 'None':
+            lines.append(value)
+        if len(e):
+            newlines = legacy_extract_lines_from_tag(e, exclude_tags=exclude_tags, include_tags=include_tags)
+            for line in newlines:
+                if line not in lines:
+                    lines.append(line)
+    return lines
+
+
+def random_strings(count=2000, seed=42):
+    pieces = ['a', 'word', ' ', '  ', '\t', '\n', '\r\n', '\xc2\xa0', '\xc2', '\xa0', '\x0b', '\x0c',
+              u'caf\xe9', u'\xa0', u'\u2003', '\xe2\x82\xac', '0', '12.50']
+    rnd = random.Random(seed)
+    strings = [None, '', ' ', u'', 12, 1.5]
+    for _ in range(count):
+        parts = [rnd.choice(pieces) for _ in range(rnd.randint(0, 12))]
+        if any(isinstance(part, unicode) for part in parts):
+            strings.append(u''.join(part.decode('utf-8') if isinstance(part, str) else part for part in parts
+                                    if not isinstance(part, str) or part not in ('\xc2', '\xa0')))
+        else:
+            strings.append(''.join(parts))
+    return strings
+
+
+def corpus_elements():
+    elements = []
+    for path in sorted(glob.glob(os.path.join(BENCH_DIR, 'corpus', 'deals', '*.html'))):
+        root = etree.fromstring(open(path, 'rb').read(), etree.HTMLParser())
+        elements.extend(root.iter())
+    return elements
+
+
+def report(name, before, after, number):
+    t_before = timeit.timeit(before, number=number) / number
+    t_after = timeit.timeit(after, number=number) / number
+    print "{:24s} before {:8.3f} ms  after {:8.3f} ms  speedup x{:.2f}".format(
+        name, t_before * 1000, t_after * 1000, t_before / t_after)
+
+
+def main(number=5):
+    strings = random_strings()
+    elements = corpus_elements()
+    tags = [e for e in elements if len(e)]
+
+    assert [legacy_strip_white_spaces(s) for s in strings] == utils.strip_white_spaces_many(strings)
+    for with_tail in (False, True):
+        assert ([legacy_get_text(e, with_tail) for e in elements] ==
+                utils.get_texts(elements, with_tail)), with_tail
+    assert [legacy_extract_lines_from_tag(t) for t in tags] == utils.extract_lines_from_tags(tags)
+    assert ([legacy_extract_lines_from_tag(t, include_tags=('p', 'span')) for t in tags] ==
+            utils.extract_lines_from_tags(tags, include_tags=('p', 'span')))
+
+    report('strip_white_spaces',
+           lambda: [legacy_strip_white_spaces(s) for s in strings],
+           lambda: utils.strip_white_spaces_many(strings), number)
+    report('get_text',
+           lambda: [legacy_get_text(e) for e in elements],
+           lambda: utils.get_texts(elements), number)
+    report('extract_lines_from_tag',
+           lambda: [legacy_extract_lines_from_tag(t) for t in tags],
+           lambda: utils.extract_lines_from_tags(tags), number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+"""
+Transfer benchmark: bytes on the wire and time-to-tree of compressed, streamed parsing.
+
+Every document is fetched from the local HTTP stand-in (bench/standin.py),
+at an emulated link rate, in four modes:
+
+    identity    uncompressed body, read then parsed (fetch() then make_tree())
+    streamed    uncompressed body, fed to the parser as it arrives (parse())
+    gzip        gzip encoded body, read then parsed
+    gzip-stream gzip encoded body, decoded and fed to the parser as it arrives
+
+Reports the median time-to-tree and the bytes read per document, and checks
+that every mode gives the same tree.
+
+    bench/bench_transfer.py
+    bench/bench_transfer.py --rate 0 --repeat 20    # unlimited (loopback) rate
+
+"""
+import argparse
+import os
+import sys
+import time
+from lxml import etree
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(BENCH_DIR, '..')))
+sys.path.append(os.path.abspath(os.path.join(BENCH_DIR, '../libscraper')))
+
+from standin import StandIn
+from libscraper.metrics import HookSink
+from libscraper.scraper import Scraper
+
+DOCUMENTS = [
+    ('feed medium', lambda server: server.feed_url('medium')),
+    ('feed 3000 items', lambda server: server.feed_url('synthetic-3000')),
+    ('deal page', lambda server: server.deal_url('expired-large')),
+]
+
+MODES = [('identity', None, False), ('streamed', None, True), ('gzip', 'gzip', False), ('gzip-stream', 'gzip', True)]
+
+
+def time_to_tree(scrpr, url, stream):
+    """ Returns the Tree of url, the seconds taken to get it and the bytes read. """
+    wire = []
+    scrpr.metrics.add_sink(HookSink(on_count=lambda name, value, tags: name == 'bytes' and wire.append(value)))
+    parser = scrpr._base_parser()
+    start = time.time()
+    if stream:
+        tree = parser.parse(url)
+    else:
+        raw = parser.fetch(url)
+        tree = parser.make_tree(raw.body, url, code=raw.code, final_url=raw.url, content_type=raw.content_type)
+    elapsed = time.time() - start
+    return tree, elapsed, sum(wire)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transfer benchmark.')
+    parser.add_argument('--rate', type=float, default=4.0, help='emulated link rate in MB/s (0: unlimited)')
+    parser.add_argument('--repeat', type=int, default=5, help='fetches per document and mode')
+    args = parser.parse_args()
+
+    rate = args.rate * 1024 * 1024 or None
+    print "{:<18s}{:<13s}{:>12s}{:>14s}  {:s}".format('document', 'mode', 'median ms', 'wire bytes', 'tree')
+    for name, url_of in DOCUMENTS:
+        reference = None
+        for mode, encoding, stream in MODES:
+            server = StandIn(encoding=encoding, rate=rate).start()
+            try:
+                url = url_of(server)
+                times = []
+                for _ in range(args.repeat):
+                    scrpr = Scraper()
+                    tree, elapsed, wire = time_to_tree(scrpr, url, stream)
+                    times.append(elapsed * 1000)
+                    scrpr.session.close()
+                document = etree.tostring(tree._root).replace(server.base, '')
+            finally:
+                server.stop()
+            if reference is None:
+                reference = document
+            times.sort()
+            print "{:<18s}{:<13s}{:>12.1f}{:>14,d}  {:s}".format(
+                name, mode, times[len(times) // 2], wire, 'same' if document == reference else 'DIFFERENT')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/python
+"""
+Local HTTP stand-in for the Groupon servers, serving the benchmark corpus.
+
+    /feeds/<name>.xml                   fixed feed of bench/corpus/feeds
+    /feeds/synthetic-<count>.xml        generated feed of <count> items
+    /deals/<location>/<page>/<id>       deal page bench/corpus/deals/<page>.html
+
+Bodies are sent as is, unless the stand-in is created with encoding='gzip'
+(or 'deflate'): they are then encoded for requests accepting it. rate limits
+the transfer speed, to emulate network links.
+
+Running this module serves the corpus until interrupted, and (re)writes the
+fixed feeds with --write-feeds.
+
+The corpus is generated, not captured from the Groupon servers: the feeds of
+bench/corpus/feeds are synthetic_feed() output (fixed seed), and the deal
+pages follow the Groupon deal page layout the model reads, with made-up
+content.
+
+"""
+import BaseHTTPServer
+import SocketServer
+import argparse
+import datetime
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import zlib
+from xml.sax.saxutils import escape
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_DIR = os.path.join(BENCH_DIR, 'corpus')
+sys.path.append(os.path.abspath(os.path.join(BENCH_DIR, '..')))
+sys.path.append(os.path.abspath(os.path.join(BENCH_DIR, '../libscraper')))
+
+# Fixed feeds of bench/corpus/feeds (synthetic_feed() output): name -> number of items
+FEEDS = {'small': 10, 'medium': 250}
+
+LOCATIONS = ['london', 'manchester', 'birmingham', 'national-deal', 'london-special', 'events', 'groupon-getaways']
+MERCHANTS = ['Cafe Rouge', 'Pizza Express', 'Spa Retreat', 'City Cruises', 'Yoga Studio', 'Wine Tasting', 'Go Karting']
+OFFERS = ['Two-Course Meal', 'Full Day Pass', 'Three Massages', 'River Cruise', 'Ten Classes', 'Tasting for Two']
+
+
+def synthetic_feed(count, host='www.groupon.co.uk', seed=0):
+    """
+    Returns a Groupon RSS feed of count items, deals linking to host.
+    One item out of ten lists several offerings.
+
+    """
+    rnd = random.Random(seed)
+    start = datetime.datetime(2013, 1, 14, 9, 0, 0)
+    parts = ['<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0">\n<channel>\n<title>Groupon UK</title>\n']
+    for i in range(count):
+        rel_id = 100000 + i
+        location = rnd.choice(LOCATIONS)
+        merchant = rnd.choice(MERCHANTS)
+        offer = rnd.choice(OFFERS)
+        slug = re.sub(r'\W+', '-', merchant.lower())
+        pubdate = (start + datetime.timedelta(minutes=7 * i)).strftime('%a, %d %b %Y %H:%M:%S GMT')
+        if i % 10 == 9:
+            description = ''.join(
+                '<ul><a href="http://{:s}/deals/{:s}/{:s}-{:d}/{:d}?utm=feed">{:s} {:d}</a><br/> {:s} \xc2\xa0offer {:d}</ul>'.format(
+                    host, rnd.choice(LOCATIONS), slug, j, rel_id * 10 + j, offer, j, merchant, j)
+                for j in range(rnd.randint(2, 4)))
+        else:
+            description = '<p>{:s} at {:s} &amp; more, \xc2\xa0up to {:d}% off</p>'.format(offer, merchant, rnd.randint(30, 80))
+        parts.append(
+            '<item>\n<title>{:s}: {:s}</title>\n<link>http://{:s}/deals/{:s}/{:s}/{:d}?utm=feed</link>\n'
+            '<pubDate>{:s}</pubDate>\n<description>{:s}</description>\n</item>\n'.format(
+                escape(merchant), escape(offer), host, location, slug, rel_id, pubdate, escape(description)))
+    parts.append('</channel>\n</rss>\n')
+    return ''.join(parts)
+
+
+def write_feeds():
+    path = os.path.join(CORPUS_DIR, 'feeds')
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for name, count in sorted(FEEDS.items()):
+        with open(os.path.join(path, name + '.xml'), 'wb') as f:
+            f.write(synthetic_feed(count))
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1 # one write per response
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        # Avoids Nagle / delayed ACK stalls on keep-alive connections
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    feed_re = re.compile(r'^/feeds/([\w-]+)\.xml$')
+    deal_re = re.compile(r'^/deals/[\w-]+/([\w-]+)/\d+$')
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        m = self.feed_re.match(path)
+        if m is not None:
+            body = self.server.feed(m.group(1))
+            return self.reply(body, 'application/rss+xml; charset=utf-8')
+        m = self.deal_re.match(path)
+        if m is not None:
+            body = self.server.page(m.group(1))
+            return self.reply(body, 'text/html; charset=utf-8')
+        self.reply(None, 'text/html')
+
+    def reply(self, body, content_type):
+        if body is None:
+            body = '<html><body>Not Found</body></html>'
+            self.send_response(404)
+        else:
+            self.send_response(200)
+        encoding = self.server.encoding
+        if encoding is not None and encoding in self.headers.get('Accept-Encoding', ''):
+            body = self.server.encode(body)
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        rate = self.server.rate
+        if rate is None:
+            return self.wfile.write(body)
+        self.wfile.flush()
+        chunk = max(1, int(rate / 100)) # 10 ms slices
+        for i in range(0, len(body), chunk):
+            self.connection.sendall(body[i:i + chunk])
+            time.sleep(0.01)
+
+
+class StandIn(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded HTTP server serving the corpus, in a background thread.
+
+        -- port     listening port on 127.0.0.1 (0 picks a free port)
+        -- encoding Content-Encoding of the bodies ('gzip', 'deflate', or None: sent as is)
+        -- rate     transfer rate in bytes per second (None: unlimited)
+
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, port=0, encoding=None, rate=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.encoding = encoding
+        self.rate = rate
+        self.port = self.server_address[1]
+        self.base = 'http://127.0.0.1:{:d}'.format(self.port)
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _load(self, key, loader):
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = loader()
+            return self._cache[key]
+
+    def encode(self, body):
+        """ Returns body encoded with the stand-in encoding (cached). """
+        def compress():
+            if self.encoding == 'gzip':
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            else:
+                compressor = zlib.compressobj(6)
+            return compressor.compress(body) + compressor.flush()
+        return self._load((self.encoding, body), compress)
+
+    def feed(self, name):
+        m = re.match(r'^synthetic-(\d+)$', name)
+        if m is not None:
+            return self._load(name, lambda: synthetic_feed(int(m.group(1)), host=self.base[7:]))
+        path = os.path.join(CORPUS_DIR, 'feeds', name + '.xml')
+        if not os.path.isfile(path):
+            return None
+        return self._load(name, lambda: open(path, 'rb').read())
+
+    def page(self, name):
+        path = os.path.join(CORPUS_DIR, 'deals', name + '.html')
+        if not os.path.isfile(path):
+            return None
+        return self._load('deals/' + name, lambda: open(path, 'rb').read())
+
+    def feed_url(self, name):
+        return '{:s}/feeds/{:s}.xml'.format(self.base, name)
+
+    def deal_url(self, page, location='london', rel_id=12345):
+        return '{:s}/deals/{:s}/{:s}/{:d}'.format(self.base, location, page, rel_id)
+
+    def target(self):
+        """ Returns a fixtures Target routing the stand-in URLs to the Groupon model. """
+        from libscraper import fixtures
+        groupon = [t for t in fixtures.targets if t._parser == 'groupon'][0]
+        base = re.escape(self.base)
+        return fixtures.Target(site=groupon._site_name, locale=groupon._locale, category=groupon._category,
+                               parser='groupon', locmap=groupon._locmap,
+                               patterns=[base + r'/feeds/[\w-]+\.xml', base + r'/deals/([\w-]+)/[\w-]+/(\d+)'])
+
+    def install(self):
+        """ Adds the stand-in target to the fixtures targets. """
+        from libscraper import fixtures
+        fixtures.targets.append(self.target())
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark corpus HTTP stand-in.')
+    parser.add_argument('--port', type=int, default=8800, help='listening port')
+    parser.add_argument('--encoding', type=str, default='none', choices=['gzip', 'deflate', 'none'],
+                        help='Content-Encoding of the bodies (default: none)')
+    parser.add_argument('--rate', type=int, help='transfer rate in bytes per second (default: unlimited)')
+    parser.add_argument('--write-feeds', action='store_true', help='(re)write the fixed feeds and exit')
+    args = parser.parse_args()
+    if args.write_feeds:
+        write_feeds()
+        return
+    server = StandIn(args.port, encoding=None if args.encoding == 'none' else args.encoding, rate=args.rate)
+    print "Serving bench/corpus on {:s}".format(server.base)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Locale address cleaners.
+
+A cleaner converts the raw lines of an address to a dictionary holding the
+address lines, postcode and phone number. Cleaners are registered per locale,
+their regular expressions being compiled once at registration:
+
+    register(GBAddressCleaner('en_GB'))
+    addresses = clean_addresses([lines, lines], 'en_GB')
+
+A locale without a cleaner of its own uses the cleaner of its country
+(e.g. a cleaner registered for 'en_GB' also cleans 'cy_GB' addresses).
+
+"""
+import re
+import threading
+
+
+def unicodestr(s):
+    return s.decode('utf-8') if isinstance(s, str) else s
+
+
+class AddressCleaner(object):
+    """
+    Base locale cleaner.
+    Subclasses compile their patterns in compile() and implement extract().
+
+        -- locale   locale code, e.g. 'en_GB'
+
+    """
+
+    def __init__(self, locale):
+        self.locale = locale
+        self.compile()
+
+    @property
+    def country(self):
+        return self.locale[3:].lower()
+
+    def compile(self):
+        pass
+
+    def extract(self, address_lines):
+        """ Returns {'address': [lines], 'postcode': postcode, 'phone': phone}, postcode and phone being optional. """
+        raise NotImplementedError
+
+    def clean(self, address_lines, locale=None):
+        """
+        Converts a list of address fields to a dictionary.
+        Clean addresses MUST have a valid postcode: {} is returned otherwise.
+
+        """
+        address = self.extract(address_lines)
+        postcode = address.get('postcode')
+        if postcode is None:
+            return {} # No postcode
+        lines = []
+        for line in address['address']:
+            addr = line.replace(postcode, '').strip()
+            if addr:
+                lines.append(addr)
+        address['address'] = lines
+        address['locale'] = locale or self.locale
+        return address
+
+
+class GBAddressCleaner(AddressCleaner):
+
+    def compile(self):
+        outcode_pattern = '[A-PR-UWYZ]([0-9]{1,2}|([A-HIK-Y][0-9](|[0-9]|[ABEHMNPRVWXY]))|[0-9][A-HJKSTUW])'
+        incode_pattern = '[0-9][ABD-HJLNP-UW-Z]{2}'
+        self.postcode_re = re.compile(r'(GIR 0AA|%s %s)' % (outcode_pattern, incode_pattern))
+        self.space_re = re.compile(r' *(%s)$' % incode_pattern)
+        self.white_spaces_re = re.compile(r'\s\s*')
+        self.phone_digits_re = re.compile(r'([0-9]{11})')
+        self.invalid_values_re = re.compile("|".join(["None",]))
+        self.excluded_values_re = re.compile(r'[\|\.]|{:s}'.format("|".join(["Returns:"])))
+
+    def extract(self, address_lines):
+        clean_address = {'address': []}
+        for line in address_lines:
+            m = self.phone_digits_re.search(self.white_spaces_re.sub('', line))
+            if m:
+                clean_address['phone'] = u'{!s}'.format(m.group(1))
+                continue
+            postcode = self.space_re.sub(r' \1', line.upper().strip())
+            m = self.postcode_re.search(postcode)
+            if m:
+                clean_address['postcode'] = u'{!s}'.format(m.group(1))
+            value = self.excluded_values_re.sub('', line).strip()
+            if not self.invalid_values_re.search(value):
+                clean_address['address'].append(unicodestr(value))
+        return clean_address
+
+
+class FRAddressCleaner(AddressCleaner):
+
+    def compile(self):
+        self.phone_digits_re = re.compile(r'^0\d(\s|\.)?(\d{2}(\s|\.)?){3}\d{2}$')
+        self.phone_separators_re = re.compile(r'(\.|\s)')
+        self.postal_code_re = re.compile(r'(\d{5})')
+        self.excluded_values_re = re.compile(r'[\|\.]')
+        self.invalid_values_re = re.compile("|".join(["None",]))
+
+    def extract(self, address_lines):
+        clean_address = {'address': []}
+        for line in address_lines:
+            value = unicodestr(line)
+            phone_value = self.phone_separators_re.sub('', value)
+            m = self.phone_digits_re.search(phone_value)
+            if m:
+                clean_address['phone'] = u' '.join(phone_value[i:i + 2] for i in range(0, 10, 2))
+                continue
+            m = self.postal_code_re.search(value)
+            if m:
+                clean_address['postcode'] = m.group(1)
+            value = self.excluded_values_re.sub('', value).strip()
+            if not self.invalid_values_re.search(value):
+                clean_address['address'].append(value)
+        return clean_address
+
+
+_cleaners = {}
+_countries = {}
+_lock = threading.Lock()
+
+def register(cleaner):
+    """ Registers a cleaner for its locale (and for its country, unless already taken). """
+    with _lock:
+        _cleaners[cleaner.locale] = cleaner
+        _countries.setdefault(cleaner.country, cleaner)
+
+def get_cleaner(locale):
+    """ Returns the cleaner of a locale, or None. """
+    cleaner = _cleaners.get(locale)
+    if cleaner is None:
+        cleaner = _countries.get(locale[3:].lower())
+    return cleaner
+
+def clean_address_lines(address_lines, locale):
+    """ Cleans one address; returns {} when the locale has no cleaner or the address no postcode. """
+    cleaner = get_cleaner(locale)
+    if cleaner is None:
+        return {}
+    return cleaner.clean(address_lines, locale)
+
+def clean_addresses(addresses, locale):
+    """ Batch version of clean_address_lines: cleans a list of address lines lists. """
+    cleaner = get_cleaner(locale)
+    if cleaner is None:
+        return [{} for _ in addresses]
+    return [cleaner.clean(address_lines, locale) for address_lines in addresses]
+
+
+register(GBAddressCleaner('en_GB'))
+register(FRAddressCleaner('fr_FR'))
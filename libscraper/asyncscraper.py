@@ -0,0 +1,228 @@
+"""
+Asynchronous Deal Scraper.
+
+AsyncScraper is the non-blocking counterpart of Scraper: pages are downloaded
+on an event loop, while lxml parsing and model extraction run on worker threads.
+Its methods return Future objects; run() drives the loop until they complete.
+
+    scrpr = AsyncScraper()
+    deals = scrpr.run([scrpr.get_deal(url) for url in urls])
+
+URLs are matched to models through the same fixtures targets and
+BaseParser.urlinfo as Scraper, so existing plugins work under both engines.
+
+"""
+import collections
+import time
+import urllib2
+import urlparse
+from compression import ACCEPT_ENCODING
+from eventloop import EventLoop, ThreadExecutor, HTTPFetch, Future, chain, gather
+from exceptions import TargetPatternNotFound, ElementMissing
+from parser import BaseParser, RawResponse, Tree, random_user_agent
+from scraper import Scraper
+from transport import UrllibTransport
+
+
+def resolved(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class AsyncScraper(Scraper):
+
+    def __init__(self, verbose=False, session=None, workers=4, max_connections=100, timeout=10, max_redirects=5,
+                 transport=None):
+        """
+            -- workers          number of threads used for parsing and model extraction
+            -- max_connections  maximum number of concurrent connections
+            -- timeout          request timeout (in seconds)
+            -- max_redirects    maximum number of redirects followed per request
+            -- transport        pages are downloaded on the event loop, unless another transport
+                                than the default one is given (e.g. transport.ReplayTransport):
+                                parse() then goes through it on the worker threads
+
+        """
+        Scraper.__init__(self, verbose=verbose, session=session, transport=transport)
+        self.loop = EventLoop()
+        self.executor = ThreadExecutor(self.loop, workers=workers)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self._active = 0
+        self._waiting = collections.deque()
+
+    def run(self, futures):
+        """
+        Runs the event loop until the given Future, or list of Futures, completes.
+        Returns the result (or list of results; failed Futures give their exception).
+
+        """
+        if isinstance(futures, Future):
+            return self.loop.run_until_complete(futures)
+        return self.loop.run_until_complete(gather(futures))
+
+    def close(self):
+        self.executor.shutdown()
+        self.loop.close()
+
+    def fetch(self, url, headers=None, proxy=None):
+        """
+        Downloads a URL without blocking; returns a Future of eventloop.HTTPResult.
+        Network errors are raised as urllib2.URLError.
+
+        """
+        future = Future()
+        self._waiting.append((future, url, headers, proxy, self.max_redirects))
+        self._start_waiting()
+        return future
+
+    def _start_waiting(self):
+        while self._waiting and self._active < self.max_connections:
+            self._active += 1
+            future, url, headers, proxy, redirects = self._waiting.popleft()
+            try:
+                self._connect(future, url, headers, proxy, redirects)
+            except Exception as e:
+                # Raised before the request was under way (e.g. a bad port): fail it like a network error
+                self._fetched(future, headers, proxy, redirects, None, urllib2.URLError(e))
+
+    def _connect(self, future, url, headers, proxy, redirects):
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            return self._fetched(future, headers, proxy, redirects, None, urllib2.URLError('unknown url type: {:s}'.format(parts.scheme)))
+        via_proxy = proxy is not None and parts.scheme == 'http'
+        if via_proxy:
+            host, port = proxy.rsplit(':', 1)
+            port = int(port)
+        else:
+            host = parts.hostname
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+        request_headers = [('Accept-encoding', ACCEPT_ENCODING)]
+        request_headers.extend((header['name'], header['value']) for header in headers or [])
+        request_headers.append(('User-agent', random_user_agent()))
+        attempt = Future()
+        attempt.add_done_callback(lambda f: self._fetched(future, headers, proxy, redirects, f, None))
+
+        def start(addresses):
+            try:
+                HTTPFetch(self.loop, attempt, url, addresses[0], request_headers, proxy=via_proxy,
+                          timeout=self.timeout, ssl_context=self.session._ssl_context, max_body_size=self.max_body_size)
+            except Exception as e:
+                if not attempt.done():
+                    attempt.set_exception(urllib2.URLError(e))
+
+        addresses = self.session.dns.cached(host, port)
+        if addresses:
+            start(addresses)
+        else:
+            # Host resolution is blocking: run it on a worker thread
+            resolving = chain(self.executor.submit(self.session.dns.resolve, host, port), start)
+
+            def on_resolved(f):
+                if f.exception() is not None and not attempt.done():
+                    attempt.set_exception(urllib2.URLError(f.exception()))
+            resolving.add_done_callback(on_resolved)
+
+    def _fetched(self, future, headers, proxy, redirects, attempt, error):
+        self._active -= 1
+        if error is None:
+            error = attempt.exception()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            result = attempt.result()
+            location = result.headers.get('location')
+            if result.code in (301, 302, 303, 307) and location and redirects > 0:
+                self._waiting.appendleft((future, urlparse.urljoin(result.url, location), headers, proxy, redirects - 1))
+            else:
+                future.set_result(result)
+        self._start_waiting()
+
+    def _fetch_tree(self, url, headers=None, proxy=None):
+        """
+        Returns a Future of either an eventloop.HTTPResult to be parsed, or an error Tree,
+        following the same status conventions as BaseParser.parse.
+
+        """
+        start = time.time() if self.metrics.enabled else None
+
+        def to_tree(f):
+            e = f.exception()
+            if start is not None:
+                self.metrics.timing('fetch', time.time() - start)
+            if e is None:
+                result = f.result()
+                if start is not None:
+                    self.metrics.count('bytes', len(result.body))
+                if result.code >= 400:
+                    self.metrics.error('HTTPError')
+                    return Tree(url=url, code=result.code, msg=result.reason)
+                return result
+            self.logger.debug(repr(e))
+            self.metrics.error(type(e).__name__)
+            if isinstance(e, urllib2.URLError):
+                return Tree(url=url, code=404, msg=e.reason)
+            return Tree(url=url, msg=e)
+
+        fetched = Future()
+        self.fetch(url, headers, proxy).add_done_callback(lambda f: fetched.set_result(to_tree(f)))
+        return fetched
+
+    def _extract(self, url, parser, method, headers=None, proxy=None, **kwargs):
+        """ Fetches url, then runs parser.<method>(url) on a worker thread against the fetched response. """
+        def run(fetched):
+            if isinstance(fetched, Tree):
+                parser.prefetch(url, fetched)
+            elif fetched is not None:
+                parser.prefetch(url, RawResponse(fetched.body, code=fetched.code, url=fetched.url,
+                                                 content_type=fetched.headers.get('content-type'),
+                                                 content_encoding=fetched.headers.get('content-encoding')))
+            if method == 'parse':
+                return parser.parse(url, headers, proxy, **kwargs)
+            with self.metrics.span(method, model=parser.name):
+                return getattr(parser, method)(url, **kwargs)
+        if not isinstance(self.transport, UrllibTransport):
+            return self.executor.submit(run, None) # fetched by the transport, on the worker thread
+        return chain(self._fetch_tree(url, headers, proxy), lambda fetched: self.executor.submit(run, fetched))
+
+    def parse(self, url, headers=None, proxy=None, ptype=None):
+        """ Returns a Future of Tree object """
+        parser = BaseParser(self)
+        return self._extract(url, parser, 'parse', headers, proxy, ptype=ptype)
+
+    def get_deals(self, url):
+        """ Returns a Future of the list of deals found at url """
+        if not url:
+            return resolved([])
+        try:
+            parser = self.model(url)
+        except TargetPatternNotFound:
+            self.logger.debug(' >> Target Pattern Not Found')
+            return resolved([])
+        return self._extract(url, parser, 'get_deals')
+
+    def get_deal(self, url=''):
+        """ Returns a Future of the deal found at url """
+        if not url:
+            return resolved({})
+        try:
+            parser = self.model(url)
+        except TargetPatternNotFound:
+            self.logger.debug(' >> Target Pattern Not Found')
+            return resolved({})
+
+        def on_done(f):
+            e = f.exception()
+            if isinstance(e, ElementMissing):
+                self.logger.debug(' >> Element Missing - {:s}'.format(e))
+                deal.set_result({})
+            elif e is not None:
+                deal.set_exc_info(f._exc_info)
+            else:
+                deal.set_result(f.result())
+
+        deal = Future()
+        self._extract(url, parser, 'get_deal').add_done_callback(on_done)
+        return deal
@@ -0,0 +1,167 @@
+"""
+Batch processing of URLs on a bounded thread pool.
+
+Results are yielded as (url, result) tuples in completion order.
+When processing a URL raises an exception, the exception instance is yielded
+as its result and the rest of the batch carries on.
+
+A URL whose host already has per_host calls running is set aside, and the
+worker takes the next URL: runs of same-host URLs do not hold workers idle
+while other hosts wait. Set-aside URLs are run by the workers of their host,
+as their current calls complete. At most backlog URLs are set aside; past
+that, workers wait for a free slot of the host.
+
+"""
+import collections
+import Queue
+import threading
+import urlparse
+
+
+def host_of(url):
+    return urlparse.urlsplit(url).netloc.lower()
+
+
+class HostLimiter(object):
+    """ Limits the number of concurrent jobs per host. """
+
+    def __init__(self, per_host=4):
+        self.per_host = per_host
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        host = host_of(url)
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host)
+                self._semaphores[host] = semaphore
+        return semaphore
+
+
+def run_batch(func, urls, workers=8, per_host=4, backlog=None):
+    """
+    Applies func to each URL on a pool of worker threads.
+
+        -- func         callable taking a URL
+        -- urls         iterable of URLs (consumed lazily)
+        -- workers      number of worker threads
+        -- per_host     maximum number of concurrent calls per host
+        -- backlog      maximum number of URLs set aside while their host is busy (default: 16 per worker)
+
+    """
+    workers = max(1, workers)
+    per_host = max(1, per_host)
+    backlog = workers * 16 if backlog is None else backlog
+    tasks = Queue.Queue(maxsize=workers * 2)
+    results = Queue.Queue()
+    stop = threading.Event()
+    done = object()
+    hosts = HostSlots(per_host, backlog)
+
+    def feed():
+        try:
+            for url in urls:
+                while not stop.is_set():
+                    try:
+                        tasks.put(url, timeout=0.1)
+                        break
+                    except Queue.Full:
+                        pass
+                if stop.is_set():
+                    break
+        finally:
+            for _ in range(workers):
+                tasks.put(done)
+
+    def work():
+        while True:
+            url = tasks.get()
+            if url is done:
+                results.put(done)
+                return
+            if stop.is_set() or not hosts.claim(url, stop):
+                continue
+            # The slot of the host is kept for the URLs set aside meanwhile
+            while url is not None:
+                try:
+                    result = func(url)
+                except Exception as e:
+                    result = e
+                results.put((url, result))
+                url = hosts.release(url, stop)
+
+    threads = [threading.Thread(target=feed)]
+    threads.extend([threading.Thread(target=work) for _ in range(workers)])
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        running = workers
+        while running:
+            # Use a timeout so KeyboardInterrupt is delivered to the main thread
+            try:
+                item = results.get(timeout=1)
+            except Queue.Empty:
+                continue
+            if item is done:
+                running -= 1
+            else:
+                yield item
+    finally:
+        # Workers skip the remaining tasks and exit
+        stop.set()
+
+
+class HostSlots(object):
+    """
+    Per-host call slots of run_batch, and the URLs set aside while their host has none free.
+
+        -- per_host     slots per host
+        -- backlog      maximum number of URLs set aside
+
+    """
+
+    def __init__(self, per_host, backlog):
+        self.per_host = per_host
+        self.backlog = backlog
+        self._active = {}
+        self._waiting = {}  # host -> deque of URLs set aside
+        self._count = 0     # URLs set aside
+        self._cond = threading.Condition()
+
+    def claim(self, url, stop):
+        """
+        Takes a slot of the host of url: returns True, or False when url was set aside instead
+        (to be returned by the release() of a call of the same host).
+
+        """
+        host = host_of(url)
+        with self._cond:
+            while not stop.is_set():
+                if self._active.get(host, 0) < self.per_host:
+                    self._active[host] = self._active.get(host, 0) + 1
+                    return True
+                if self._count < self.backlog:
+                    self._waiting.setdefault(host, collections.deque()).append(url)
+                    self._count += 1
+                    return False
+                self._cond.wait(0.1)
+            return False
+
+    def release(self, url, stop):
+        """ Returns the next URL set aside for the host of url, keeping its slot, or frees the slot and returns None. """
+        host = host_of(url)
+        with self._cond:
+            waiting = self._waiting.get(host)
+            if waiting and not stop.is_set():
+                url = waiting.popleft()
+                if not waiting:
+                    del self._waiting[host]
+                self._count -= 1
+                return url
+            self._active[host] -= 1
+            self._cond.notify_all()
+            return None
@@ -0,0 +1,315 @@
+"""
+On-disk HTTP response cache.
+
+Responses are stored under a cache directory, keyed by normalized URL.
+Fresh entries (Cache-Control max-age / Expires) are served without any
+network access; stale entries are revalidated with If-None-Match and
+If-Modified-Since, a 304 response being answered from the stored body.
+The total size of the cache is bounded, least recently used entries
+being evicted first.
+
+The cache plugs into a Session:
+
+    session = Session(cache=ResponseCache('/var/cache/scraper'))
+    scrpr = Scraper(session=session)
+
+"""
+import calendar
+import email.utils
+import hashlib
+import httplib
+import json
+import os
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+from collections import OrderedDict
+from cStringIO import StringIO
+from libscraper.utils import bytestr
+
+
+def normalize_url(url):
+    """ Lowercases scheme and host, drops default ports and fragments, and sorts the querystring. """
+    parts = urlparse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = '{:s}:{:d}'.format(host, parts.port)
+    query = urllib.urlencode(sorted(urlparse.parse_qsl(parts.query, keep_blank_values=True)))
+    return urlparse.urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+def parse_http_date(value):
+    parsed = email.utils.parsedate(value) if value else None
+    if parsed is None:
+        return None
+    return calendar.timegm(parsed)
+
+
+def cache_control(headers):
+    directives = {}
+    for directive in headers.get('cache-control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+
+def freshness_lifetime(headers, now):
+    """ Returns the timestamp until which a response is fresh (None when it must be revalidated). """
+    directives = cache_control(headers)
+    if 'no-cache' in directives:
+        return None
+    for name in ('s-maxage', 'max-age'):
+        if name in directives:
+            try:
+                return now + int(directives[name])
+            except ValueError:
+                return None
+    expires = parse_http_date(headers.get('expires'))
+    if expires is not None:
+        date = parse_http_date(headers.get('date')) or now
+        return now + (expires - date)
+    return None
+
+
+class CacheEntry(object):
+
+    def __init__(self, url, code, msg, headers, size, stored, expires):
+        self.url = bytestr(url)
+        self.code = code
+        self.msg = bytestr(msg)
+        self.headers = [bytestr(line) for line in headers]
+        self.size = size
+        self.stored = stored
+        self.expires = expires
+
+    def is_fresh(self, now=None):
+        return self.expires is not None and self.expires > (now or time.time())
+
+    def validators(self):
+        validators = {}
+        headers = dict((line.split(':', 1)[0].strip().lower(), line.split(':', 1)[1].strip())
+                       for line in self.headers if ':' in line)
+        if 'etag' in headers:
+            validators['If-None-Match'] = headers['etag']
+        if 'last-modified' in headers:
+            validators['If-Modified-Since'] = headers['last-modified']
+        return validators
+
+    def todict(self):
+        return dict(self.__dict__)
+
+
+class ResponseCache(urllib2.BaseHandler):
+    """
+    urllib2 handler caching GET responses on disk.
+
+        -- path         cache directory (created if missing)
+        -- max_size     maximum total size of cached bodies, in bytes
+
+    """
+
+    handler_order = 400
+
+    def __init__(self, path, max_size=100 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._counters = {
+            'hits': 0,
+            'revalidated': 0,
+            'misses': 0,
+            'stored': 0,
+            'evicted': 0,
+            'bytes_saved': 0,
+        }
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._load()
+
+    # Storage
+
+    def _file(self, key, ext):
+        return os.path.join(self.path, '{:s}.{:s}'.format(key, ext))
+
+    def key(self, url):
+        return hashlib.sha1(normalize_url(url)).hexdigest()
+
+    def _load(self):
+        """ Rebuilds the LRU index from the cache directory, oldest access first. """
+        found = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.meta'):
+                continue
+            key = name[:-5]
+            try:
+                with open(self._file(key, 'meta')) as f:
+                    entry = CacheEntry(**json.load(f))
+                atime = os.path.getmtime(self._file(key, 'meta'))
+            except (IOError, OSError, ValueError, TypeError):
+                continue
+            found.append((atime, key, entry))
+        for atime, key, entry in sorted(found):
+            self._entries[key] = entry
+            self._size += entry.size
+
+    def get(self, url):
+        """ Returns (entry, body) for url, or (None, None). """
+        key = self.key(url)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None, None
+            self._entries[key] = entry # mark as most recently used
+        try:
+            with open(self._file(key, 'body'), 'rb') as f:
+                body = f.read()
+            os.utime(self._file(key, 'meta'), None)
+        except (IOError, OSError):
+            self._discard(key)
+            return None, None
+        return entry, body
+
+    def put(self, url, entry, body=None):
+        """ Stores entry (and body, when given) for url, evicting old entries past max_size. """
+        key = self.key(url)
+        if body is not None:
+            entry.size = len(body)
+            if entry.size > self.max_size:
+                return
+            tmp = self._file(key, 'body.tmp')
+            with open(tmp, 'wb') as f:
+                f.write(body)
+            os.rename(tmp, self._file(key, 'body'))
+        tmp = self._file(key, 'meta.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(entry.todict(), f)
+        os.rename(tmp, self._file(key, 'meta'))
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous.size
+            self._entries[key] = entry
+            self._size += entry.size
+            while self._size > self.max_size and len(self._entries) > 1:
+                old_key, old_entry = self._entries.popitem(last=False)
+                self._size -= old_entry.size
+                evicted.append(old_key)
+            self._counters['evicted'] += len(evicted)
+            if body is not None:
+                self._counters['stored'] += 1
+        for old_key in evicted:
+            self._remove_files(old_key)
+
+    def _discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry.size
+        self._remove_files(key)
+
+    def _remove_files(self, key):
+        for ext in ('meta', 'body'):
+            try:
+                os.remove(self._file(key, ext))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries.keys())
+            self._entries.clear()
+            self._size = 0
+        for key in keys:
+            self._remove_files(key)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def stats(self):
+        """ Returns hit/miss counters, bytes saved and current cache size. """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+            stats['size'] = self._size
+        lookups = stats['hits'] + stats['revalidated'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits'] + stats['revalidated']) / lookups if lookups else 0.0
+        return stats
+
+    # urllib2 handler
+
+    def _response(self, entry, body):
+        headers = httplib.HTTPMessage(StringIO(''.join(entry.headers)))
+        response = urllib.addinfourl(StringIO(body), headers, entry.url)
+        response.code = entry.code
+        response.msg = entry.msg
+        response.from_cache = True
+        return response
+
+    def default_open(self, req):
+        """ Serves fresh entries without touching the network. """
+        if req.get_method() != 'GET':
+            return None
+        entry, body = self.get(req.get_full_url())
+        if entry is None:
+            self._count('misses')
+            return None
+        if entry.is_fresh():
+            self._count('hits')
+            self._count('bytes_saved', len(body))
+            return self._response(entry, body)
+        req._cache_revalidating = True
+        if not req.has_header('If-none-match') and not req.has_header('If-modified-since'):
+            for name, value in entry.validators().items():
+                req.add_unredirected_header(name, value)
+        return None
+
+    def http_response(self, req, response):
+        """ Stores cacheable 200 responses. """
+        if req.get_method() != 'GET' or response.code != 200 or getattr(response, 'from_cache', False):
+            return response
+        if getattr(req, '_cache_revalidating', False):
+            self._count('misses') # the stored entry was outdated
+        headers = response.info()
+        directives = cache_control(headers)
+        if 'no-store' in directives or 'private' in directives:
+            return response
+        body = response.read()
+        response.close()
+        now = time.time()
+        entry = CacheEntry(
+            url=response.geturl(),
+            code=response.code,
+            msg=response.msg,
+            headers=list(headers.headers),
+            size=len(body),
+            stored=now,
+            expires=freshness_lifetime(headers, now),
+        )
+        try:
+            self.put(req.get_full_url(), entry, body)
+        except (IOError, OSError, ValueError):
+            pass # Uncacheable (e.g. non UTF-8 headers) or disk error: serve the response anyway
+        return self._response(entry, body)
+
+    https_response = http_response
+
+    def http_error_304(self, req, fp, code, msg, headers):
+        """ Answers a successful revalidation from the stored body. """
+        entry, body = self.get(req.get_full_url())
+        if entry is None:
+            return None
+        fp.read()
+        fp.close()
+        entry.expires = freshness_lifetime(headers, time.time())
+        self.put(req.get_full_url(), entry)
+        self._count('revalidated')
+        self._count('bytes_saved', len(body))
+        return self._response(entry, body)
@@ -0,0 +1,133 @@
+"""
+HTTP content codings: gzip and deflate response bodies, decoded as they are read.
+
+ACCEPT_ENCODING is sent with every request (see BaseParser and AsyncScraper);
+bodies are decoded according to their Content-Encoding header:
+
+    decoder = compression.decoder(response.info().getheader('Content-Encoding'))
+    while True:
+        data = response.read(16384)
+        if not data:
+            break
+        process(decoder.decompress(data))
+    process(decoder.flush())
+
+Bodies are kept as sent on the wire by the transports, the cache and the
+archives: they are decoded by the parser only.
+
+"""
+import zlib
+
+ACCEPT_ENCODING = 'gzip, deflate'
+
+
+class DecodingError(ValueError):
+    """ A body could not be decoded: unsupported Content-Encoding (only gzip and deflate are requested), or corrupt data. """
+    pass
+
+
+class Decoder(object):
+    """
+    Incremental decoder of a gzip or deflate body.
+
+        -- encoding     'gzip' or 'deflate' (Content-Encoding header value)
+
+    """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            # deflate should be a zlib stream, but some servers send raw deflate data:
+            # the stream format is told from its first two bytes
+            self._zlib = None
+        self._head = ''
+
+    def _start(self, data):
+        data = self._head + data
+        if len(data) < 2:
+            self._head = data
+            return None
+        self._head = ''
+        first, second = ord(data[0]), ord(data[1])
+        if first & 0x0f == 8 and (first * 256 + second) % 31 == 0:
+            self._zlib = zlib.decompressobj(zlib.MAX_WBITS)
+        else:
+            self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+        return data
+
+    def decompress(self, data):
+        """ Returns the decoded data available after data was read. """
+        if self._zlib is None:
+            data = self._start(data)
+            if data is None:
+                return ''
+        try:
+            output = self._zlib.decompress(data)
+            # gzip bodies may hold several members, decoded one after the other
+            while self.encoding == 'gzip' and self._zlib.unused_data:
+                data = self._zlib.unused_data
+                self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                output += self._zlib.decompress(data)
+        except zlib.error as e:
+            raise DecodingError('Invalid {:s} body: {!s}'.format(self.encoding, e))
+        return output
+
+    def flush(self):
+        """ Returns the remaining decoded data, once the whole body was read. """
+        if self._zlib is None:
+            return ''  # empty (or single byte) deflate body
+        try:
+            return self._zlib.flush()
+        except zlib.error as e:
+            raise DecodingError('Invalid {:s} body: {!s}'.format(self.encoding, e))
+
+
+def decoder(content_encoding):
+    """
+    Returns a Decoder for a Content-Encoding header value, or None for identity bodies.
+    Raises DecodingError for unsupported codings.
+
+    """
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        return None
+    if encoding in ('gzip', 'x-gzip'):
+        return Decoder('gzip')
+    if encoding == 'deflate':
+        return Decoder('deflate')
+    raise DecodingError('Unsupported Content-Encoding: {:s}'.format(content_encoding))
+
+
+class DecodedStream(object):
+    """
+    File-like object reading the decoded body of a response (e.g. for lxml.etree.iterparse).
+
+        -- fileobj      response, read from as its body arrives
+        -- decoder      Decoder of the response Content-Encoding
+
+    """
+
+    def __init__(self, fileobj, decoder, chunk_size=16384):
+        self.fileobj = fileobj
+        self.decoder = decoder
+        self.chunk_size = chunk_size
+        self._buffer = ''
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            data = self.fileobj.read(self.chunk_size)
+            if data:
+                self._buffer += self.decoder.decompress(data)
+            else:
+                self._buffer += self.decoder.flush()
+                self._eof = True
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        self.fileobj.close()
@@ -0,0 +1,259 @@
+"""
+Deal records.
+
+Models return Deal objects: compact records (__slots__, no per-instance dict)
+holding the fields documented in BaseParser.get_deals and get_deal. The
+site/locale/location/category values are interned, and the hashid is kept
+as a binary SHA256 digest (deal.digest), converted to hex on demand.
+
+Deals still behave as dictionaries of their set fields (deal['title'],
+deal.get('link'), deal.items(), dict(deal.items()), deal.todict(), ...);
+fields other than the documented ones are kept in an extra dictionary.
+
+DealBatch stores large result sets column by column.
+
+"""
+import array
+import binascii
+import calendar
+import datetime
+
+# Documented fields: BaseParser.get_deals, then BaseParser.get_deal
+DEALS_FIELDS = ('title', 'headline', 'link', 'rel_id', 'pubDate', 'site', 'locale', 'location', 'category', 'hashid')
+DEAL_FIELDS = ('status', 'merchant', 'merchant_url', 'addresses', 'rrp', 'price', 'volume')
+FIELDS = DEALS_FIELDS + DEAL_FIELDS
+
+# Fields taking a small set of values
+INTERNED_FIELDS = ('site', 'locale', 'location', 'category')
+
+_interned = {}
+
+def intern_value(value):
+    """ Returns a shared instance of value (works for unicode values, unlike intern()). """
+    return _interned.setdefault(value, value)
+
+
+class Deal(object):
+
+    __slots__ = tuple(name for name in FIELDS if name != 'hashid') + ('digest', '_extra')
+
+    def __init__(self, *args, **kwargs):
+        self._extra = None
+        self.update(*args, **kwargs)
+
+    # Field access
+
+    def __getitem__(self, name):
+        if name == 'hashid':
+            try:
+                digest = self.digest
+            except AttributeError:
+                raise KeyError(name)
+            return None if digest is None else binascii.hexlify(digest)
+        if name in FIELDS:
+            try:
+                return getattr(self, name)
+            except AttributeError:
+                raise KeyError(name)
+        if self._extra is None:
+            raise KeyError(name)
+        return self._extra[name]
+
+    def __setitem__(self, name, value):
+        if name == 'hashid':
+            self.digest = None if value is None else binascii.unhexlify(value)
+        elif name in INTERNED_FIELDS:
+            setattr(self, name, intern_value(value))
+        elif name in FIELDS:
+            setattr(self, name, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[name] = value
+
+    def __delitem__(self, name):
+        if name in FIELDS:
+            try:
+                delattr(self, 'digest' if name == 'hashid' else name)
+            except AttributeError:
+                raise KeyError(name)
+        elif self._extra is None:
+            raise KeyError(name)
+        else:
+            del self._extra[name]
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    has_key = __contains__
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [name for name in FIELDS if name in self]
+        if self._extra:
+            keys.extend(self._extra.keys())
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[name] for name in self.keys()]
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def update(self, *args, **kwargs):
+        for other in args + (kwargs,):
+            items = other.items() if hasattr(other, 'items') else other
+            for name, value in items:
+                self[name] = value
+
+    def todict(self):
+        return dict(self.items())
+
+    @property
+    def hashid(self):
+        """ Hexadecimal hashid (None when not set). """
+        return self.get('hashid')
+
+    # Comparison, pickling
+
+    def __eq__(self, other):
+        if isinstance(other, (Deal, dict)):
+            return self.todict() == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return (tuple((name, getattr(self, name)) for name in self.__slots__[:-1] if hasattr(self, name)), self._extra)
+
+    def __setstate__(self, state):
+        values, self._extra = state
+        for name, value in values:
+            if name in INTERNED_FIELDS:
+                value = intern_value(value)
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return 'Deal({!r})'.format(self.todict())
+
+
+MISSING = object()
+
+def to_timestamp(value):
+    return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+
+def from_timestamp(value):
+    return datetime.datetime.utcfromtimestamp(value)
+
+
+class DealBatch(object):
+    """
+    Columnar container of deals.
+    Interned fields are stored as codes into a per-batch table of values, digests in a single
+    bytearray (32 bytes per deal), publication dates as timestamps; Deal objects are rebuilt
+    on access.
+
+    """
+
+    def __init__(self, deals=()):
+        self._size = 0
+        self._codes = dict((name, array.array('I')) for name in INTERNED_FIELDS)
+        self._values = dict((name, [MISSING]) for name in INTERNED_FIELDS)
+        self._index = dict((name, {MISSING: 0}) for name in INTERNED_FIELDS)
+        self._digests = bytearray()
+        self._has_digest = bytearray()
+        self._dates = array.array('d')
+        self._columns = dict((name, []) for name in FIELDS
+                             if name not in INTERNED_FIELDS and name not in ('hashid', 'pubDate'))
+        self._extra = []
+        self.extend(deals)
+
+    def __len__(self):
+        return self._size
+
+    def append(self, deal):
+        for name in INTERNED_FIELDS:
+            value = deal.get(name, MISSING)
+            index = self._index[name]
+            code = index.get(value)
+            if code is None:
+                code = index[value] = len(self._values[name])
+                self._values[name].append(value)
+            self._codes[name].append(code)
+        hashid = deal.get('hashid')
+        digest = None if hashid is None else getattr(deal, 'digest', None) or binascii.unhexlify(hashid)
+        self._has_digest.append(0 if digest is None else 1)
+        self._digests.extend(digest or '\0' * 32)
+        date = deal.get('pubDate')
+        self._dates.append(float('nan') if date is None else to_timestamp(date))
+        for name, column in self._columns.items():
+            column.append(deal.get(name, MISSING))
+        extra = deal._extra if isinstance(deal, Deal) else dict((k, v) for k, v in deal.items() if k not in FIELDS)
+        self._extra.append(extra or None)
+        self._size += 1
+
+    def extend(self, deals):
+        for deal in deals:
+            self.append(deal)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._size
+        if not 0 <= i < self._size:
+            raise IndexError(i)
+        deal = Deal()
+        for name in INTERNED_FIELDS:
+            value = self._values[name][self._codes[name][i]]
+            if value is not MISSING:
+                setattr(deal, name, value)
+        if self._has_digest[i]:
+            deal.digest = bytes(self._digests[i * 32:(i + 1) * 32])
+        if self._dates[i] == self._dates[i]: # not NaN
+            deal.pubDate = from_timestamp(self._dates[i])
+        for name, column in self._columns.items():
+            if column[i] is not MISSING:
+                setattr(deal, name, column[i])
+        if self._extra[i]:
+            deal._extra = dict(self._extra[i])
+        return deal
+
+    def __iter__(self):
+        for i in xrange(self._size):
+            yield self[i]
+
+    def column(self, name):
+        """ Returns the values of a field (None where unset). """
+        if name in INTERNED_FIELDS:
+            values = self._values[name]
+            return [None if values[code] is MISSING else values[code] for code in self._codes[name]]
+        if name == 'hashid':
+            return [binascii.hexlify(self._digests[i * 32:(i + 1) * 32]) if self._has_digest[i] else None
+                    for i in xrange(self._size)]
+        if name == 'pubDate':
+            return [from_timestamp(value) if value == value else None for value in self._dates]
+        return [None if value is MISSING else value for value in self._columns[name]]
+
+    def todicts(self):
+        return [deal.todict() for deal in self]
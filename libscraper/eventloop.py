@@ -0,0 +1,445 @@
+"""
+Non-blocking I/O primitives used by the AsyncScraper engine.
+
+The EventLoop drives asyncore dispatchers from a single thread and resolves
+Future objects. CPU-bound work (lxml parsing, model extraction) is handed to a
+ThreadExecutor so the loop is never stalled by it; executor results are
+delivered back on the loop thread.
+
+"""
+import asyncore
+import collections
+import heapq
+import itertools
+import os
+import select
+import socket
+import sys
+import threading
+import time
+import urllib2
+import urlparse
+import Queue
+from exceptions import BodyTooLarge
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+
+class Future(object):
+    """ Result of an asynchronous operation. """
+
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        if not self._done:
+            raise RuntimeError('Future is not done')
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self):
+        if not self._done:
+            raise RuntimeError('Future is not done')
+        return self._exc_info[1] if self._exc_info is not None else None
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exc, tb=None):
+        self._finish(None, (type(exc), exc, tb))
+
+    def set_exc_info(self, exc_info):
+        self._finish(None, exc_info)
+
+    def _finish(self, result, exc_info):
+        with self._lock:
+            if self._done:
+                return
+            self._result = result
+            self._exc_info = exc_info
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+
+def chain(future, func):
+    """
+    Returns a Future resolved with func(result) once future is done.
+    When func returns a Future, its outcome is forwarded instead.
+
+    """
+    chained = Future()
+
+    def forward(f):
+        if f._exc_info is not None:
+            chained.set_exc_info(f._exc_info)
+        else:
+            chained.set_result(f._result)
+
+    def on_done(f):
+        if f._exc_info is not None:
+            chained.set_exc_info(f._exc_info)
+            return
+        try:
+            result = func(f._result)
+        except Exception:
+            chained.set_exc_info(sys.exc_info())
+            return
+        if isinstance(result, Future):
+            result.add_done_callback(forward)
+        else:
+            chained.set_result(result)
+
+    future.add_done_callback(on_done)
+    return chained
+
+
+def gather(futures):
+    """ Returns a Future resolved with the list of results (or exceptions) of all futures. """
+    futures = list(futures)
+    gathered = Future()
+    results = [None] * len(futures)
+    pending = [len(futures)]
+    if not futures:
+        gathered.set_result([])
+
+    def collect(index):
+        def on_done(f):
+            results[index] = f.exception() if f._exc_info is not None else f._result
+            pending[0] -= 1
+            if not pending[0]:
+                gathered.set_result(results)
+        return on_done
+
+    for index, future in enumerate(futures):
+        future.add_done_callback(collect(index))
+    return gathered
+
+
+class _Waker(asyncore.file_dispatcher):
+    """ Wakes up the loop when callbacks are scheduled from other threads. """
+
+    def __init__(self, map):
+        self._rfd, self._wfd = os.pipe()
+        asyncore.file_dispatcher.__init__(self, self._rfd, map=map)
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        try:
+            self.recv(4096)
+        except (OSError, socket.error):
+            pass
+
+    def wake(self):
+        try:
+            os.write(self._wfd, 'x')
+        except OSError:
+            pass
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        os.close(self._wfd)
+
+
+class EventLoop(object):
+
+    def __init__(self):
+        self.map = {}
+        self._ready = collections.deque()
+        self._timers = []
+        self._sequence = itertools.count()
+        self._waker = _Waker(self.map)
+        self._use_poll = hasattr(select, 'poll')
+
+    def call_soon(self, callback, *args):
+        self._ready.append((callback, args))
+
+    def call_soon_threadsafe(self, callback, *args):
+        self._ready.append((callback, args))
+        self._waker.wake()
+
+    def call_later(self, delay, callback, *args):
+        """ Schedules callback after delay seconds; returns a handle for cancel(). """
+        handle = [time.time() + delay, next(self._sequence), callback, args, False]
+        heapq.heappush(self._timers, handle)
+        return handle
+
+    def cancel(self, handle):
+        handle[4] = True
+
+    def run_once(self, timeout=1.0):
+        if self._ready:
+            timeout = 0
+        elif self._timers:
+            timeout = max(0, min(timeout, self._timers[0][0] - time.time()))
+        asyncore.loop(timeout=timeout, use_poll=self._use_poll, map=self.map, count=1)
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            handle = heapq.heappop(self._timers)
+            if not handle[4]:
+                self._ready.append((handle[2], handle[3]))
+        for _ in range(len(self._ready)):
+            callback, args = self._ready.popleft()
+            callback(*args)
+
+    def run_until_complete(self, future):
+        while not future.done():
+            self.run_once()
+        return future.result()
+
+    def close(self):
+        self._waker.close()
+        for dispatcher in self.map.values():
+            dispatcher.close()
+
+
+class ThreadExecutor(object):
+    """ Runs callables on a pool of worker threads, resolving Futures on the loop thread. """
+
+    def __init__(self, loop, workers=4):
+        self.loop = loop
+        self.workers = workers
+        self._tasks = Queue.Queue()
+        self._threads = []
+
+    def submit(self, func, *args):
+        if not self._threads:
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        future = Future()
+        self._tasks.put((future, func, args))
+        return future
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            future, func, args = task
+            try:
+                result = func(*args)
+            except Exception:
+                self.loop.call_soon_threadsafe(future.set_exc_info, sys.exc_info())
+            else:
+                self.loop.call_soon_threadsafe(future.set_result, result)
+
+    def shutdown(self):
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+class HTTPResult(object):
+
+    def __init__(self, code, reason, url, headers, body):
+        self.code = code
+        self.reason = reason
+        self.url = url
+        self.headers = headers
+        self.body = body
+
+
+class HTTPFetch(asyncore.dispatcher):
+    """
+    Non-blocking HTTP/1.1 GET over a single connection.
+    Connections are not reused: every request is sent with "Connection: close".
+    The future is resolved with an HTTPResult, or a urllib2.URLError on network errors
+    (exceptions.BodyTooLarge when the body exceeds max_body_size bytes).
+
+    """
+
+    def __init__(self, loop, future, url, address, headers, proxy=False, timeout=10, ssl_context=None,
+                 max_body_size=None):
+        asyncore.dispatcher.__init__(self, map=loop.map)
+        self.loop = loop
+        self.future = future
+        self.url = url
+        parts = urlparse.urlsplit(url)
+        self._host = parts.hostname
+        self._https = parts.scheme == 'https'
+        self._ssl_context = ssl_context
+        self._handshaking = False
+        selector = url if proxy else (urlparse.urlunsplit(('', '', parts.path or '/', parts.query, '')))
+        lines = ['GET {:s} HTTP/1.1'.format(selector), 'Host: {:s}'.format(parts.netloc)]
+        for name, value in headers:
+            lines.append('{:s}: {:s}'.format(name, value))
+        lines.append('Connection: close')
+        self._outbuf = '\r\n'.join(lines) + '\r\n\r\n'
+        self._inbuf = ''
+        self._status = None
+        self._headers = {}
+        self._length = None
+        self._chunked = False
+        self._body = []
+        self._received = 0
+        self._max_body_size = max_body_size
+        self._timer = loop.call_later(timeout, self._on_timeout)
+        af, socktype, proto, canonname, sa = address
+        try:
+            self.create_socket(af, socktype)
+            self.connect(sa)
+        except socket.error as e:
+            self._fail(e)
+
+    # asyncore callbacks
+
+    def writable(self):
+        return not self.connected or self._handshaking or bool(self._outbuf)
+
+    def handle_connect(self):
+        if self._https:
+            if ssl is None:
+                return self._fail('SSL is not available')
+            context = self._ssl_context or ssl.create_default_context()
+            self.socket = context.wrap_socket(self.socket, server_hostname=self._host,
+                                              do_handshake_on_connect=False)
+            self._handshaking = True
+
+    def _handshake(self):
+        try:
+            self.socket.do_handshake()
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return
+        self._handshaking = False
+
+    def handle_write(self):
+        if self._handshaking:
+            return self._handshake()
+        try:
+            sent = self.socket.send(self._outbuf)
+        except socket.error as e:
+            if ssl is not None and isinstance(e, ssl.SSLWantWriteError):
+                return
+            return self._fail(e)
+        self._outbuf = self._outbuf[sent:]
+
+    def handle_read(self):
+        if self._handshaking:
+            return self._handshake()
+        try:
+            data = self.socket.recv(65536)
+        except socket.error as e:
+            if ssl is not None and isinstance(e, ssl.SSLWantReadError):
+                return
+            return self._fail(e)
+        if not data:
+            return self.handle_close()
+        # SSL records may leave decrypted data buffered, invisible to poll()
+        while ssl is not None and isinstance(self.socket, ssl.SSLSocket) and self.socket.pending():
+            data += self.socket.recv(self.socket.pending())
+        self._feed(data)
+
+    def handle_close(self):
+        if self.future.done():
+            return self.close()
+        if self._status is not None and self._length is None and not self._chunked:
+            # Body delimited by connection close
+            return self._complete()
+        self._fail('connection closed before the response was complete')
+
+    def handle_error(self):
+        self._fail(sys.exc_info()[1])
+
+    # Response parsing
+
+    def _feed(self, data):
+        self._inbuf += data
+        if self._status is None:
+            end = self._inbuf.find('\r\n\r\n')
+            if end < 0:
+                return
+            head, self._inbuf = self._inbuf[:end], self._inbuf[end + 4:]
+            lines = head.split('\r\n')
+            try:
+                version, code, reason = (lines[0].split(' ', 2) + [''])[:3]
+                self._status = (int(code), reason)
+            except ValueError:
+                return self._fail('bad status line: {!r}'.format(lines[0]))
+            for line in lines[1:]:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    self._headers[name.strip().lower()] = value.strip()
+            if self._status[0] in (204, 304) or 100 <= self._status[0] < 200:
+                self._length = 0
+            elif 'chunked' in self._headers.get('transfer-encoding', '').lower():
+                self._chunked = True
+            elif 'content-length' in self._headers:
+                self._length = int(self._headers['content-length'])
+            if self._max_body_size and self._length and self._length > self._max_body_size:
+                return self._too_large()
+        if self._chunked:
+            self._feed_chunked()
+        else:
+            self._body.append(self._inbuf)
+            self._received += len(self._inbuf)
+            self._inbuf = ''
+            if self._max_body_size and self._received > self._max_body_size:
+                return self._too_large()
+            if self._length is not None and self._received >= self._length:
+                self._complete()
+
+    def _feed_chunked(self):
+        while True:
+            end = self._inbuf.find('\r\n')
+            if end < 0:
+                return
+            size = int(self._inbuf[:end].split(';', 1)[0].strip() or '0', 16)
+            if size == 0:
+                return self._complete()
+            if self._max_body_size and self._received + size > self._max_body_size:
+                return self._too_large()
+            if len(self._inbuf) < end + 2 + size + 2:
+                return
+            start = end + 2
+            self._body.append(self._inbuf[start:start + size])
+            self._inbuf = self._inbuf[start + size + 2:]
+            self._received += size
+
+    def _complete(self):
+        self.loop.cancel(self._timer)
+        self.close()
+        code, reason = self._status
+        self.future.set_result(HTTPResult(code, reason, self.url, self._headers, ''.join(self._body)))
+
+    def _fail(self, reason):
+        self.loop.cancel(self._timer)
+        if self.socket is not None:  # None when the socket could not be created
+            self.close()
+        if not self.future.done():
+            self.future.set_exception(urllib2.URLError(reason))
+
+    def _too_large(self):
+        self.loop.cancel(self._timer)
+        self.close()
+        if not self.future.done():
+            self.future.set_exception(BodyTooLarge('body exceeds {:d} bytes'.format(self._max_body_size)))
+
+    def _on_timeout(self):
+        if not self.future.done():
+            self._fail(socket.timeout('timed out'))
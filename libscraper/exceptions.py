@@ -6,6 +6,13 @@ Exceptions specific to the Scraper library.
 class TargetPatternNotFound(Exception):
     pass
 
+class FetchError(Exception):
+    """ A page could not be fetched; tree is the error Tree returned by the parser (tree._code, tree._msg). """
+
+    def __init__(self, tree):
+        Exception.__init__(self, '{:d} {!s}'.format(tree._code, tree._msg))
+        self.tree = tree
+
 class ElementMissing(Exception):
     """
     ElementMissing should provide the relevent information associated with the element.
@@ -20,3 +27,7 @@ class ElementMissing(Exception):
 
     """
     pass
+
+class BodyTooLarge(Exception):
+    """ A response body exceeded the scraper's max_body_size: it was dropped without being read further. """
+    pass
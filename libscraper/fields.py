@@ -0,0 +1,149 @@
+"""
+Declarative field extraction for models.
+
+A model declares the fields it extracts as a SelectorPlan, compiled once when
+the plan is built instead of on every call:
+
+    plan = SelectorPlan([
+        Field('merchant', '//h2[@class="subHeadline"]', pick='first', process=utils.get_text),
+        Field('price', '//div[@id="buy"]/span[@class="price"]', process=utils.extract_float_from_tag),
+    ])
+    values = plan.extract(tree._root, url)
+
+Expressions starting with a simple anchor (//tag[@attr="value"]) are resolved
+together: a single walk over the tree collects the anchors of all fields, and
+the rest of each expression is evaluated from its anchor. Other expressions are
+evaluated as compiled etree.XPath objects.
+
+A required field without any matching element raises ElementMissing('<url>:<label>:<xpath>').
+
+"""
+import re
+from lxml import etree
+from libscraper.exceptions import ElementMissing
+
+anchor_re = re.compile(r'^//([a-zA-Z][\w-]*)\[@([\w-]+)="([^"]*)"\](?:/(?!/)(.+))?$')
+
+
+class Field(object):
+    """
+        -- name         key of the value in the extracted dictionary
+        -- xpath        XPath expression
+        -- required     raise ElementMissing when no element matches
+        -- pick         'first' or 'last' matching element
+        -- process      callable applied to the element (the element itself is returned otherwise)
+        -- default      value of a missing optional field (omitted when None)
+        -- context      name of the field whose element the expression is evaluated against
+        -- label        data name used in ElementMissing messages (defaults to name)
+
+    """
+
+    def __init__(self, name, xpath, required=True, pick='last', process=None, default=None, context=None, label=None):
+        self.name = name
+        self.xpath = xpath
+        self.required = required
+        self.pick = pick
+        self.process = process
+        self.default = default
+        self.context = context
+        self.label = name if label is None else label
+        self._compiled = etree.XPath(xpath)
+        self.anchor = None
+        self._rest = None
+        m = anchor_re.match(xpath)
+        if m is not None:
+            # Absolute expressions do not depend on their context
+            self.anchor = m.group(1, 2, 3)
+            if m.group(4):
+                self._rest = etree.XPath(m.group(4))
+
+    def _pick(self, found):
+        if not found:
+            return None
+        return found[0] if self.pick == 'first' else found[-1]
+
+    def select(self, element, anchors=None):
+        """
+        Returns the matching element, or None.
+
+            -- anchors  elements matching the field anchor, in document order (see SelectorPlan.collect)
+
+        """
+        if anchors is None or self.anchor is None:
+            return self._pick(self._compiled(element))
+        found = anchors.get(self.anchor, [])
+        if self._rest is None:
+            return self._pick(found)
+        if len(found) == 1:
+            return self._pick(self._rest(found[0]))
+        if not found:
+            return None
+        # Several anchors: let XPath order the results
+        return self._pick(self._compiled(element))
+
+
+class SelectorPlan(object):
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self._fields = dict((field.name, field) for field in self.fields)
+        self.names = [field.name for field in self.fields]
+
+    def collect(self, root, fields):
+        """ Single walk over the document, collecting the anchor elements of the given fields. """
+        wanted = {}
+        for field in fields:
+            if field.anchor is not None:
+                tag, attr, value = field.anchor
+                wanted.setdefault(tag, {}).setdefault(attr, set()).add(value)
+        anchors = {}
+        if not wanted:
+            return anchors
+        for element in root.getroottree().iter(*wanted.keys()):
+            for attr, values in wanted[element.tag].items():
+                value = element.get(attr)
+                if value in values:
+                    anchors.setdefault((element.tag, attr, value), []).append(element)
+        return anchors
+
+    def extract(self, root, url, names=None):
+        """
+        Extracts fields from a tree, in declaration order.
+
+            -- names    fields to extract (defaults to all); context fields are selected as needed
+
+        """
+        names = self.names if names is None else names
+        needed = set()
+        for name in names:
+            while name is not None and name not in needed:
+                needed.add(name)
+                name = self._fields[name].context
+        anchors = self.collect(root, [field for field in self.fields if field.name in needed])
+        elements = {}
+        values = {}
+
+        def select(field):
+            if field.name not in elements:
+                if field.context is not None:
+                    context = select(self._fields[field.context])
+                else:
+                    context = root
+                element = None if context is None else field.select(context, anchors)
+                if element is None and field.required:
+                    raise ElementMissing('{:s}:{:s}:{:s}'.format(url, field.label, field.xpath))
+                elements[field.name] = element
+            return elements[field.name]
+
+        for field in self.fields:
+            if field.name not in names:
+                continue
+            element = select(field)
+            if element is None:
+                if field.default is not None:
+                    values[field.name] = field.default
+            elif field.process is not None:
+                values[field.name] = field.process(element)
+            else:
+                values[field.name] = element
+        return values
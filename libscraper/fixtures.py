@@ -12,20 +12,34 @@ to actual location name and/or category, using the following format:
         ...
     }
 
+Optional rate limits (rate: requests per second, burst: requests allowed at
+once) are applied per host by the crawl scheduler (see scheduler.py).
+
+Patterns are compiled on first use (when routing a URL of their host, see
+router.py).
+
 """
 import re
 
 class Target(object):
 
-    def __init__(self, site='', locale='', category='', parser='', patterns=[], locmap={}):
+    def __init__(self, site='', locale='', category='', parser='', patterns=[], locmap={}, rate=None, burst=None):
         self._site_name = site
         self._locale = locale
         self._category = category
         self._parser = parser
-        self._patterns = []
-        for pattern in patterns:
-            self._patterns.append(re.compile(r"{:s}".format(pattern)))
+        self._sources = [r"{:s}".format(pattern) for pattern in patterns]
+        self._compiled = None
         self._locmap = locmap
+        self._rate = rate
+        self._burst = burst
+
+    @property
+    def _patterns(self):
+        """ Compiled patterns """
+        if self._compiled is None:
+            self._compiled = [re.compile(source) for source in self._sources]
+        return self._compiled
 
     def get_info(self):
         return {
@@ -59,7 +73,9 @@ targets = [
             'manchester-special': {'location': 'Manchester', 'category': 'Special'},
             'events': {'location': 'National', 'category': 'Events'},
             'groupon-getaways': {'location': 'National', 'category': 'Getaways'},
-        }
+        },
+        rate=2.0,
+        burst=5
     ),
 
 
@@ -0,0 +1,48 @@
+"""
+Lazy imports: modules loaded on first attribute access.
+
+    etree = lazy_import('lxml.etree')
+    ...
+    etree.fromstring(data)      # lxml.etree is imported here
+
+Keeps heavy dependencies (lxml, urllib2, hashlib, pkg_resources) out of the
+import of modules needing them in some code paths only, e.g. so that
+"bin/scraper show-targets" does not load the parsing and network machinery.
+Attributes are cached on the proxy once read: later accesses cost an
+instance dictionary lookup.
+
+Modules defining classes based on a lazily imported module's classes, or
+reading its attributes at import time, load it at once.
+
+"""
+import importlib
+import sys
+
+
+class LazyModule(object):
+    """ Proxy of a module, imported when one of its attributes is first read. """
+
+    def __init__(self, name):
+        self._lazy_name = name
+        self._lazy_module = None
+
+    def _load(self):
+        if self._lazy_module is None:
+            self._lazy_module = importlib.import_module(self._lazy_name)
+        return self._lazy_module
+
+    def __getattr__(self, name):
+        value = getattr(self._load(), name)
+        self.__dict__[name] = value
+        return value
+
+    def __repr__(self):
+        return '<lazy module {!r}{:s}>'.format(self._lazy_name, '' if self._lazy_module is None else ' (loaded)')
+
+
+def lazy_import(name):
+    """ Returns the module name if already imported, else a LazyModule importing it on first use. """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
@@ -0,0 +1,183 @@
+"""
+Instrumentation: timings, byte counts and error counts.
+
+Every Scraper has a Metrics instance (scrpr.metrics), disabled until a sink
+is added. Sinks receive:
+
+    timing(name, seconds, tags)     phase durations: 'connect', 'read', 'parse', 'extract'
+                                    ('fetch' for AsyncScraper downloads), and the total
+                                    duration of model methods ('get_deal', ...)
+    count(name, value, tags)        'bytes' (read, parsed) and 'errors' (tagged with the error type:
+                                    HTTPError, URLError, ElementMissing, XMLSyntaxError, fallback, ...)
+
+    sink = MemorySink()
+    scrpr.metrics.add_sink(sink)
+    scrpr.get_deal(url)
+    sink.snapshot()
+
+The connect/read/parse timings of a parse() call are also attached to the
+returned Tree (tree._timings). When no sink is registered, instrumented code
+only tests metrics.enabled.
+
+"""
+import threading
+import time
+
+
+class Span(object):
+    """ Time spent in a model method call; phases recorded during the call are subtracted from 'extract'. """
+
+    def __init__(self, metrics, name, tags):
+        self.metrics = metrics
+        self.name = name
+        self.tags = tags
+        self.phases = 0.0
+
+    def __enter__(self):
+        self.metrics._stack().append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        elapsed = time.time() - self.start
+        self.metrics._stack().pop()
+        self.metrics.timing(self.name, elapsed, **self.tags)
+        self.metrics.timing('extract', max(elapsed - self.phases, 0.0), method=self.name, **self.tags)
+        if exc_type is not None:
+            self.metrics.error(exc_type.__name__, method=self.name, **self.tags)
+        return False
+
+
+class NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+null_span = NullSpan()
+
+
+class Metrics(object):
+
+    def __init__(self):
+        self.sinks = []
+        self.enabled = False
+        self._local = threading.local()
+
+    def add_sink(self, sink):
+        """ Registers a sink (an object with timing() and count() methods, e.g. MemorySink or HookSink). """
+        self.sinks.append(sink)
+        self.enabled = True
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+        self.enabled = bool(self.sinks)
+
+    def _stack(self):
+        try:
+            return self._local.spans
+        except AttributeError:
+            self._local.spans = []
+            return self._local.spans
+
+    def timing(self, name, seconds, **tags):
+        if not self.enabled:
+            return
+        if name in ('connect', 'read', 'parse'):
+            for span in self._stack():
+                span.phases += seconds
+        for sink in self.sinks:
+            sink.timing(name, seconds, tags)
+
+    def count(self, name, value=1, **tags):
+        if not self.enabled:
+            return
+        for sink in self.sinks:
+            sink.count(name, value, tags)
+
+    def error(self, error_type, **tags):
+        """ Counts an error of the given type (an exception class name, or e.g. 'fallback'). """
+        self.count('errors', 1, type=error_type, **tags)
+
+    def span(self, name, **tags):
+        """ Returns a context manager timing a model method call. """
+        if not self.enabled:
+            return null_span
+        return Span(self, name, tags)
+
+
+class MemorySink(object):
+    """ Aggregates timings (calls, total, min, max) and counts in memory, per name and tags. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = {}
+        self.counts = {}
+
+    @staticmethod
+    def key(name, tags):
+        if not tags:
+            return name
+        return '{:s}[{:s}]'.format(name, ','.join('{:s}={!s}'.format(k, v) for k, v in sorted(tags.items())))
+
+    def timing(self, name, seconds, tags):
+        key = self.key(name, tags)
+        with self._lock:
+            stats = self.timings.get(key)
+            if stats is None:
+                self.timings[key] = {'calls': 1, 'total': seconds, 'min': seconds, 'max': seconds}
+            else:
+                stats['calls'] += 1
+                stats['total'] += seconds
+                stats['min'] = min(stats['min'], seconds)
+                stats['max'] = max(stats['max'], seconds)
+
+    def count(self, name, value, tags):
+        key = self.key(name, tags)
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'timings': dict((k, dict(v)) for k, v in self.timings.items()),
+                'counts': dict(self.counts),
+            }
+
+    def clear(self):
+        with self._lock:
+            self.timings.clear()
+            self.counts.clear()
+
+
+class HookSink(object):
+    """
+    Forwards metrics to callbacks.
+
+        -- on_timing    callable(name, seconds, tags)
+        -- on_count     callable(name, value, tags)
+
+    """
+
+    def __init__(self, on_timing=None, on_count=None):
+        self.on_timing = on_timing
+        self.on_count = on_count
+
+    def timing(self, name, seconds, tags):
+        if self.on_timing is not None:
+            self.on_timing(name, seconds, tags)
+
+    def count(self, name, value, tags):
+        if self.on_count is not None:
+            self.on_count(name, value, tags)
+
+
+class LoggerSink(HookSink):
+    """ Prints metrics through a utils.Logger (i.e. when the scraper is verbose). """
+
+    def __init__(self, logger):
+        HookSink.__init__(self,
+            on_timing=lambda name, seconds, tags: logger.debug(' -- {:s} {:.1f} ms {!s}'.format(name, seconds * 1000, tags)),
+            on_count=lambda name, value, tags: logger.debug(' -- {:s} {:d} {!s}'.format(name, value, tags)))
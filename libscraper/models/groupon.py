@@ -2,17 +2,40 @@
 Groupon (EU) Model.
 
 """
+import _strptime # datetime.strptime imports it lazily, which is not thread-safe (Python issue 7980)
 import datetime
 import re
 from lxml import etree
-from libscraper import utils
-from libscraper.parser import BaseParser
-from libscraper.exceptions import ElementMissing
+from libscraper import numeric, utils
+from libscraper.deal import Deal
+from libscraper.fields import Field, SelectorPlan
+from libscraper.parser import BaseParser, Tree
+
+def sales_volume(tag, locale=None):
+    return int(numeric.parse_tag(tag, locale))
+
 
 class Parser(BaseParser):
 
     name = 'Groupon (EU)'
 
+    deal_fields = SelectorPlan([
+        Field('status', '//input[@id="currentTimeLeft"]', required=False),
+        Field('contact', '//div[@class="merchantContact"]', label=''),
+        Field('merchant', '//h2[@class="subHeadline"]', context='contact', pick='first', process=utils.get_text),
+        Field('merchant_url', 'a', context='contact', required=False, process=lambda tag: tag.get('href')),
+        # price, savings and volume elements are read together, in the locale of the deal (see get_deal)
+        Field('price', '//div[@id="contentDealBuyBox"]/span[@class="price"]/span[@class="noWrap"]'),
+        Field('savings', '//div[@id="contentDealBuyBox"]/div[contains(@class, "savings")]/*[contains(@class, "_saving")]',
+              required=False, pick='first'),
+        Field('volume', '//span[@id="jDealSoldAmount"]', label='sales'),
+    ])
+
+    # Raw page tags of the status and volume fields (see get_deal_status)
+    status_tag_re = re.compile(r'<input\s+(?:[^>]*?\s)?id\s*=\s*["\']?currentTimeLeft(?:["\'\s/][^>]*)?>', re.I)
+    volume_tag_re = re.compile(r'<span\s+(?:[^>]*?\s)?id\s*=\s*["\']?jDealSoldAmount(?:["\'\s/][^>]*)?>', re.I)
+    span_end_re = re.compile(r'</span\s*>', re.I)
+
 
     def get_urlinfo(self, info):
         """ Map data from fixtures """
@@ -39,7 +62,7 @@ class Parser(BaseParser):
 
         """
         deals = []
-        tree = self.parse(url=url)
+        tree = self.parse(url=url, expect='XML')
         if tree._root is None:
             return [] # The parsing failed (usually caused by connection/network issues)
 
@@ -49,61 +72,101 @@ class Parser(BaseParser):
         if tree._code == 200:
             info = self.urlinfo(url)
             for item in tree._root.xpath('/rss/channel/item'):
-                title = utils.get_text(item.xpath('title')[0])
-                pubDate = utils.get_text(item.xpath('pubDate')[0])[:-4] # Remove ' GMT'
-                pubDate = datetime.datetime.strptime(pubDate, '%a, %d %b %Y %X')
-                link = utils.strip_qs(utils.get_text(item.xpath('link')[0]))
-                link_base = "/".join(link.split('/')[:-1])
-                description = etree.HTML(item.xpath('description')[0].text)
-                if len(description.xpath('//ul/a')) > 1:
-                    for itm in description.xpath('//ul'):
-                        deal = {}
-                        deal['title'] = utils.get_text(itm.xpath('a')[0])
-                        deal['headline'] = utils.get_text(itm.xpath('br')[0], with_tail=True)
-                        deal['link'] = utils.strip_qs(itm.xpath('a')[0].get('href'))
-                        info = self.urlinfo(deal['link'])
-                        deal['rel_id'] = info['rel_id']
-                        deal['pubDate'] = pubDate
-                        deal['site'] = info['site']
-                        deal['locale'] = info['locale']
-                        deal['location'] = info['location']
-                        deal['category'] = info['category']
-                        hashbag = [
-                            deal['title'],
-                            deal['headline'],
-                            deal['pubDate'],
-                            deal['rel_id'],
-                            deal['site'],
-                            deal['locale'],
-                            deal['location'],
-                            deal['category']
-                        ]
-                        deal['hashid'] = self.get_hash(hashbag)
-                        deals.append(deal)
-                else:
-                    deal = {}
-                    deal['title'] = title
-                    deal['headline'] = utils.get_text(description)
-                    deal['link'] = link
-                    info = self.urlinfo(link)
-                    deal['rel_id'] = info['rel_id']
-                    deal['pubDate'] = pubDate
-                    deal['site'] = info['site']
-                    deal['locale'] = info['locale']
-                    deal['location'] = info['location']
-                    deal['category'] = info['category']
-                    hashbag = [
-                        deal['title'],
-                        deal['headline'],
-                        deal['pubDate'],
-                        deal['rel_id'],
-                        deal['site'],
-                        deal['locale'],
-                        deal['location'],
-                        deal['category']
-                    ]
-                    deal['hashid'] = self.get_hash(hashbag)
+                deals.extend(self.__item_deals(item))
+        return deals
+
+
+    def iter_deals(self, url):
+        """
+        Streaming version of get_deals.
+        Feed items are parsed incrementally and discarded once their deals have been yielded.
+
+        """
+        for item in self.iterparse(url, tag='item'):
+            if item.getparent() is not None and item.getparent().tag == 'channel':
+                for deal in self.__item_deals(item):
+                    yield deal
+
+
+    def get_new_deals(self, url, store):
+        """
+        Incremental version of get_deals.
+        Feed items already processed (same raw content) are skipped before any extraction.
+
+        """
+        deals = []
+        for item in self.iterparse(url, tag='item'):
+            if item.getparent() is None or item.getparent().tag != 'channel':
+                continue
+            fingerprint = store.fingerprint(etree.tostring(item))
+            if store.seen_item(fingerprint):
+                continue
+            for deal in self.__item_deals(item):
+                if store.add_deal(deal):
                     deals.append(deal)
+            store.add_item(fingerprint)
+        store.commit()
+        return deals
+
+
+    def __item_deals(self, item):
+        """ Returns the deals listed in a RSS item. """
+        deals = []
+        title = utils.get_text(item.xpath('title')[0])
+        pubDate = utils.get_text(item.xpath('pubDate')[0])[:-4] # Remove ' GMT'
+        pubDate = datetime.datetime.strptime(pubDate, '%a, %d %b %Y %X')
+        link = utils.strip_qs(utils.get_text(item.xpath('link')[0]))
+        link_base = "/".join(link.split('/')[:-1])
+        description = etree.HTML(item.xpath('description')[0].text)
+        if len(description.xpath('//ul/a')) > 1:
+            for itm in description.xpath('//ul'):
+                deal = Deal()
+                deal['title'] = utils.get_text(itm.xpath('a')[0])
+                deal['headline'] = utils.get_text(itm.xpath('br')[0], with_tail=True)
+                deal['link'] = utils.strip_qs(itm.xpath('a')[0].get('href'))
+                info = self.urlinfo(deal['link'])
+                deal['rel_id'] = info['rel_id']
+                deal['pubDate'] = pubDate
+                deal['site'] = info['site']
+                deal['locale'] = info['locale']
+                deal['location'] = info['location']
+                deal['category'] = info['category']
+                hashbag = [
+                    deal['title'],
+                    deal['headline'],
+                    deal['pubDate'],
+                    deal['rel_id'],
+                    deal['site'],
+                    deal['locale'],
+                    deal['location'],
+                    deal['category']
+                ]
+                deal.digest = self.get_digest(hashbag)
+                deals.append(deal)
+        else:
+            deal = Deal()
+            deal['title'] = title
+            deal['headline'] = utils.get_text(description)
+            deal['link'] = link
+            info = self.urlinfo(link)
+            deal['rel_id'] = info['rel_id']
+            deal['pubDate'] = pubDate
+            deal['site'] = info['site']
+            deal['locale'] = info['locale']
+            deal['location'] = info['location']
+            deal['category'] = info['category']
+            hashbag = [
+                deal['title'],
+                deal['headline'],
+                deal['pubDate'],
+                deal['rel_id'],
+                deal['site'],
+                deal['locale'],
+                deal['location'],
+                deal['category']
+            ]
+            deal.digest = self.get_digest(hashbag)
+            deals.append(deal)
         return deals
 
 
@@ -113,55 +176,79 @@ class Parser(BaseParser):
         Groupon uses different URLs poiting to the same deal. The URL format defines the HTMLformat displayed.
         
         """
-        deal = {}
-        tree = self.parse(url=url)
+        deal = Deal()
+        tree = self.parse(url=url, expect='HTML')
         if tree._root is not None and tree._code == 200:
-            try:
-                tag = tree._root.xpath('//input[@id="currentTimeLeft"]').pop()
-                deal['status'] = 1
-            except IndexError: # Expired / Sold Out
-                deal['status'] = 0
+            if not self.deal_fields.extract(tree._root, url, ['status']):
+                deal['status'] = 0 # Expired / Sold Out
             else:
+                deal['status'] = 1
                 info = self.urlinfo(url)
-                try:
-                    tag = tree._root.xpath('//div[@class="merchantContact"]').pop()
-                except IndexError:
-                    raise ElementMissing('{:s}:://div[@class="merchantContact"]'.format(url))
-                else:
-                    try:
-                        deal['merchant'] = utils.get_text(tag.xpath('//h2[@class="subHeadline"]')[0])
-                    except IndexError:
-                        raise ElementMissing('{:s}:merchant://h2[@class="subHeadline"]'.format(url))
-                    else:
-                        try:
-                            deal['merchant_url'] = tag.xpath('a').pop().get('href')
-                        except IndexError:
-                            pass
-                        address = self.__extract_address_lines(tag, deal, info)
-                        if address:
-                            deal['addresses'] = [address]
-                try:
-                    tag = tree._root.xpath('//div[@id="contentDealBuyBox"]/span[@class="price"]/span[@class="noWrap"]').pop()
-                except IndexError:
-                    raise ElementMissing('{:s}:price://div[@id="contentDealBuyBox"]/span[@class="price"]/span[@class="noWrap"]'.format(url))
-                else:
-                    price = utils.extract_float_from_tag(tag)
-                    deal['price'] = price
-                    try:
-                        tag = tree._root.xpath('//div[@id="contentDealBuyBox"]/div[contains(@class, "savings")]/*[contains(@class, "_saving")]')[0]
-                        _savings = utils.extract_float_from_tag(tag)
-                    except IndexError:
-                        _savings = 0.0
-                    deal['rrp'] = price + _savings
-                    try:
-                        tag = tree._root.xpath('//span[@id="jDealSoldAmount"]').pop()
-                    except IndexError:
-                        raise ElementMissing('{:s}:sales://span[@id="jDealSoldAmount"]'.format(url))
-                    else:
-                        deal['volume'] = int(utils.extract_float_from_tag(tag))
+                values = self.deal_fields.extract(tree._root, url, self.deal_fields.names[1:])
+                deal['merchant'] = values['merchant']
+                if 'merchant_url' in values:
+                    deal['merchant_url'] = values['merchant_url']
+                address = self.__extract_address_lines(values['contact'], deal, info)
+                if address:
+                    deal['addresses'] = [address]
+                price, savings, volume = numeric.parse_tags(
+                    [values['price'], values.get('savings'), values['volume']], info['locale'])
+                deal['price'] = price
+                deal['rrp'] = price + savings
+                deal['volume'] = int(volume)
+        return deal
+
+
+    def get_deal_status(self, url):
+        """
+        Status and volume of a deal, read off the raw page: the document tree is not built,
+        and neither prices nor addresses are extracted.
+        Pages whose markers are not recognized go through get_deal.
+        Raises FetchError when the page cannot be fetched.
+
+        """
+        raw = self.fetch(url)
+        if isinstance(raw, Tree):
+            # An error, or a page prefetched as a Tree
+            self.prefetch(url, raw)
+            return BaseParser.get_deal_status(self, url)
+        deal = self.extract_deal_status(raw.body, url)
+        if deal is None:
+            self.prefetch(url, raw)
+            return BaseParser.get_deal_status(self, url)
         return deal
 
 
+    def extract_deal_status(self, body, url):
+        """ Returns the status and volume of a deal page body as a Deal, or None when its markers are not recognized. """
+        if not self.__find_tags(body, 'currentTimeLeft', self.status_tag_re):
+            return Deal(status=0) # Expired / Sold Out
+        spans = self.__find_tags(body, 'jDealSoldAmount', self.volume_tag_re)
+        if not spans:
+            return None
+        start, end = spans[-1]
+        close = self.span_end_re.search(body, end)
+        if close is None or '<span' in body[end:close.start()].lower():
+            return None
+        span = etree.fromstring(body[start:close.end()], self._lxml_parser('HTML')).find('.//span')
+        if span is None:
+            return None
+        return Deal(status=1, volume=sales_volume(span, self.urlinfo(url)['locale']))
+
+
+    def __find_tags(self, body, value, tag_re):
+        """ Returns the (start, end) offsets of the tags matching tag_re around the occurrences of an id value. """
+        tags = []
+        pos = body.find(value)
+        while pos >= 0:
+            start = body.rfind('<', 0, pos)
+            match = tag_re.match(body, start) if start >= 0 else None
+            if match is not None and match.end() > pos:
+                tags.append((start, match.end()))
+            pos = body.find(value, pos + len(value))
+        return tags
+
+
     def __extract_address_lines(self, tag, deal, info):
         raw_address = []
         for a in utils.extract_lines_from_tag(tag):
@@ -0,0 +1,226 @@
+"""
+Numbers parsing: prices, savings and sold amounts read off pages, per locale.
+
+A number format holds the separators of a locale, its patterns being compiled
+once at registration:
+
+    parse_number('1 025,50 EUR', 'fr_FR')           # 1025.5
+    parse_tags([price, savings, volume], 'en_GB')   # array('d', [1025.5, 24.5, 1234.0])
+
+Locales without a format of their own use the format of their country, and
+unknown (or None) locales the separators guessing of the original
+utils.extract_float_from_string: the number is split in up to three groups of
+digits, the last one being read as decimals when it holds at most two digits
+("1,234" is 1234.0, "12,50" and "12.50" are 12.5). Guessing fails on millions
+("1,234,567" is 1234.56) and on amounts with three decimals; explicit formats
+read them as written.
+
+Elements are read as utils.extract_float_from_tag always did: serialized with
+their tail, the &#13; &#160; &#163; &#8364; entities removed and tags replaced
+by spaces. '. ' is read as '.' (PoinX formats prices '10. 00').
+
+Batch versions (parse_numbers, parse_tags) return arrays of floats, their
+strings being matched in a single regular expression pass.
+
+"""
+import array
+import re
+import threading
+from libscraper.lazy import lazy_import
+from libscraper.utils import strip_white_spaces
+
+etree = lazy_import('lxml.etree')
+
+entities_re = re.compile('|'.join(re.escape(entity) for entity in ('&#13;', '&#160;', '&#163;', '&#8364;')))
+tags_re = re.compile(r'<.*?>')
+non_digits_re = re.compile(r'\D+')
+
+# Strings are joined with this separator (a character never found in page text) to be parsed in a single pass
+SEPARATOR = '\x00'
+
+
+class NumberFormat(object):
+    """
+    Explicit number format of a locale.
+
+        -- locale       locale code, e.g. 'en_GB'
+        -- decimal      decimal separator
+        -- thousands    thousands separators (unicode strings, matched in byte strings as UTF-8)
+
+    """
+
+    def __init__(self, locale, decimal, thousands):
+        self.locale = locale
+        self.decimal = decimal
+        self.thousands = thousands
+        self.compile()
+
+    @property
+    def country(self):
+        return self.locale[3:].lower()
+
+    def compile(self):
+        self._patterns = {}
+        for kind in (str, unicode):
+            thousands = '|'.join(re.escape(sep if kind is unicode else sep.encode('utf-8')) for sep in self.thousands)
+            number = kind(r'\b(\d{{1,3}}(?:(?:{:s})\d{{3}})+(?!\d)|\d+)(?:{:s}(\d+))?').format(
+                thousands, re.escape(self.decimal))
+            self._patterns[kind] = (re.compile(number), re.compile(self.record(number)))
+
+    def record(self, number):
+        """ Pattern matching a whole record of joined strings, number first (if any). """
+        return r'(?:[^\x00]*?' + number.replace(r'\D', r'[^\d\x00]') + r')?[^\x00]*\x00'
+
+    def value(self, groups):
+        """ Returns the float value of the groups of a number match. """
+        integer, decimals = groups
+        if integer is None:
+            return 0.0
+        if not integer.isdigit():
+            integer = non_digits_re.sub('', integer)
+        if not decimals:
+            return float(integer)
+        if len(decimals) > 2:
+            return float(integer + '.' + decimals)
+        return float(integer) + float(decimals) / (10.0, 100.0)[len(decimals) - 1] # as GuessFormat computes prices
+
+    def parse(self, data):
+        """ Returns the first number of a string (0.0 when there is none). """
+        data = data.replace('. ', '.')
+        match = self._patterns[unicode if isinstance(data, unicode) else str][0].search(data)
+        if match is None:
+            return 0.0
+        return self.value(match.groups())
+
+    def parse_many(self, strings):
+        """ Batch version of parse: returns an array of floats. """
+        strings = list(strings)
+        kinds = set(map(type, strings))
+        if not kinds <= set([str, unicode]):
+            return array.array('d', [self.parse(s) for s in strings])
+        if len(kinds) == 1:
+            return self._parse_many(strings, kinds.pop())
+        # byte and unicode strings are matched apart
+        values = array.array('d', [0.0]) * len(strings)
+        for kind in kinds:
+            indexes = [i for i, s in enumerate(strings) if type(s) is kind]
+            for i, value in zip(indexes, self._parse_many([strings[i] for i in indexes], kind)):
+                values[i] = value
+        return values
+
+    def _parse_many(self, strings, kind):
+        data = kind(SEPARATOR).join(strings)
+        if data.count(SEPARATOR) != len(strings) - 1:
+            # strings holding the separator: one at a time
+            return array.array('d', [self.parse(s) for s in strings])
+        data = data.replace('. ', '.') + SEPARATOR
+        value = self.value
+        return array.array('d', [value(match.groups()) for match in self._patterns[kind][1].finditer(data)])
+
+
+class GuessFormat(NumberFormat):
+    """ Separators guessed from digit counts (the original utils.extract_float_from_string). """
+
+    def __init__(self):
+        NumberFormat.__init__(self, None, None, ())
+
+    @property
+    def country(self):
+        return None
+
+    def compile(self):
+        number = r"""
+            \b(\d+)         # leading digits: the whole number, its units, or its thousands
+            \D?(\d{0,3})    # following digits: hundreds of a thousand-split number, or decimals
+            \D?(\d{0,2})    # closing digits: decimals
+        """
+        patterns = (re.compile(number, re.VERBOSE), re.compile(self.record(number), re.VERBOSE))
+        self._patterns = {str: patterns, unicode: patterns}
+
+    def value(self, groups):
+        leading, following, closing = groups
+        if leading is None:
+            return 0.0
+        thousands = '0'
+        decimals = closing or '0'
+        digits = following or '0'
+        if following and len(digits) < 3 and decimals == '0':
+            # two digits at most, and no decimals found after them: they are the decimals
+            decimals = digits
+            digits = '0'
+        if len(decimals) < 2:
+            decimals += '0' # 0.9 is 0.90, not 0.09
+        if not following and not closing:
+            digits = leading
+        elif following and not closing:
+            if digits == '0':
+                digits = leading
+            else:
+                thousands = leading
+        else:
+            thousands = leading
+        return (float(thousands) * 1000) + float(digits) + (float(decimals) / 100)
+
+
+def tag_text(tag):
+    """
+    Returns the text numbers are read from in an element: its serialization (tail included),
+    stripped of the &#13; &#160; &#163; &#8364; entities, white spaces and tags.
+
+    """
+    text = tag.text
+    tail = tag.tail
+    if (not len(tag) and isinstance(tag.tag, basestring) and type(text or '') is str and type(tail or '') is str
+            and not _escaped(text) and not _escaped(tail)):
+        # Leaf element of ASCII text: serialized as is, but for its tags (replaced by spaces anyway)
+        data = ('<>' + text + '<>' if text else '<>') + (tail or '')
+    else:
+        data = entities_re.sub('', etree.tostring(tag))
+    return tags_re.sub(' ', strip_white_spaces(data))
+
+def _escaped(text):
+    """ True when text holds characters escaped by etree.tostring. """
+    return text is not None and ('&' in text or '<' in text or '>' in text or '\r' in text)
+
+
+_formats = {}
+_countries = {}
+_lock = threading.Lock()
+_guess = GuessFormat()
+
+def register(number_format):
+    """ Registers a number format for its locale (and for its country, unless already taken). """
+    with _lock:
+        _formats[number_format.locale] = number_format
+        _countries.setdefault(number_format.country, number_format)
+
+def get_format(locale):
+    """ Returns the number format of a locale (the guessing format for unknown locales). """
+    if not locale:
+        return _guess
+    number_format = _formats.get(locale)
+    if number_format is None:
+        number_format = _countries.get(locale[3:].lower(), _guess)
+    return number_format
+
+def parse_number(data, locale=None):
+    """ Returns the first number of a string, as a float (0.0 when there is none). """
+    return get_format(locale).parse(data)
+
+def parse_numbers(strings, locale=None):
+    """ Batch version of parse_number: returns an array of floats. """
+    return get_format(locale).parse_many(strings)
+
+def parse_tag(tag, locale=None):
+    """ Returns the number of an element, as a float (0.0 for None, e.g. a missing optional element). """
+    if tag is None:
+        return 0.0
+    return get_format(locale).parse(tag_text(tag))
+
+def parse_tags(tags, locale=None):
+    """ Batch version of parse_tag: returns an array of floats. """
+    return get_format(locale).parse_many([tag_text(tag) if tag is not None else '' for tag in tags])
+
+
+register(NumberFormat('en_GB', '.', (u',',)))
+register(NumberFormat('fr_FR', ',', (u' ', u'\xa0', u'\u202f')))
@@ -0,0 +1,189 @@
+"""
+Structured output sinks: deals streamed as NDJSON, CSV or TSV.
+
+    with open_sink('deals.ndjson.gz', 'ndjson') as sink:
+        for deal in scrpr.iter_deals(url):
+            sink.write(deal)
+
+Deals are written as they come, through an in-memory buffer flushed every
+buffer_size bytes. Fields are written in a stable order: the documented
+deal fields first (deal.FIELDS order), then other keys sorted by name.
+Dates are written in ISO 8601 format; in CSV/TSV files, lists and
+dictionaries (e.g. addresses) are written as JSON.
+
+"""
+import csv
+import datetime
+import gzip
+import json
+import sys
+from collections import OrderedDict
+from libscraper.deal import FIELDS
+from libscraper.utils import bytestr
+
+FORMATS = ('ndjson', 'csv', 'tsv')
+
+
+def ordered_keys(deal):
+    keys = deal.keys()
+    known = set(FIELDS)
+    return [name for name in FIELDS if name in keys] + sorted(key for key in keys if key not in known)
+
+def json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if hasattr(value, 'todict'):
+        return value.todict()
+    return bytestr(value)
+
+
+class RawWriter(object):
+    """ File-like wrapper of a write function (csv.writer target). """
+
+    def __init__(self, write):
+        self.write = write
+
+
+class Sink(object):
+    """
+    Base output sink.
+
+        -- stream       file-like object written to
+        -- fields       fields written (defaults to the fields of the first deal)
+        -- buffer_size  bytes buffered before writing to the stream
+        -- close_stream close the stream when the sink is closed
+
+    """
+
+    def __init__(self, stream, fields=None, buffer_size=64 * 1024, close_stream=True):
+        self.stream = stream
+        self.fields = list(fields) if fields is not None else None
+        self.buffer_size = buffer_size
+        self.close_stream = close_stream
+        self.count = 0
+        self._begun = False
+        self._buffer = []
+        self._size = 0
+
+    def _write(self, data):
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def write(self, deal):
+        if not self._begun:
+            if self.fields is None:
+                self.fields = ordered_keys(deal)
+            self.begin()
+            self._begun = True
+        self.write_deal(deal)
+        self.count += 1
+
+    def write_many(self, deals):
+        for deal in deals:
+            self.write(deal)
+
+    def begin(self):
+        """ Called before the first deal is written, once fields are known. """
+        pass
+
+    def write_deal(self, deal):
+        raise NotImplementedError
+
+    def flush(self):
+        if self._buffer:
+            self.stream.write(''.join(self._buffer))
+            self._buffer = []
+            self._size = 0
+        self.stream.flush()
+
+    def close(self):
+        if not self._begun and self.fields is not None:
+            self.begin() # e.g. CSV header of an empty result
+            self._begun = True
+        self.flush()
+        if self.close_stream:
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+
+class NDJSONSink(Sink):
+    """ One JSON object per line. Without explicit fields, every key of every deal is written. """
+
+    def __init__(self, stream, fields=None, **kwargs):
+        Sink.__init__(self, stream, fields, **kwargs)
+        self._all_fields = fields is None
+
+    def write_deal(self, deal):
+        keys = ordered_keys(deal) if self._all_fields else [key for key in self.fields if key in deal]
+        data = OrderedDict((key, deal[key]) for key in keys)
+        self._write(json.dumps(data, default=json_default, separators=(',', ':')))
+        self._write('\n')
+
+
+class CSVSink(Sink):
+    """ Comma separated values, with a header row. Missing fields are written as empty values. """
+
+    delimiter = ','
+
+    def __init__(self, stream, fields=None, **kwargs):
+        Sink.__init__(self, stream, fields, **kwargs)
+        self._writer = csv.writer(RawWriter(self._write), delimiter=self.delimiter, lineterminator='\n')
+
+    def begin(self):
+        self._writer.writerow(self.fields)
+
+    def value(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        if isinstance(value, (list, tuple, dict)):
+            return json.dumps(value, default=json_default, separators=(',', ':'))
+        return bytestr(value)
+
+    def write_deal(self, deal):
+        self._writer.writerow([self.value(deal.get(field)) for field in self.fields])
+
+
+class TSVSink(CSVSink):
+    """ Tab separated values, with a header row. """
+
+    delimiter = '\t'
+
+
+SINKS = {'ndjson': NDJSONSink, 'csv': CSVSink, 'tsv': TSVSink}
+
+
+def open_sink(path, format='ndjson', fields=None, compress=None, buffer_size=64 * 1024):
+    """
+    Returns a sink writing to path.
+
+        -- path         output file path; '-' writes to the standard output
+        -- format       'ndjson', 'csv' or 'tsv'
+        -- fields       fields written (defaults to the fields of the first deal)
+        -- compress     gzip the output (defaults to True when path ends with '.gz')
+
+    """
+    if format not in SINKS:
+        raise ValueError('Unknown output format: {:s}'.format(format))
+    if compress is None:
+        compress = path.endswith('.gz')
+    if path == '-':
+        if compress:
+            # Closing the GzipFile writes the gzip trailer, without closing the standard output
+            stream, close_stream = gzip.GzipFile(fileobj=sys.stdout, mode='wb', compresslevel=6), True
+        else:
+            stream, close_stream = sys.stdout, False
+    elif compress:
+        stream, close_stream = gzip.open(path, 'wb', 6), True
+    else:
+        stream, close_stream = open(path, 'wb'), True
+    return SINKS[format](stream, fields=fields, buffer_size=buffer_size, close_stream=close_stream)
@@ -2,15 +2,34 @@
 The Parser module provides the tools required to parse URLs.
 
 """
-import importlib
-import hashlib
-import pkg_resources
 import re
 import random
 import sys
-import urllib2
-from lxml import etree
-from libscraper.exceptions import TargetPatternNotFound
+import threading
+import time
+from cStringIO import StringIO
+from libscraper import compression
+from libscraper.deal import Deal
+from libscraper.exceptions import BodyTooLarge, FetchError, TargetPatternNotFound
+from libscraper.lazy import lazy_import
+
+etree = lazy_import('lxml.etree')
+hashlib = lazy_import('hashlib')
+urllib2 = lazy_import('urllib2')
+
+user_agents = [
+    "Mozilla/5.0 (Linux i686)",
+    "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:14.0) Gecko/20100101 Firefox/14.0.1",
+    "Mozilla/5.0 (compatible; MSIE 9.0; Windows NT 6.1; Win64; x64; Trident/5.0)",
+    "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.1 (KHTML, like Gecko) Chrome/21.0.1180.60 Safari/537.1",
+]
+
+VOLATILE_FIELDS = ('status', 'volume') # deal fields changing while a deal is live (see get_deal_status)
+READ_SIZE = 16 * 1024 # body chunk size: parsing a chunk overlaps the transfer of the next ones
+GUESS_SIZE = 1024     # body bytes read before the parse mode is guessed (see guess_ptype)
+
+def random_user_agent():
+    return user_agents[random.randint(0, len(user_agents)-1)]
 
 
 class Tree(object):
@@ -21,17 +40,81 @@ class Tree(object):
         self._url = url
         self._root = root
         self._msg = msg
+        self._timings = None # phase timings, when metrics are enabled (see metrics.Metrics)
 
     def __str__(self):
         prt = self._msg if self._root is None else self._root
         return "[{:s}] {:d} \"{:s}\" {!s}".format(self._ptype, self._code, self._url, prt)
 
 
+class RawResponse(object):
+    """ A fetched response body, parsed to a Tree on demand (see BaseParser.prefetch). """
+
+    def __init__(self, body, code=200, url=None, content_type=None, content_encoding=None):
+        self.body = body
+        self.code = code
+        self.url = url
+        self.content_type = content_type
+        self.content_encoding = content_encoding # body decoded on parsing when set (e.g. 'gzip')
+        self.timings = None # connect/read timings, when metrics are enabled
+
+
+xml_content_types = ('text/xml', 'application/xml', 'application/rss+xml', 'application/atom+xml', 'application/rdf+xml')
+xml_roots = ('<rss', '<feed', '<rdf:rdf', '<urlset', '<sitemapindex')
+html_roots = ('<!doctype html', '<html')
+
+def guess_ptype(output, content_type=None, expect=None):
+    """
+    Guesses how a body should be parsed ('XML', 'HTML'), or None when undecided.
+    The start of the document is checked first, then the Content-Type, then the expected type.
+
+    """
+    head = output[:1024].lstrip('\xef\xbb\xbf \t\r\n').lower()
+    # Skip XML declaration, processing instructions and comments
+    while head.startswith('<?') or head.startswith('<!--'):
+        end = head.find('?>' if head.startswith('<?') else '-->')
+        if end < 0:
+            break
+        head = head[end + (2 if head.startswith('<?') else 3):].lstrip()
+    if head.startswith(html_roots):
+        if not output.lstrip('\xef\xbb\xbf \t\r\n').startswith('<?xml'):
+            return 'HTML'
+    elif head.startswith(xml_roots):
+        return 'XML'
+    ctype = (content_type or '').split(';')[0].strip().lower()
+    if ctype == 'text/html':
+        return 'HTML'
+    if ctype in xml_content_types or ctype.endswith('+xml'):
+        return 'XML'
+    return expect
+
+
 class BaseParser(object):
 
+    name = 'Base'
+
     def __init__(self, scraper):
         self.scraper = scraper
         self._targets = scraper._targets
+        self._local = threading.local()
+
+    @property
+    def _prefetched(self):
+        # Parser instances are shared between threads: prefetched trees are kept per thread
+        try:
+            return self._local.prefetched
+        except AttributeError:
+            self._local.prefetched = {}
+            return self._local.prefetched
+
+    def prefetch(self, url, tree):
+        """
+        Registers an already fetched Tree (or RawResponse) for a URL.
+        The next parse() call for that URL, from the same thread, returns it instead of connecting.
+        Used by engines that fetch pages themselves (e.g. AsyncScraper).
+
+        """
+        self._prefetched[url] = tree
 
     def urlinfo(self, url, init=False):
         """
@@ -43,25 +126,18 @@ class BaseParser(object):
         """
         url = url.split('?').pop(0) # Remove any querystring
         match = None
-        for target in self._targets:
-            for pattern in target._patterns:
-                s = pattern.search(url)
-                if s is not None:
-                    match = target.get_info()
-                    match['info'] = list(s.groups())
-                    break
-            if init and match:
-                parser_model = match['parser'] + '.py'
-                models = pkg_resources.resource_listdir('models', '')
-                if parser_model in models:
-                    # Load module
-                    module = importlib.import_module('.'+parser_model[:-3], 'models')
+        route = self.scraper.router.route(url)
+        if route is not None:
+            target, groups = route
+            match = target.get_info()
+            match['info'] = list(groups)
+            if init:
+                parser = self.scraper.models.get(match['parser'])
+                if parser is not None:
                     # Replace parser with Parser instance
-                    parser = module.Parser(self.scraper)                    
                     match['parser'] = parser
                     # Load info from fixtures
                     match.update(parser.get_urlinfo(match))
-                break
         if not match:
             raise TargetPatternNotFound()
             return {}
@@ -72,74 +148,384 @@ class BaseParser(object):
     def __connect(self, url, headers=None, proxy=None):
         timeout = 10 # set timeout at 10 seconds
         request = urllib2.Request(url)
+        request.add_header('Accept-encoding', compression.ACCEPT_ENCODING)
         if headers is not None:
             for header in headers:
                 request.add_header(header['name'], header['value'])
-        user_agents = [
-            "Mozilla/5.0 (Linux i686)",
-            "Mozilla/5.0 (Windows NT 6.1; WOW64; rv:14.0) Gecko/20100101 Firefox/14.0.1",
-            "Mozilla/5.0 (compatible; MSIE 9.0; Windows NT 6.1; Win64; x64; Trident/5.0)",
-            "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.1 (KHTML, like Gecko) Chrome/21.0.1180.60 Safari/537.1",
-        ]
-        request.add_header('User-agent', user_agents[random.randint(0, len(user_agents)-1)])
-        if proxy is not None:
-            proxy_handler = urllib2.ProxyHandler({'http':proxy})
-            opener = urllib2.build_opener(proxy_handler)
-        else:
-            opener = urllib2.build_opener()
-        r = opener.open(request, timeout=timeout)
-        return r
+        request.add_header('User-agent', random_user_agent())
+        pool = self.scraper.proxies
+        if proxy is None and pool is not None:
+            return pool.open(self.scraper.transport, request, timeout=timeout)
+        return self.scraper.transport.open(request, proxy=proxy, timeout=timeout)
 
     def get_hash(self, hashbag=[]):
         if not hashbag:
             return None
         return hashlib.sha256(','.join([str(i) for i in hashbag])).hexdigest()
 
-    def parse(self, url, headers=None, proxy=None):
+    def get_digest(self, hashbag=[]):
+        """ Binary version of get_hash (see deal.Deal.digest) """
+        if not hashbag:
+            return None
+        return hashlib.sha256(','.join([str(i) for i in hashbag])).digest()
+
+    def parse(self, url, headers=None, proxy=None, ptype=None, expect=None):
         """
         Parse URL to a Tree object.
-        All URLs are parsed as XML/XHTML, defaulting to HTML when an XML syntax error is found.
+        The parse mode is guessed from the document start and Content-Type (see guess_ptype);
+        undecided URLs are parsed as XML/XHTML, defaulting to HTML when an XML syntax error is found.
+        The body is fed to the parser as it arrives (decoded when gzip/deflate encoded),
+        so that parsing overlaps the transfer.
 
             -- headers      list of request HTTP headers
-            -- proxy        proxy format: "IP:port"
+            -- proxy        proxy format: "IP:port" (defaults to one of the scraper's proxies, if any)
+            -- ptype        force the parse mode ('XML' or 'HTML')
+            -- expect       parse mode expected by the caller (e.g. 'XML' for feeds), used when undecided
 
         """
+        if url in self._prefetched:
+            prefetched = self._prefetched.pop(url)
+            if isinstance(prefetched, RawResponse):
+                return self.__parse_raw(url, prefetched, ptype, expect)
+            return prefetched
+        timings = {} if self.scraper.metrics.enabled else None
+        response = self.__open(url, headers, proxy, timings)
+        if isinstance(response, Tree):
+            return response
+        return self.__timed(self.__stream(url, response, ptype, expect, timings), timings)
+
+    def __parse_raw(self, url, raw, ptype, expect):
+        raw = self.__decoded(url, raw)
+        if isinstance(raw, Tree):
+            return raw
+        tree = self.make_tree(raw.body, url=url, code=raw.code, final_url=raw.url,
+                              content_type=raw.content_type, ptype=ptype, expect=expect)
+        return self.__timed(tree, raw.timings)
+
+    def __decoded(self, url, raw):
+        """ Returns a RawResponse with its body decoded, or an error Tree. """
+        if not raw.content_encoding:
+            return raw
+        # e.g. fetched on the event loop by AsyncScraper: decoded here, off the loop
         try:
-            response = self.__connect(url, headers, proxy)
+            body = ''.join(self.__read(StringIO(raw.body), raw.content_encoding))
+        except Exception as e:
+            return self.__timed(self.__read_error(url, e), raw.timings)
+        decoded = RawResponse(body, code=raw.code, url=raw.url, content_type=raw.content_type)
+        decoded.timings = raw.timings
+        return decoded
+
+    def fetch(self, url, headers=None, proxy=None):
+        """
+        Network half of parse(): returns the RawResponse of url (decoded body), or an error Tree
+        (following the same status conventions as parse). A prefetched response is returned as is.
+
+            -- headers      list of request HTTP headers
+            -- proxy        proxy format: "IP:port" (defaults to one of the scraper's proxies, if any)
+
+        """
+        if url in self._prefetched:
+            prefetched = self._prefetched.pop(url)
+            if isinstance(prefetched, RawResponse):
+                return self.__decoded(url, prefetched)
+            return prefetched
+        metrics = self.scraper.metrics
+        timings = {} if metrics.enabled else None
+        response = self.__open(url, headers, proxy, timings)
+        if isinstance(response, Tree):
+            return response
+        info = response.info()
+        wire = [0]
+        start = time.time()
+        try:
+            output = ''.join(self.__read(response, info.getheader('Content-Encoding'),
+                                         info.getheader('Content-Length'), wire))
+        except Exception as e:
+            return self.__timed(self.__read_error(url, e), timings)
+        finally:
+            response.close()
+        if timings is not None:
+            timings['read'] = time.time() - start
+            timings['bytes'] = len(output)
+            timings['wire_bytes'] = wire[0]
+            metrics.timing('read', timings['read'], model=self.name)
+            metrics.count('bytes', wire[0], model=self.name)
+        raw = RawResponse(output, code=response.code, url=response.geturl(),
+                          content_type=info.getheader('Content-Type'))
+        raw.timings = timings
+        return raw
+
+    def __open(self, url, headers, proxy, timings):
+        """ Sends the request of url; returns the response, or an error Tree. """
+        metrics = self.scraper.metrics
+        try:
+            if timings is None:
+                return self.__connect(url, headers, proxy)
+            start = time.time()
+            try:
+                return self.__connect(url, headers, proxy)
+            finally:
+                timings['connect'] = time.time() - start
+                metrics.timing('connect', timings['connect'], model=self.name)
         except urllib2.HTTPError as e:
             self.scraper.logger.debug(sys.exc_info())
-            return Tree(url=url, code=e.code, msg=e.msg)
+            metrics.error('HTTPError', model=self.name)
+            return self.__timed(Tree(url=url, code=e.code, msg=e.msg), timings)
         except urllib2.URLError as e:
             self.scraper.logger.debug(sys.exc_info())
-            return Tree(url=url, code=404, msg=e.reason)
+            metrics.error('URLError', model=self.name)
+            return self.__timed(Tree(url=url, code=404, msg=e.reason), timings)
         except Exception as e:
             self.scraper.logger.debug(sys.exc_info())
-            return Tree(url=url, msg=e)
+            metrics.error(type(e).__name__, model=self.name)
+            return self.__timed(Tree(url=url, msg=e), timings)
+
+    def __read(self, response, content_encoding=None, content_length=None, wire=None):
+        """
+        Yields the body of a response in chunks, decoded according to its Content-Encoding.
+        Raises BodyTooLarge as soon as the body is known to exceed scraper.max_body_size.
+
+            -- wire     one item list, incremented by the number of bytes read from the response
+
+        """
+        limit = self.scraper.max_body_size
+        if limit and content_length and content_length.strip().isdigit() and int(content_length) > limit:
+            raise BodyTooLarge('Content-Length {:s} exceeds {:d} bytes'.format(content_length.strip(), limit))
+        decoder = compression.decoder(content_encoding)
+        size = 0
+        while True:
+            data = response.read(READ_SIZE)
+            if wire is not None:
+                wire[0] += len(data)
+            if not data:
+                data = decoder.flush() if decoder is not None else ''
+            elif decoder is not None:
+                data = decoder.decompress(data)
+                if not data:
+                    continue
+            if not data:
+                return
+            size += len(data)
+            if limit and size > limit:
+                raise BodyTooLarge('body exceeds {:d} bytes'.format(limit))
+            yield data
+
+    def __read_error(self, url, e):
+        self.scraper.logger.debug(sys.exc_info())
+        self.scraper.metrics.error(type(e).__name__, model=self.name)
+        return Tree(url=url, msg=e)
+
+    def __stream(self, url, response, ptype, expect, timings):
+        """
+        Parses a response body to a Tree as it is read: the parse mode is guessed from
+        the first GUESS_SIZE bytes, then chunks are fed to the lxml parser as they arrive.
+
+        """
+        metrics = self.scraper.metrics
+        info = response.info()
+        content_type = info.getheader('Content-Type')
+        forced = ptype is not None
+        chunks = []
+        head = ''
+        parser = None
+        error = None # XML syntax error raised by the feed parser
+        parsing = 0.0
+        wire = [0]
+        start = time.time()
         try:
-            output = response.read()
+            for chunk in self.__read(response, info.getheader('Content-Encoding'),
+                                     info.getheader('Content-Length'), wire):
+                chunks.append(chunk)
+                if parser is None:
+                    head += chunk
+                    if len(head) < GUESS_SIZE:
+                        continue
+                    if not forced:
+                        ptype = guess_ptype(head, content_type, expect) or 'XML'
+                    parser = self._lxml_parser(ptype)
+                    chunk, head = head, None
+                if error is None:
+                    feed_start = time.time()
+                    try:
+                        parser.feed(chunk)
+                    except etree.XMLSyntaxError as e:
+                        error = e
+                    parsing += time.time() - feed_start
         except Exception as e:
-            self.scraper.logger.debug(sys.exc_info())
-            return Tree(url=url, msg=e)
-        try:
-            ptype = 'XML'
-            root = etree.fromstring(output, etree.XMLParser(encoding='utf-8'))
-        except etree.XMLSyntaxError:
+            if parser is not None and error is None:
+                self.__reset(parser)
+            return self.__read_error(url, e)
+        finally:
+            response.close()
+        output = ''.join(chunks)
+        read = time.time() - start - parsing
+        if timings is not None:
+            timings['read'] = read
+            timings['wire_bytes'] = wire[0]
+            metrics.timing('read', read, model=self.name)
+            metrics.count('bytes', wire[0], model=self.name)
+        if parser is None:
+            # Short body: parsed at once
+            return self.make_tree(output, url=url, code=response.code, final_url=response.geturl(),
+                                  content_type=content_type, ptype=ptype, expect=expect)
+        start = time.time()
+        root = None
+        if error is None:
             try:
-                ptype = 'HTML'
-                root = etree.fromstring(output, etree.HTMLParser(encoding='utf-8'))
-            except Exception as e:
-                self.scraper.logger.debug(sys.exc_info())
-                return Tree(url=url, msg=e)
+                root = parser.close()
+            except etree.XMLSyntaxError as e:
+                error = e
+        else:
+            self.__reset(parser)
+        if error is not None:
+            root = self.__fallback(url, output, ptype, forced, error)
+            if isinstance(root, Tree):
+                return root
+            ptype = 'HTML'
+        parsing += time.time() - start
+        return self.__tree(root, ptype, response.code, url, response.geturl(), len(output), parsing)
+
+    def __reset(self, parser):
+        """ Ends the document of an lxml feed parser left in the middle of one, so that it can be reused. """
+        try:
+            parser.close()
+        except Exception:
+            pass
+
+    def __timed(self, tree, timings):
+        """ Attaches the connect/read timings of a parse() call to its Tree (make_tree adds the parse timing). """
+        if timings:
+            if tree._timings is not None:
+                timings.update(tree._timings)
+            tree._timings = timings
+        return tree
+
+    def _lxml_parser(self, ptype):
+        # lxml parsers can be reused, but not concurrently: keep one of each per thread
+        parsers = self.scraper._lxml_parsers
+        try:
+            return getattr(parsers, ptype)
+        except AttributeError:
+            if ptype == 'XML':
+                parser = etree.XMLParser(encoding='utf-8')
+            else:
+                parser = etree.HTMLParser(encoding='utf-8')
+            setattr(parsers, ptype, parser)
+            return parser
+
+    def make_tree(self, output, url, code=200, final_url=None, content_type=None, ptype=None, expect=None):
+        """
+        Parse a raw response body to a Tree object.
+
+            -- url          requested URL
+            -- code         HTTP status code
+            -- final_url    URL after redirects (defaults to url)
+            -- content_type response Content-Type header
+            -- ptype        force the parse mode ('XML' or 'HTML')
+            -- expect       expected parse mode, used when the document type cannot be guessed
+
+        """
+        start = time.time() if self.scraper.metrics.enabled else None
+        forced = ptype is not None
+        if not forced:
+            ptype = guess_ptype(output, content_type, expect) or 'XML'
+        try:
+            root = etree.fromstring(output, self._lxml_parser(ptype))
+        except etree.XMLSyntaxError as e:
+            root = self.__fallback(url, output, ptype, forced, e)
+            if isinstance(root, Tree):
+                return root
+            ptype = 'HTML'
         except Exception as e:
-            self.scraper.logger.debug(sys.exc_info())
-            return Tree(url=url, msg=e)
+            return self.__parse_error(url, e)
+        return self.__tree(root, ptype, code, url, final_url, len(output),
+                           time.time() - start if start is not None else None)
+
+    def __fallback(self, url, output, ptype, forced, error):
+        """ Handles an XML syntax error: returns the root of output parsed as HTML, or an error Tree. """
+        if forced or ptype != 'XML':
+            return self.__parse_error(url, error)
+        self.scraper.parse_stats.incr('fallback')
+        self.scraper.metrics.error('fallback', model=self.name)
+        try:
+            return etree.fromstring(output, self._lxml_parser('HTML'))
+        except Exception as e:
+            return self.__parse_error(url, e)
+
+    def __parse_error(self, url, e):
+        self.scraper.parse_stats.incr('errors')
+        self.scraper.metrics.error(type(e).__name__, model=self.name)
+        self.scraper.logger.debug(sys.exc_info())
+        return Tree(url=url, msg=e)
+
+    def __tree(self, root, ptype, code, url, final_url, size, elapsed):
+        self.scraper.parse_stats.incr(ptype)
         if type(root) is not etree._Element:
             root = None
-        return Tree(ptype=ptype, code=response.code, url=response.geturl(), root=root)
+        tree = Tree(ptype=ptype, code=code, url=final_url or url, root=root)
+        if elapsed is not None and self.scraper.metrics.enabled:
+            tree._timings = {'parse': elapsed, 'bytes': size}
+            self.scraper.metrics.timing('parse', elapsed, model=self.name, ptype=ptype)
+        return tree
+
+    def iterparse(self, url, tag, headers=None, proxy=None):
+        """
+        Incrementally parse an XML URL, yielding each <tag> element once it is complete.
+        Elements are cleared (and detached from the tree) once the caller moves on,
+        so memory use does not grow with the document size.
+
+            -- tag          name of the elements to yield
+            -- headers      list of request HTTP headers
+            -- proxy        proxy format: "IP:port"
+
+        """
+        if url in self._prefetched:
+            tree = self.parse(url, ptype='XML')
+            if tree._root is not None and tree._ptype == 'XML':
+                for element in tree._root.iter(tag):
+                    yield element
+            return
+        try:
+            response = self.__connect(url, headers, proxy)
+        except Exception:
+            self.scraper.logger.debug(sys.exc_info())
+            return
+        try:
+            decoder = compression.decoder(response.info().getheader('Content-Encoding'))
+            stream = response if decoder is None else compression.DecodedStream(response, decoder, READ_SIZE)
+            for event, element in etree.iterparse(stream, events=('end',), tag=tag, encoding='utf-8'):
+                yield element
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+        except (etree.XMLSyntaxError, compression.DecodingError):
+            self.scraper.logger.debug(sys.exc_info())
+        finally:
+            response.close()
+
+    def iter_deals(self, url):
+        """
+        Yields the deals described in get_deals, one at a time.
+        Models able to stream their feeds should override it; by default it iterates over get_deals.
+
+        """
+        for deal in self.get_deals(url):
+            yield deal
+
+    def get_new_deals(self, url, store):
+        """
+        Incremental version of get_deals: returns only the deals not yet recorded in store
+        (a seen.SeenStore), i.e. new deals and deals whose hashid changed.
+        Models may override it to skip the extraction of unchanged feed items.
+
+        """
+        deals = [deal for deal in self.iter_deals(url) if store.add_deal(deal)]
+        store.commit()
+        return deals
 
     def get_deals(self, url):
         """
-        The method should gather the following information:
+        The method should return a list of deal.Deal objects, gathering the following information:
             - title         Main headline
             - headline      Sub-headline
             - link          Full URI
@@ -156,7 +542,7 @@ class BaseParser(object):
 
     def get_deal(self, url):
         """
-        The method should gather the following information:
+        The method should return a deal.Deal object, gathering the following information:
             - status        If the deal is sold out or expired
             - merchant      Merchant name
             - merchant_url  Merchant site URL
@@ -167,3 +553,18 @@ class BaseParser(object):
 
         """
         return {}
+
+    def get_deal_status(self, url):
+        """
+        Lightweight version of get_deal, for polling live deals (see tracker.VolumeTracker):
+        returns a deal.Deal holding the volatile fields only (status, volume).
+        Models should override it with a cheaper extraction path; by default it runs get_deal.
+        Raises FetchError when the page cannot be fetched (get_deal returns an empty deal).
+
+        """
+        raw = self.fetch(url)
+        if isinstance(raw, Tree) and raw._root is None:
+            raise FetchError(raw)
+        self.prefetch(url, raw)
+        deal = self.get_deal(url)
+        return Deal((name, deal[name]) for name in VOLATILE_FIELDS if name in deal)
@@ -0,0 +1,239 @@
+"""
+Pipelined scraping: fetching on threads, parsing and extraction on processes.
+
+Fetching is I/O bound while lxml parsing and model extraction are CPU bound
+and hold the GIL. A Pipeline fetches pages on a pool of threads (the network
+half of BaseParser.parse, see BaseParser.fetch) and hands the raw bodies to
+a pool of worker processes, which parse them and run the model method,
+returning plain results (deal.Deal records, lists of deals).
+
+    pipeline = Pipeline(scrpr, workers=16)
+    for url, deal in pipeline.run(urls, 'get_deal'):
+        ...
+    pipeline.close()
+
+Worker processes use a Scraper of their own: models are resolved and loaded
+there by the same registry, and run unchanged (parse() returns the fetched
+page). At most max_pending fetched pages wait for a worker: fetch threads
+block beyond that.
+
+Results travel back pickled by the workers: a result which cannot be pickled
+is yielded as an error. An extraction not done timeout seconds after it was
+submitted (e.g. its worker process died) is yielded as a
+multiprocessing.TimeoutError, and pages still waiting when the pipeline is
+closed as errors too, so that run() always ends.
+
+"""
+import Queue
+import cPickle as pickle
+import multiprocessing
+import threading
+import time
+from libscraper.batch import HostLimiter
+from libscraper.parser import Tree
+
+_worker_scraper = None
+
+def _init_worker(scraper_class, verbose):
+    global _worker_scraper
+    _worker_scraper = scraper_class(verbose=verbose)
+
+def _extract(url, method, fetched, args):
+    """
+    Runs in a worker process: parses the fetched page and runs the model method.
+    Returns the result (or the error) pickled.
+
+    """
+    try:
+        parser = _worker_scraper.model(url)
+        parser.prefetch(url, fetched)
+        result = getattr(parser, method)(url, *args)
+    except Exception as e:
+        try:
+            return pickle.dumps(e, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            result = Exception(repr(e))
+    try:
+        return pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        return pickle.dumps(pickle.PicklingError('{:s} result of {:s} cannot be pickled: {!r}'.format(method, url, e)),
+                            pickle.HIGHEST_PROTOCOL)
+
+def _unpickle(data):
+    try:
+        return pickle.loads(data)
+    except Exception as e:
+        return pickle.UnpicklingError(repr(e))
+
+
+class Pipeline(object):
+    """
+    Fetch / extract pipeline of a Scraper.
+
+        -- scraper          Scraper fetching pages (its Session and transport are used)
+        -- workers          number of extraction processes (defaults to the number of CPUs)
+        -- fetch_workers    number of fetching threads
+        -- per_host         maximum number of concurrent requests per host
+        -- max_pending      maximum number of fetched pages waiting for extraction (defaults to 2 per process)
+        -- timeout          seconds after which a submitted extraction is given up (None waits forever)
+
+    """
+
+    def __init__(self, scraper, workers=None, fetch_workers=8, per_host=4, max_pending=None, timeout=60):
+        self.scraper = scraper
+        self.workers = max(1, workers or multiprocessing.cpu_count())
+        self.fetch_workers = max(1, fetch_workers)
+        self.per_host = max(1, per_host)
+        self.max_pending = max(1, max_pending or self.workers * 2)
+        self.timeout = timeout
+        self._pool = None
+        # Guards pool submissions (and the extractions in flight) against close()
+        self._lock = threading.Lock()
+
+    def pool(self):
+        if self._pool is None:
+            # Workers are forked before any fetching thread is started
+            self._pool = multiprocessing.Pool(self.workers, initializer=_init_worker,
+                                              initargs=(type(self.scraper), self.scraper.logger.verbose))
+        return self._pool
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    def run(self, urls, method='get_deal', args=(), ordered=False):
+        """
+        Yields (url, result) tuples; errors (e.g. ElementMissing, TargetPatternNotFound)
+        are yielded in place of results.
+
+            -- urls         iterable of URLs (consumed lazily)
+            -- method       model method run in the workers ('get_deal', 'get_deals', ...)
+            -- args         extra arguments of the model method (must be picklable)
+            -- ordered      yield results in the order of urls, instead of completion order
+
+        """
+        pool = self.pool()
+        limiter = HostLimiter(per_host=self.per_host)
+        pending = threading.BoundedSemaphore(self.max_pending)
+        tasks = Queue.Queue(maxsize=self.fetch_workers * 2)
+        results = Queue.Queue()
+        stop = threading.Event()
+        done = object()
+        # Extractions submitted to the pool: index -> (url, submission time)
+        running = {}
+
+        def feed():
+            count = 0
+            try:
+                for index, url in enumerate(urls):
+                    while not stop.is_set():
+                        try:
+                            tasks.put((index, url), timeout=0.1)
+                            break
+                        except Queue.Full:
+                            pass
+                    if stop.is_set():
+                        break
+                    count += 1
+            finally:
+                for _ in range(self.fetch_workers):
+                    tasks.put(done)
+                results.put((done, count))
+
+        def fetch():
+            while True:
+                task = tasks.get()
+                if task is done:
+                    return
+                index, url = task
+                # Backpressure: wait for an extraction slot before fetching
+                while not pending.acquire(False):
+                    if stop.wait(0.05):
+                        break
+                if stop.is_set():
+                    continue
+                try:
+                    with limiter.get(url):
+                        fetched = self.scraper.model(url).fetch(url)
+                except Exception as e:
+                    pending.release()
+                    results.put((index, url, e))
+                    continue
+                if isinstance(fetched, Tree):
+                    # Error Trees hold no parsed document: strip non-picklable messages
+                    fetched = Tree(url=fetched._url, code=fetched._code, msg=str(fetched._msg))
+
+                def extracted(data, index=index):
+                    # Called on the result handler thread of the pool: must not raise
+                    with self._lock:
+                        task = running.pop(index, None)
+                    if task is not None: # else given up already
+                        pending.release()
+                        results.put((index, task[0], _unpickle(data)))
+
+                with self._lock:
+                    if stop.is_set():
+                        pending.release()
+                    elif self._pool is not pool:
+                        pending.release()
+                        results.put((index, url, ValueError('the pipeline was closed')))
+                    else:
+                        running[index] = (url, time.time())
+                        pool.apply_async(_extract, (url, method, fetched, tuple(args)), callback=extracted)
+
+        def give_up():
+            """ Fails the extractions not done in time, or all of them once the pipeline is closed. """
+            now = time.time()
+            with self._lock:
+                closed = self._pool is not pool
+                for index, (url, submitted) in running.items():
+                    if closed:
+                        error = ValueError('the pipeline was closed')
+                    elif self.timeout is not None and now - submitted > self.timeout:
+                        error = multiprocessing.TimeoutError('extraction of {:s} not done after {:d}s'.format(
+                            url, int(now - submitted)))
+                    else:
+                        continue
+                    del running[index]
+                    pending.release()
+                    results.put((index, url, error))
+
+        threads = [threading.Thread(target=feed)]
+        threads.extend([threading.Thread(target=fetch) for _ in range(self.fetch_workers)])
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            total = None
+            received = 0
+            waiting = {}
+            following = 0
+            check = time.time() + 1
+            while total is None or received < total:
+                if time.time() >= check:
+                    give_up()
+                    check = time.time() + 1
+                # Use a timeout so KeyboardInterrupt is delivered to the main thread
+                try:
+                    item = results.get(timeout=1)
+                except Queue.Empty:
+                    continue
+                if item[0] is done:
+                    total = item[1]
+                    continue
+                received += 1
+                index, url, result = item
+                if not ordered:
+                    yield url, result
+                    continue
+                waiting[index] = (url, result)
+                while following in waiting:
+                    yield waiting.pop(following)
+                    following += 1
+        finally:
+            with self._lock:
+                stop.set()
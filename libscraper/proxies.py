@@ -0,0 +1,212 @@
+"""
+Proxy pools: requests spread over egress proxies by measured health.
+
+    pool = ProxyPool(['10.0.0.1:3128', '10.0.0.2:3128', '10.0.0.3:3128'])
+    scrpr = Scraper(proxies=pool)
+    scrpr.get_deals(url)        # http and https requests go through the pool
+    pool.stats()                # per-proxy health statistics
+
+Every request picks a proxy among those not quarantined: proxies not measured
+yet are tried first, then the better of two randomly drawn proxies wins, by
+score (latency EWMA, scaled by the requests in flight through the proxy and
+by its recent success rate). Slow proxies get less traffic without being
+starved when others degrade.
+
+A network error, or a 403 / 429 response (a ban, most likely specific to the
+proxy), quarantines a proxy: for quarantine seconds, doubled after each
+consecutive failure up to max_quarantine. The request is then retried
+through another proxy (retries times at most). When every proxy is
+quarantined, the one released first is used.
+
+Connections are pooled per proxy by the Session (http requests are sent to
+the proxy, https requests are tunnelled through it with CONNECT).
+
+"""
+import httplib
+import random
+import socket
+import threading
+import time
+import urllib2
+
+
+class Proxy(object):
+    """
+    A proxy and its health statistics.
+
+        -- address      proxy address ("IP:port")
+
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.latency = None         # EWMA of the response latency (seconds), None until measured
+        self.health = 1.0           # EWMA of the request outcomes (1: success, 0: failure)
+        self.requests = 0
+        self.failures = 0
+        self.bans = 0               # failures due to a ban response (see ProxyPool.ban_codes)
+        self.consecutive = 0        # consecutive failures
+        self.quarantines = 0
+        self.quarantined_until = 0.0
+        self.active = 0             # requests in flight
+
+    def score(self, default_latency):
+        """ Lower is better. """
+        latency = self.latency if self.latency is not None else default_latency
+        return latency * (1 + self.active) / max(self.health, 0.05)
+
+    def stats(self, now):
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'bans': self.bans,
+            'latency': self.latency,
+            'health': self.health,
+            'active': self.active,
+            'quarantines': self.quarantines,
+            'quarantined': max(0.0, self.quarantined_until - now),
+        }
+
+    def __repr__(self):
+        return '<Proxy {:s}>'.format(self.address)
+
+
+class ProxyPool(object):
+    """
+    Health-aware pool of proxies, attached to a Scraper (Scraper(proxies=pool)).
+
+        -- proxies          proxy addresses ("IP:port")
+        -- quarantine       seconds a proxy is set aside after a failure (doubled per consecutive failure)
+        -- max_quarantine   maximum quarantine, in seconds
+        -- retries          number of other proxies a failed request is retried through
+        -- ban_codes        HTTP status codes counted as proxy failures
+        -- alpha            weight of the last request in the latency and health averages
+
+    """
+
+    def __init__(self, proxies=(), quarantine=30, max_quarantine=1800, retries=2, ban_codes=(403, 429), alpha=0.3):
+        self.quarantine = quarantine
+        self.max_quarantine = max_quarantine
+        self.retries = retries
+        self.ban_codes = ban_codes
+        self.alpha = alpha
+        self._proxies = []
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        for address in proxies:
+            self.add(address)
+
+    def add(self, address):
+        with self._lock:
+            if address not in [proxy.address for proxy in self._proxies]:
+                self._proxies.append(Proxy(address))
+
+    def remove(self, address):
+        with self._lock:
+            self._proxies = [proxy for proxy in self._proxies if proxy.address != address]
+
+    def __len__(self):
+        return len(self._proxies)
+
+    def acquire(self, exclude=()):
+        """
+        Picks a proxy for a request, not one of the addresses in exclude unless there is no other.
+        Each acquire() must be followed by a release() of the proxy.
+
+        """
+        now = time.time()
+        with self._lock:
+            if not self._proxies:
+                raise ValueError('empty proxy pool')
+            candidates = [proxy for proxy in self._proxies if proxy.address not in exclude] or self._proxies
+            available = [proxy for proxy in candidates if proxy.quarantined_until <= now]
+            if not available:
+                proxy = min(candidates, key=lambda p: p.quarantined_until)
+            else:
+                untested = [p for p in available if p.latency is None and p.active == 0]
+                if untested:
+                    proxy = untested[0]
+                elif len(available) == 1:
+                    proxy = available[0]
+                else:
+                    measured = [p.latency for p in available if p.latency is not None]
+                    default = sum(measured) / len(measured) if measured else 1.0
+                    proxy = min(self._random.sample(available, 2), key=lambda p: p.score(default))
+            proxy.active += 1
+            return proxy
+
+    def release(self, proxy, latency=None, code=None, error=None):
+        """
+        Records the outcome of a request made through proxy.
+
+            -- latency      seconds until the response (None when the request did not reach the proxy)
+            -- code         response HTTP status code
+            -- error        network error raised by the request
+
+        """
+        now = time.time()
+        with self._lock:
+            proxy.active -= 1
+            if latency is None and error is None:
+                return
+            proxy.requests += 1
+            if error is not None or code in self.ban_codes:
+                proxy.failures += 1
+                if error is None:
+                    proxy.bans += 1
+                proxy.consecutive += 1
+                proxy.health *= 1 - self.alpha
+                proxy.quarantines += 1
+                proxy.quarantined_until = now + min(self.max_quarantine,
+                                                    self.quarantine * 2 ** (proxy.consecutive - 1))
+            else:
+                proxy.consecutive = 0
+                proxy.health = proxy.health * (1 - self.alpha) + self.alpha
+                if proxy.latency is None:
+                    proxy.latency = latency
+                else:
+                    proxy.latency = proxy.latency * (1 - self.alpha) + latency * self.alpha
+
+    def open(self, transport, request, timeout=10):
+        """
+        Opens a urllib2.Request with transport, through the pool's proxies.
+        Returns the response, or raises the error of the last attempt (urllib2.HTTPError / URLError).
+
+        """
+        tried = []
+        while True:
+            proxy = self.acquire(exclude=tried)
+            tried.append(proxy.address)
+            start = time.time()
+            try:
+                response = transport.open(copy_request(request), proxy=proxy.address, timeout=timeout)
+            except urllib2.HTTPError as e:
+                self.release(proxy, time.time() - start, code=e.code)
+                if e.code not in self.ban_codes or len(tried) > self.retries:
+                    raise
+                if e.fp is not None:
+                    e.close()
+            except (urllib2.URLError, socket.error, httplib.HTTPException) as e:
+                self.release(proxy, time.time() - start, error=e)
+                if len(tried) > self.retries:
+                    raise
+            except Exception:
+                self.release(proxy)
+                raise
+            else:
+                self.release(proxy, time.time() - start, code=response.code)
+                return response
+
+    def stats(self):
+        """ Returns the health statistics of every proxy, by address. """
+        now = time.time()
+        with self._lock:
+            return dict((proxy.address, proxy.stats(now)) for proxy in self._proxies)
+
+
+def copy_request(request):
+    """ Returns a copy of a urllib2.Request: opening a request through a proxy alters it. """
+    copy = urllib2.Request(request.get_full_url(), request.get_data(), dict(request.headers))
+    for name, value in request.unredirected_hdrs.items():
+        copy.add_unredirected_header(name, value)
+    return copy
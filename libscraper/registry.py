@@ -0,0 +1,95 @@
+"""
+Model plugins registry.
+
+Plugins are discovered once: modules found in the models package, and
+modules or Parser classes published under the "libscraper.models" entry point
+group. A plugin is imported on first use, and a single Parser instance is
+kept per model, so resolving a URL to its model is a dictionary lookup once
+the registry is warm.
+
+Built-in models are found without scanning entry points: pkg_resources (slow
+to import) is only loaded to list all models, or to find a third-party one.
+
+"""
+import importlib
+import pkgutil
+import threading
+import time
+from libscraper.lazy import lazy_import
+
+pkg_resources = lazy_import('pkg_resources')
+
+
+class ModelRegistry(object):
+    """
+    Models registry of a Scraper.
+
+        -- package          package holding the built-in models
+        -- group            entry point group of third-party models
+
+    """
+
+    def __init__(self, scraper, package='models', group='libscraper.models'):
+        self.scraper = scraper
+        self.package = package
+        self.group = group
+        self.load_times = {}
+        self._builtins = None
+        self._available = None
+        self._parsers = {}
+        self._lock = threading.RLock()
+
+    def builtins(self):
+        """ Returns the names of the modules of the models package. """
+        with self._lock:
+            if self._builtins is None:
+                package = importlib.import_module(self.package)
+                self._builtins = set(name for _, name, ispkg in pkgutil.iter_modules(package.__path__)
+                                     if not ispkg and not name.startswith('__'))
+            return sorted(self._builtins)
+
+    def discover(self):
+        """ Returns the available models names, scanning plugins on first call only. """
+        with self._lock:
+            if self._available is None:
+                available = dict((name, '.' + name) for name in self.builtins())
+                for entry_point in pkg_resources.iter_entry_points(self.group):
+                    available.setdefault(entry_point.name, entry_point)
+                self._available = available
+            return sorted(self._available.keys())
+
+    def _find(self, name):
+        """ Returns the plugin of a model (built-in module name or entry point), or None. """
+        if self._available is None:
+            self.builtins()
+            if name in self._builtins:
+                return '.' + name # built-in models take precedence over entry points
+            self.discover()
+        return self._available.get(name)
+
+    def _load(self, plugin):
+        if isinstance(plugin, basestring):
+            return importlib.import_module(plugin, self.package).Parser
+        loaded = plugin.load()
+        return getattr(loaded, 'Parser', loaded)
+
+    def get(self, name):
+        """ Returns the Parser instance of a model, or None if no such model exists. """
+        parser = self._parsers.get(name)
+        if parser is not None:
+            return parser
+        with self._lock:
+            if name in self._parsers:
+                return self._parsers[name]
+            plugin = self._find(name)
+            if plugin is None:
+                return None
+            start = time.time()
+            parser = self._load(plugin)(self.scraper)
+            self.load_times[name] = time.time() - start
+            self._parsers[name] = parser
+            return parser
+
+    def loaded(self):
+        """ Returns the names of the models already imported. """
+        return sorted(self._parsers.keys())
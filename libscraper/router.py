@@ -0,0 +1,190 @@
+"""
+URL routing index for fixtures targets.
+
+Patterns starting with a literal "scheme://host" are indexed by scheme and host:
+a URL is only tested against the patterns of its own host (plus patterns without
+a recognizable host), combined into a single alternation that reports which
+pattern matched and its groups. Target and pattern ordering is preserved, so the
+first matching pattern is the same as with a linear scan.
+
+Patterns are searched anywhere in the URL, as BaseParser.urlinfo always did.
+A host-indexed pattern holds "://", so in a URL whose only "://" follows its
+own scheme it can only match from the start: such URLs go through the index.
+URLs embedding other URLs (e.g. redirect or tracking URLs) are tested against
+every pattern, in order. The index is built on the first lookup, and patterns
+are only compiled once a URL has to be tested against them.
+
+"""
+import re
+import threading
+import urlparse
+from collections import OrderedDict
+
+# Literal "scheme://host[:port]" prefix of a pattern ('.' being the only metacharacter allowed)
+prefix_re = re.compile(r'^([a-z][a-z0-9+.-]*)://((?:[\w-]|\\?\.|:\d+)+)(?=/|$)')
+
+# Python 2 regular expressions support at most 100 groups
+MAX_GROUPS = 99
+
+
+class Route(object):
+    """ A target pattern, with its literal scheme and host (when found). """
+
+    def __init__(self, target, index):
+        self.target = target
+        self.index = index
+        self.scheme = None
+        self._host = None
+        source = target._sources[index]
+        m = prefix_re.match(source)
+        if m is not None:
+            self.scheme = m.group(1)
+            # a pattern ending with its host also matches longer hosts
+            self._host = m.group(2) + ('$' if m.end() < len(source) else '')
+            self._length = len(m.group(2).replace('\\.', '.'))
+
+    @property
+    def pattern(self):
+        return self.target._patterns[self.index]
+
+    def match_host(self, host):
+        """ False when the pattern cannot match URLs of host (the pattern itself is tested otherwise). """
+        if isinstance(self._host, basestring):
+            self._host = re.compile(self._host)
+        # the host part of the pattern matches a fixed number of characters: '.' may match past a shorter host
+        return len(host) < self._length or self._host.match(host) is not None
+
+
+class Alternation(object):
+    """ Several host-indexed routes combined into one regular expression. """
+
+    def __init__(self, routes):
+        self.routes = []
+        parts = []
+        group = 1
+        for route in routes:
+            self.routes.append((group, route.pattern.groups, route))
+            parts.append('({:s})'.format(route.pattern.pattern))
+            group += route.pattern.groups + 1
+        self.regex = re.compile('|'.join(parts))
+        self._by_group = dict((g, (g, n, r)) for g, n, r in self.routes)
+
+    def match(self, url):
+        m = self.regex.match(url)
+        if m is None:
+            return None
+        # The outer group of the matching alternative closes last
+        group, count, route = self._by_group[m.lastindex]
+        return route.target, m.groups()[group:group + count]
+
+
+class Single(object):
+    """ A route tested on its own (patterns without host, or not combinable). """
+
+    def __init__(self, route, anchored=True):
+        self.route = route
+        self.anchored = anchored
+
+    def match(self, url):
+        if self.anchored:
+            m = self.route.pattern.match(url)
+        else:
+            m = self.route.pattern.search(url)
+        if m is None:
+            return None
+        return self.route.target, m.groups()
+
+
+class Router(object):
+    """
+    Resolves URLs to (target, groups).
+
+        -- targets      list of fixtures.Target (the list may grow; the index is rebuilt)
+        -- memo_size    number of recent URL results kept
+
+    """
+
+    def __init__(self, targets, memo_size=1024):
+        self._targets = targets
+        self.memo_size = memo_size
+        self._lock = threading.Lock()
+        self._count = None
+
+    def _build(self):
+        self._count = len(self._targets)
+        self._routes = []
+        for target in self._targets:
+            for index in range(len(target._sources)):
+                self._routes.append(Route(target, index))
+        self._buckets = {}
+        self._memo = OrderedDict()
+
+    def _linear(self):
+        """ Returns the matchers of URLs holding "://" elsewhere than after their scheme: every pattern, searched. """
+        return [Single(route, anchored=False) for route in self._routes]
+
+    def _bucket(self, scheme, host):
+        """ Returns the ordered matchers for URLs of scheme://host (holding no other "://") """
+        matchers = []
+        run = []
+        groups = 0
+
+        def flush():
+            if len(run) == 1:
+                matchers.append(Single(run[0]))
+            elif run:
+                try:
+                    matchers.append(Alternation(run))
+                except (re.error, AssertionError, OverflowError):
+                    # e.g. back-references, which are renumbered once combined
+                    matchers.extend([Single(route) for route in run])
+            del run[:]
+
+        for route in self._routes:
+            if route.scheme is None:
+                flush()
+                groups = 0
+                matchers.append(Single(route, anchored=False))
+            elif route.scheme != scheme and scheme.endswith(route.scheme) and route.match_host(host):
+                # e.g. "http://..." found in "xhttp://...": searched, not matched from the start
+                flush()
+                groups = 0
+                matchers.append(Single(route, anchored=False))
+            elif route.scheme == scheme and route.match_host(host):
+                if groups + route.pattern.groups + 1 > MAX_GROUPS:
+                    flush()
+                    groups = 0
+                run.append(route)
+                groups += route.pattern.groups + 1
+        flush()
+        return matchers
+
+    def route(self, url):
+        """ Returns (target, groups) for the first pattern matching url, or None. """
+        with self._lock:
+            if len(self._targets) != self._count:
+                self._build()
+            if url in self._memo:
+                result = self._memo.pop(url)
+                self._memo[url] = result
+                return result
+            parts = urlparse.urlsplit(url)
+            if url.count('://') > (1 if url.find('://') == len(parts.scheme) else 0):
+                key = None
+            else:
+                key = (parts.scheme, parts.netloc)
+            matchers = self._buckets.get(key)
+            if matchers is None:
+                if len(self._buckets) >= self.memo_size:
+                    self._buckets.clear()
+                matchers = self._buckets[key] = self._linear() if key is None else self._bucket(*key)
+        result = None
+        for matcher in matchers:
+            result = matcher.match(url)
+            if result is not None:
+                break
+        with self._lock:
+            self._memo[url] = result
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return result
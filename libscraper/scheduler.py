@@ -0,0 +1,378 @@
+"""
+Crawl scheduler: when, and how often, feeds and deal pages are fetched.
+
+A Scheduler keeps a priority queue of jobs (a URL and the model method run
+on it: get_deals for feeds, get_deal for deal pages), runs them on a pool of
+threads and yields their results:
+
+    scheduler = Scheduler(scrpr, workers=4)
+    scheduler.add_feed('http://api.groupon.de/feed/api/v1/deals/oftheday/UK')
+    scheduler.add_deal(url, priority=5)
+    for job, result in scheduler.run():
+        ...
+
+- Rate limits: requests to a host go through a token bucket, refilled at the
+  rate of the host's fixtures.Target (rate / burst; default_rate and
+  default_burst otherwise).
+- Priorities: among due jobs, lower priority values run first.
+- Retries: jobs failing with a retryable status (Tree._code: 408, 429, 5xx)
+  are retried with exponential backoff and jitter, max_retries times; their
+  error is yielded after that (FetchError, or the exception raised).
+- Re-polling: repeating jobs (feeds, by default) are run again after their
+  interval, halved when the result changed since the previous run and grown
+  by half otherwise, within [min_interval, max_interval].
+
+Scheduler.stats() reports the queue depth, wait times (from a job being due
+to it being started) and the achieved requests per second of each host;
+wait times and requests are also sent to the Scraper's metrics ('wait',
+'requests', 'retries').
+
+"""
+import Queue
+import collections
+import heapq
+import itertools
+import random
+import threading
+import time
+from libscraper.batch import host_of
+from libscraper.exceptions import BodyTooLarge, FetchError
+from libscraper.parser import Tree
+
+RETRY_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter (not thread-safe).
+
+        -- rate     tokens added per second
+        -- burst    bucket capacity
+
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """ Takes a token; returns 0 if one was available, or the number of seconds until one is. """
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class Job(object):
+    """
+    A scheduled URL.
+
+        -- url          URL
+        -- method       Scraper model method ('get_deals' or 'get_deal')
+        -- priority     lower values run first
+        -- repeat       re-poll the URL after each run
+        -- interval     initial re-poll interval (seconds)
+
+    """
+
+    def __init__(self, url, method, priority, repeat, interval):
+        self.url = url
+        self.method = method
+        self.priority = priority
+        self.repeat = repeat
+        self.interval = interval
+        self.host = host_of(url)
+        self.due = time.time()
+        self.attempts = 0
+        self.runs = 0
+        self.changes = 0
+        self.fingerprint = None
+        self.cancelled = False
+
+    def __repr__(self):
+        return '<Job {:s} {:s} priority={!s} interval={:.0f}s>'.format(self.method, self.url, self.priority, self.interval)
+
+
+class HostStats(object):
+
+    def __init__(self, bucket, window):
+        self.bucket = bucket
+        self.window = window
+        self.requests = 0
+        self._recent = collections.deque()
+
+    def request(self, now):
+        self.requests += 1
+        self._recent.append(now)
+
+    def rps(self, now, started):
+        """ Requests per second achieved over the last window seconds. """
+        while self._recent and self._recent[0] < now - self.window:
+            self._recent.popleft()
+        return len(self._recent) / max(min(self.window, now - started), 1e-3)
+
+
+class Scheduler(object):
+    """
+    Crawl scheduler of a Scraper.
+
+        -- scraper          Scraper running the jobs
+        -- workers          number of jobs running concurrently
+        -- default_rate     requests per second to hosts without a rate limit in fixtures
+        -- default_burst    bucket capacity of hosts without a rate limit in fixtures
+        -- max_retries      retries of a job failing with a retryable status
+        -- backoff          first retry delay (seconds); doubled on each retry, with jitter
+        -- max_backoff      maximum retry delay (seconds)
+        -- min_interval     minimum re-poll interval (seconds)
+        -- max_interval     maximum re-poll interval (seconds)
+        -- window           period over which achieved requests per second are measured (seconds)
+
+    """
+
+    def __init__(self, scraper, workers=4, default_rate=1.0, default_burst=1, max_retries=4, backoff=2.0,
+                 max_backoff=300.0, min_interval=60.0, max_interval=6 * 3600.0, window=60.0):
+        self.scraper = scraper
+        self.workers = max(1, workers)
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.window = window
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._delayed = [] # (time, seq, job): jobs not due yet, or waiting for a token
+        self._ready = []   # (priority, seq, job): due jobs
+        self._running = 0
+        self._hosts = {}
+        self._results = Queue.Queue()
+        self._wake = object()
+        self._counts = collections.Counter()
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    # Jobs
+
+    def add(self, url, method='get_deals', priority=10, repeat=False, interval=None, delay=0):
+        """
+        Schedules a URL; returns its Job.
+
+            -- method       'get_deals' or 'get_deal'
+            -- priority     lower values run first
+            -- repeat       re-poll the URL (adaptively) after each run
+            -- interval     initial re-poll interval (defaults to min_interval)
+            -- delay        seconds before the first run
+
+        """
+        job = Job(url, method, priority, repeat, interval or self.min_interval)
+        job.due += delay
+        with self._lock:
+            heapq.heappush(self._delayed, (job.due, next(self._seq), job))
+        self._results.put(self._wake)
+        return job
+
+    def add_feed(self, url, priority=10, repeat=True, interval=None):
+        """ Schedules a feed (get_deals), re-polled by default. """
+        return self.add(url, 'get_deals', priority, repeat, interval)
+
+    def add_deal(self, url, priority=20, repeat=False, interval=None):
+        """ Schedules a deal page (get_deal). """
+        return self.add(url, 'get_deal', priority, repeat, interval)
+
+    def cancel(self, job):
+        """ Removes a job (a running job completes, but is not re-polled). """
+        job.cancelled = True
+
+    # Rate limits
+
+    def host(self, url):
+        """ Returns the HostStats (and token bucket) of the host of url. """
+        host = host_of(url)
+        stats = self._hosts.get(host)
+        if stats is None:
+            rate, burst = self.default_rate, self.default_burst
+            route = self.scraper.router.route(url.split('?').pop(0))
+            if route is not None and route[0]._rate:
+                rate, burst = route[0]._rate, route[0]._burst or 1
+            stats = self._hosts[host] = HostStats(TokenBucket(rate, burst), self.window)
+        return stats
+
+    # Retries and re-polling
+
+    def retryable(self, error):
+        """ Returns True if a failed job should be retried. """
+        if not isinstance(error, FetchError) or isinstance(error.tree._msg, BodyTooLarge):
+            return False # oversized bodies would be dropped again
+        return error.tree._code in RETRY_CODES
+
+    def retry_delay(self, attempts):
+        """ Exponential backoff with jitter: between half and all of backoff * 2 ** (attempts - 1). """
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def fingerprint(self, job, result):
+        """ Returns a value changing when the result of a job changes. """
+        if job.method == 'get_deals':
+            return hash(tuple(sorted(deal.get('hashid') or deal.get('link') for deal in result or [])))
+        return hash(repr(sorted(result.items()) if result else None))
+
+    def adapt(self, job, result):
+        """ Updates the re-poll interval of a job from its latest result. """
+        fingerprint = self.fingerprint(job, result)
+        if job.fingerprint is not None and fingerprint != job.fingerprint:
+            job.changes += 1
+            job.interval = max(self.min_interval, job.interval / 2)
+        elif job.fingerprint is not None:
+            job.interval = min(self.max_interval, job.interval * 1.5)
+        job.fingerprint = fingerprint
+
+    # Execution
+
+    def execute(self, job):
+        """ Runs a job (on a worker thread); returns its result, or raises FetchError. """
+        scrpr = self.scraper
+        parser = scrpr.model(job.url)
+        fetched = parser.fetch(job.url)
+        if isinstance(fetched, Tree):
+            raise FetchError(fetched)
+        # parse() returns the fetched page to the model method, on this thread
+        parser.prefetch(job.url, fetched)
+        return scrpr.call(parser, job.method, job.url)
+
+    def _work(self, tasks):
+        while True:
+            job = tasks.get()
+            if job is None:
+                return
+            try:
+                result, error = self.execute(job), None
+            except Exception as e:
+                result, error = None, e
+            self._results.put((job, result, error))
+
+    def _dispatch(self, tasks, now):
+        """ Starts due jobs, by priority, as long as workers are free and their hosts have tokens. """
+        while self._delayed and self._delayed[0][0] <= now:
+            job = heapq.heappop(self._delayed)[2]
+            if not job.cancelled:
+                heapq.heappush(self._ready, (job.priority, next(self._seq), job))
+        while self._ready and self._running < self.workers:
+            job = heapq.heappop(self._ready)[2]
+            if job.cancelled:
+                continue
+            host = self.host(job.url)
+            delay = host.bucket.take(now)
+            if delay:
+                # Waits for a token of its host; other hosts' jobs go ahead
+                heapq.heappush(self._delayed, (now + delay, next(self._seq), job))
+                continue
+            wait = max(now - job.due, 0.0)
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self._counts['started'] += 1
+            host.request(now)
+            self.scraper.metrics.timing('wait', wait, host=job.host)
+            self.scraper.metrics.count('requests', host=job.host)
+            self._running += 1
+            tasks.put(job)
+
+    def _complete(self, job, result, error, now):
+        """ Reschedules a finished job; returns True if its result (or error) is to be yielded. """
+        self._running -= 1
+        if error is not None and job.attempts < self.max_retries and self.retryable(error):
+            job.attempts += 1
+            job.due = now + self.retry_delay(job.attempts)
+            self._counts['retries'] += 1
+            self.scraper.metrics.count('retries', host=job.host)
+            heapq.heappush(self._delayed, (job.due, next(self._seq), job))
+            return False
+        job.attempts = 0
+        job.runs += 1
+        self._counts['failed' if error is not None else 'completed'] += 1
+        if error is None and job.repeat:
+            self.adapt(job, result)
+        if job.repeat and not job.cancelled:
+            job.due = now + job.interval
+            heapq.heappush(self._delayed, (job.due, next(self._seq), job))
+        return True
+
+    def run(self, duration=None):
+        """
+        Runs the scheduled jobs; yields (job, result) tuples as they complete. Errors (FetchError
+        once retries are exhausted, ElementMissing, TargetPatternNotFound, ...) are yielded in place
+        of results. Returns when no job is left (repeating jobs stay queued), or after duration seconds.
+
+        """
+        deadline = None if duration is None else time.time() + duration
+        tasks = Queue.Queue()
+        threads = [threading.Thread(target=self._work, args=(tasks,)) for _ in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while True:
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    return
+                with self._lock:
+                    self._dispatch(tasks, now)
+                    if not self._running and not self._ready and not self._delayed:
+                        return
+                    timeout = 1.0
+                    if self._delayed:
+                        timeout = min(timeout, max(self._delayed[0][0] - now, 0.001))
+                    if deadline is not None:
+                        timeout = min(timeout, max(deadline - now, 0.001))
+                # Use a timeout so KeyboardInterrupt is delivered to the main thread
+                try:
+                    item = self._results.get(timeout=timeout)
+                except Queue.Empty:
+                    continue
+                if item is self._wake:
+                    continue
+                job, result, error = item
+                with self._lock:
+                    report = self._complete(job, result, error, time.time())
+                if report:
+                    yield job, error if error is not None else result
+        finally:
+            # Workers finish their current job and exit: its result is handled by the next run() call
+            for _ in threads:
+                tasks.put(None)
+
+    # Observability
+
+    def stats(self):
+        """ Returns queue depth, wait time, job counts and per-host request rates. """
+        now = time.time()
+        with self._lock:
+            started = self._counts['started']
+            return {
+                'queued': len(self._delayed) + len(self._ready),
+                'due': len(self._ready) + sum(1 for entry in self._delayed if entry[0] <= now),
+                'running': self._running,
+                'started': started,
+                'completed': self._counts['completed'],
+                'failed': self._counts['failed'],
+                'retries': self._counts['retries'],
+                'wait': {
+                    'mean': self._wait_total / started if started else 0.0,
+                    'max': self._wait_max,
+                },
+                'hosts': dict((host, {
+                    'rate': stats.bucket.rate,
+                    'burst': stats.bucket.burst,
+                    'requests': stats.requests,
+                    'rps': stats.rps(now, self.started),
+                }) for host, stats in self._hosts.items()),
+            }
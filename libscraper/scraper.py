@@ -1,16 +1,74 @@
+import threading
 from exceptions import TargetPatternNotFound, ElementMissing
 from fixtures import targets
-from parser import BaseParser
-from utils import Logger
+from metrics import Metrics
+from batch import run_batch
+from registry import ModelRegistry
+from router import Router
+from utils import Counters, Logger
+
+# The parser (lxml), session and transport (urllib2) and pipeline (multiprocessing)
+# modules are imported on first use: e.g. listing targets needs none of them.
 
 
 class Scraper(object):
 
-    def __init__(self, verbose=False):
+    def __init__(self, verbose=False, session=None, transport=None, max_body_size=64 * 1024 * 1024, proxies=None):
+        """
+            -- verbose          print debug messages
+            -- session          Session shared by all parsers (keep-alive connections, DNS cache);
+                                a default Session is created on first use when none is given
+            -- transport        transport fetching URLs (see transport.py); defaults to urllib2 through session.
+            -- max_body_size    maximum size of a (decoded) response body, in bytes: larger responses
+                                are dropped as soon as detected, giving an error Tree (None: no limit)
+            -- proxies          proxies.ProxyPool (or list of "IP:port" addresses) requests are spread over,
+                                unless a proxy is given to parse()
+
+        """
         self.logger = Logger(verbose=verbose)
+        self.metrics = Metrics()
+        self._session = session
+        self._transport = transport
+        self.max_body_size = max_body_size
+        if proxies is not None and not hasattr(proxies, 'acquire'):
+            from proxies import ProxyPool
+            proxies = ProxyPool(proxies)
+        self.proxies = proxies
+        self._bound = False
+        self._lock = threading.RLock()
         self._targets = targets
+        self.router = Router(self._targets)
+        self.models = ModelRegistry(self)
+        self.parse_stats = Counters('XML', 'HTML', 'fallback', 'errors')
+        self._lxml_parsers = threading.local()
         self._parser = None
 
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    from session import Session
+                    self._session = Session()
+        return self._session
+
+    @property
+    def transport(self):
+        """ Transport fetching URLs, bound to the session on first use. """
+        if not self._bound:
+            with self._lock:
+                if not self._bound:
+                    if self._transport is None:
+                        from transport import UrllibTransport
+                        self._transport = UrllibTransport(self.session)
+                    self._transport.bind(self.session)
+                    self._bound = True
+        return self._transport
+
+    def _base_parser(self):
+        from parser import BaseParser
+        return BaseParser(self)
+
     def urlinfo(self, url):
         """
         Initializes Parser Model.
@@ -18,7 +76,7 @@ class Scraper(object):
 
         """
         if not self._parser:
-            self._parser = BaseParser(self)
+            self._parser = self._base_parser()
         try:
             info = self._parser.urlinfo(url, init=True)
         except TargetPatternNotFound:
@@ -30,17 +88,31 @@ class Scraper(object):
                 self.logger.debug('Using model "%s"' % self._parser.name)
             return info
 
-    def parse(self, url, headers=None, proxy=None):
+    def parse(self, url, headers=None, proxy=None, ptype=None):
         """ Returns Tree object """
         if not self._parser:
-            self._parser = BaseParser(self)
-        return self._parser.parse(url, headers, proxy)
+            self._parser = self._base_parser()
+        return self._parser.parse(url, headers, proxy, ptype=ptype)
             
     def get_deals(self, url):
         if not url:
             return []
         self.urlinfo(url) # initialize parser model
-        return self._parser.get_deals(url)
+        return self.call(self._parser, 'get_deals', url)
+
+    def get_new_deals(self, url, store):
+        """ Returns the deals of url not yet recorded in store (seen.SeenStore) """
+        if not url:
+            return []
+        self.urlinfo(url) # initialize parser model
+        return self.call(self._parser, 'get_new_deals', url, store)
+
+    def iter_deals(self, url):
+        """ Yields deals one at a time; models with streaming support keep memory use flat. """
+        if not url:
+            return iter([])
+        self.urlinfo(url) # initialize parser model
+        return self._parser.iter_deals(url)
 
     def get_deal(self, url=''):
         if not url:
@@ -52,7 +124,83 @@ class Scraper(object):
             return {}
         else:
             try:
-                return self._parser.get_deal(url)
+                return self.call(self._parser, 'get_deal', url)
             except ElementMissing as e:
                 self.logger.debug(' >> Element Missing - {:s}'.format(e))
                 return {}
+
+    def call(self, parser, method, url, *args):
+        """ Calls a model method, timing it (and counting its errors) when metrics are enabled. """
+        with self.metrics.span(method, model=parser.name):
+            return getattr(parser, method)(url, *args)
+
+    def model(self, url):
+        """
+        Returns the Parser model for a URL, without changing the Scraper's current model.
+        Raises TargetPatternNotFound if the URL does not match any known pattern.
+
+        """
+        route = self.router.route(url.split('?').pop(0))
+        if route is None:
+            raise TargetPatternNotFound()
+        parser = self.models.get(route[0]._parser)
+        if parser is None:
+            return self._base_parser()
+        return parser
+
+    def get_deals_many(self, urls, workers=8, per_host=4):
+        """
+        Fetches feeds concurrently; yields (url, deals) tuples as they complete.
+        Errors (e.g. TargetPatternNotFound) are yielded in place of deals.
+
+            -- workers      size of the thread pool
+            -- per_host     maximum number of concurrent requests per host
+
+        """
+        return run_batch(lambda url: self.call(self.model(url), 'get_deals', url), urls, workers, per_host)
+
+    def get_deal_many(self, urls, workers=8, per_host=4):
+        """
+        Fetches deal pages concurrently; yields (url, deal) tuples as they complete.
+        Errors (e.g. ElementMissing, TargetPatternNotFound) are yielded in place of deals.
+
+            -- workers      size of the thread pool
+            -- per_host     maximum number of concurrent requests per host
+
+        """
+        return run_batch(lambda url: self.call(self.model(url), 'get_deal', url), urls, workers, per_host)
+
+    def _pipelined(self, method, urls, workers, fetch_workers, per_host, ordered):
+        from pipeline import Pipeline
+        pipeline = Pipeline(self, workers=workers, fetch_workers=fetch_workers, per_host=per_host)
+        try:
+            for item in pipeline.run(urls, method, ordered=ordered):
+                yield item
+        finally:
+            pipeline.close()
+
+    def get_deals_pipelined(self, urls, workers=None, fetch_workers=8, per_host=4, ordered=False):
+        """
+        Fetches feeds on threads and extracts their deals on a pool of processes (see pipeline.py);
+        yields (url, deals) tuples. Errors are yielded in place of deals.
+
+            -- workers          number of extraction processes (defaults to the number of CPUs)
+            -- fetch_workers    number of fetching threads
+            -- per_host         maximum number of concurrent requests per host
+            -- ordered          yield results in the order of urls (instead of completion order)
+
+        """
+        return self._pipelined('get_deals', urls, workers, fetch_workers, per_host, ordered)
+
+    def get_deal_pipelined(self, urls, workers=None, fetch_workers=8, per_host=4, ordered=False):
+        """
+        Fetches deal pages on threads and extracts them on a pool of processes (see pipeline.py);
+        yields (url, deal) tuples. Errors (e.g. ElementMissing) are yielded in place of deals.
+
+            -- workers          number of extraction processes (defaults to the number of CPUs)
+            -- fetch_workers    number of fetching threads
+            -- per_host         maximum number of concurrent requests per host
+            -- ordered          yield results in the order of urls (instead of completion order)
+
+        """
+        return self._pipelined('get_deal', urls, workers, fetch_workers, per_host, ordered)
@@ -0,0 +1,315 @@
+"""
+Persistent store of already seen deals, used by incremental scraping.
+
+Keys are SHA256 digests: deal hashids, and fingerprints of raw feed items
+(letting models skip the extraction of unchanged items altogether). Keys are
+kept in a SQLite database; an in-memory Bloom filter answers most lookups of
+new keys without touching the database.
+
+    store = SeenStore('/var/lib/scraper/seen.db')
+    deals = scrpr.get_new_deals(url, store)
+
+The Bloom filter is sized from the number of keys in the database, and grows
+with it (a scalable Bloom filter: a larger filter, with a lower false positive
+rate, is added whenever the last one is full), so the false positive rate
+stays bounded whatever the number of keys.
+
+It is saved next to the database: commit() appends the keys added since the
+last commit to a journal, and the whole filter is written on close() (and
+once the journal grows larger than the filter). A filter whose key count does
+not match the database (e.g. after a crash) is rebuilt from the database.
+
+"""
+import binascii
+import hashlib
+import math
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+
+class BloomFilter(object):
+    """
+    Bloom filter over digests.
+
+        -- capacity     expected number of keys
+        -- error_rate   false positive rate at capacity
+
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = 0  # keys added
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest):
+        # Double hashing on two 64-bit halves of the digest
+        h1, h2 = struct.unpack('<QQ', digest[:16])
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, digest):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest):
+        for position in self._positions(digest):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class ScalableBloomFilter(object):
+    """
+    Bloom filter growing with its keys: a series of Bloom filters, each twice as large as the previous one,
+    with a false positive rate halved (the overall rate stays below error_rate).
+
+        -- capacity     capacity of the first filter
+        -- error_rate   overall false positive rate
+
+    """
+
+    growth = 2
+    tightening = 0.5
+
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filters = []
+
+    def _grow(self):
+        n = len(self.filters)
+        self.filters.append(BloomFilter(self.capacity * self.growth ** n,
+                                        self.error_rate * (1 - self.tightening) * self.tightening ** n))
+
+    def add(self, digest):
+        if not self.filters or self.filters[-1].count >= self.filters[-1].capacity:
+            self._grow()
+        self.filters[-1].add(digest)
+
+    def __contains__(self, digest):
+        for bloom in self.filters:
+            if digest in bloom:
+                return True
+        return False
+
+    def __len__(self):
+        return sum(bloom.count for bloom in self.filters)
+
+    def nbytes(self):
+        return sum(len(bloom.bits) for bloom in self.filters)
+
+    def save(self, path, generation, total):
+        """ Writes the whole filter to path, with a generation number (see BloomJournal) and the database key count. """
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(struct.pack('<QdQQQ', self.capacity, self.error_rate, generation, total, len(self.filters)))
+            for bloom in self.filters:
+                f.write(struct.pack('<Q', bloom.count))
+                f.write(bloom.bits)
+        os.rename(tmp, path)
+
+    def load(self, path):
+        """ Loads a filter saved with the same error rate; returns its (generation, database key count), or None. """
+        try:
+            with open(path, 'rb') as f:
+                capacity, error_rate, generation, total, count = struct.unpack('<QdQQQ', f.read(40))
+                if error_rate != self.error_rate:
+                    return None
+                self.capacity = capacity
+                self.filters = []
+                for _ in range(count):
+                    self._grow()
+                    bloom = self.filters[-1]
+                    bloom.count, = struct.unpack('<Q', f.read(8))
+                    bits = bytearray(f.read(len(bloom.bits)))
+                    if len(bits) != len(bloom.bits):
+                        raise IOError('truncated Bloom filter')
+                    bloom.bits = bits
+        except (IOError, struct.error):
+            self.filters = []
+            return None
+        return generation, total
+
+
+class BloomJournal(object):
+    """
+    Keys added to a saved ScalableBloomFilter since it was saved.
+    Each commit appends a record: its keys, and the number of keys in the database once committed.
+
+        -- path     journal path
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+
+    def replay(self, bloom, generation):
+        """ Adds the journal keys to bloom; returns the key count of the last record (None for another generation). """
+        count = None
+        try:
+            with open(self.path, 'rb') as f:
+                journal_generation, = struct.unpack('<Q', f.read(8))
+                if journal_generation != generation:
+                    return None
+                while True:
+                    head = f.read(16)
+                    if len(head) < 16:
+                        break # end of the journal, or a record interrupted by a crash
+                    keys, total = struct.unpack('<QQ', head)
+                    data = f.read(keys * 16)
+                    if len(data) < keys * 16:
+                        break
+                    for i in range(keys):
+                        bloom.add(data[i * 16:(i + 1) * 16])
+                    count = total
+                self.size = f.tell()
+        except (IOError, struct.error):
+            return None
+        return count
+
+    def reset(self, generation):
+        with open(self.path, 'wb') as f:
+            f.write(struct.pack('<Q', generation))
+        self.size = 8
+
+    def append(self, keys, total):
+        data = struct.pack('<QQ', len(keys), total) + ''.join(keys)
+        with open(self.path, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.size += len(data)
+
+
+class SeenStore(object):
+    """
+    Seen deals store.
+
+        -- path         SQLite database path (the Bloom filter and its journal are saved next to it)
+        -- capacity     minimum capacity of the first Bloom filter (twice the number of keys when larger)
+        -- error_rate   Bloom filter false positive rate
+
+    """
+
+    def __init__(self, path, capacity=1000000, error_rate=0.01):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = []  # keys added since the last commit
+        self._journal = BloomJournal(path + '.bloom.log')
+        self._generation = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS seen (key BLOB PRIMARY KEY, kind TEXT, first_seen REAL)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS links (link TEXT PRIMARY KEY, hashid BLOB, updated REAL)')
+        self._db.commit()
+        self.counters = {'new': 0, 'changed': 0, 'unchanged': 0, 'items_skipped': 0, 'db_lookups': 0}
+        count = self._count()
+        self.bloom = ScalableBloomFilter(capacity, error_rate)
+        loaded = self.bloom.load(self._bloom_path())
+        if loaded is not None:
+            self._generation, total = loaded
+            replayed = self._journal.replay(self.bloom, self._generation)
+            if replayed is not None:
+                total = replayed
+        if loaded is None or total != count:
+            self.bloom = ScalableBloomFilter(max(capacity, 2 * count), error_rate)
+            for (key,) in self._db.execute('SELECT key FROM seen'):
+                self.bloom.add(str(key))
+            self._save(count)
+
+    def _bloom_path(self):
+        return self.path + '.bloom'
+
+    def _save(self, count):
+        self._generation += 1
+        self.bloom.save(self._bloom_path(), self._generation, count)
+        self._journal.reset(self._generation)
+
+    def _count(self):
+        # Keys are never deleted: the last rowid is the number of keys, without a table scan
+        return self._db.execute('SELECT MAX(rowid) FROM seen').fetchone()[0] or 0
+
+    @staticmethod
+    def fingerprint(data):
+        """ Returns the digest of raw data (e.g. a serialized feed item). """
+        return hashlib.sha256(data).digest()
+
+    def _seen(self, key):
+        if key not in self.bloom:
+            return False
+        self.counters['db_lookups'] += 1
+        row = self._db.execute('SELECT 1 FROM seen WHERE key = ?', (sqlite3.Binary(key),)).fetchone()
+        return row is not None
+
+    def _add(self, key, kind):
+        self.bloom.add(key)
+        self._pending.append(key[:16])  # the Bloom filter hashes the first 16 bytes
+        self._db.execute('INSERT OR IGNORE INTO seen (key, kind, first_seen) VALUES (?, ?, ?)',
+                         (sqlite3.Binary(key), kind, time.time()))
+
+    def seen_item(self, fingerprint):
+        """ True if a feed item with this fingerprint was already processed. """
+        with self._lock:
+            if self._seen(fingerprint):
+                self.counters['items_skipped'] += 1
+                return True
+            return False
+
+    def add_item(self, fingerprint):
+        with self._lock:
+            self._add(fingerprint, 'item')
+
+    def add_deal(self, deal):
+        """
+        Records a deal; returns True if it is new or changed (i.e. its hashid was never seen).
+        A deal is changed when its link was seen before with a different hashid.
+
+        """
+        key = getattr(deal, 'digest', None) or binascii.unhexlify(deal['hashid'])
+        with self._lock:
+            if self._seen(key):
+                self.counters['unchanged'] += 1
+                return False
+            self._add(key, 'deal')
+            link = deal.get('link')
+            if link:
+                previous = self._db.execute('SELECT hashid FROM links WHERE link = ?', (link,)).fetchone()
+                self.counters['changed' if previous is not None else 'new'] += 1
+                self._db.execute('INSERT OR REPLACE INTO links (link, hashid, updated) VALUES (?, ?, ?)',
+                                 (link, sqlite3.Binary(key), time.time()))
+            else:
+                self.counters['new'] += 1
+            return True
+
+    def commit(self):
+        """ Commits pending keys, journaling them for the Bloom filter (saved whole once the journal outgrows it). """
+        with self._lock:
+            count = self._count()
+            if self._pending:
+                # Journaled first: keys committed to the database are always found in the journal
+                self._journal.append(self._pending, count)
+                self._pending = []
+            self._db.commit()
+            if self._journal.size > self.bloom.nbytes():
+                self._save(count)
+
+    def close(self):
+        """ Commits pending keys and saves the whole Bloom filter. """
+        self.commit()
+        with self._lock:
+            if self._journal.size > 8:
+                self._save(self._count())
+            self._db.close()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['keys'] = self._count()
+        return stats
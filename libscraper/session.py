@@ -0,0 +1,342 @@
+"""
+The Session module provides persistent HTTP connections.
+
+A Session owns per-host pools of keep-alive connections and a DNS cache,
+so consecutive requests to the same site skip the DNS lookup, TCP handshake
+and TLS negotiation. Sessions plug into urllib2 as regular handlers, which
+keeps redirects, proxies and HTTPError/URLError handling unchanged.
+
+"""
+import httplib
+import socket
+import threading
+import time
+import urllib
+import urllib2
+
+
+class DNSCache(object):
+    """ Caches resolved addresses for a limited time (ttl, in seconds). """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def cached(self, host, port):
+        """ Returns cached addresses for host, or None (never blocks). """
+        with self._lock:
+            entry = self._entries.get((host, port))
+            if entry is not None and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+        return None
+
+    def resolve(self, host, port):
+        key = (host, port)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (now + self.ttl, addresses)
+        return addresses
+
+    def flush(self):
+        with self._lock:
+            self._entries.clear()
+
+    def create_connection(self, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+        """ Drop-in replacement for socket.create_connection using cached addresses. """
+        host, port = address
+        err = None
+        for af, socktype, proto, canonname, sa in self.resolve(host, port):
+            sock = None
+            try:
+                sock = socket.socket(af, socktype, proto)
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(sa)
+                return sock
+            except socket.error as e:
+                err = e
+                if sock is not None:
+                    sock.close()
+        # Cached addresses may be stale
+        with self._lock:
+            self._entries.pop((host, port), None)
+        if err is not None:
+            raise err
+        raise socket.error("getaddrinfo returns an empty list")
+
+
+class ConnectionPool(object):
+    """
+    Holds idle connections, grouped by key (scheme, host, tunnel host).
+
+        -- maxsize          maximum number of idle connections kept per key
+        -- idle_timeout     idle connections older than this (in seconds) are discarded
+
+    """
+
+    def __init__(self, maxsize=10, idle_timeout=60):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns an idle connection for key, or None. """
+        expired = []
+        conn = None
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                c, last_used = idle.pop()
+                if now - last_used > self.idle_timeout:
+                    expired.append(c)
+                else:
+                    conn = c
+                    break
+        for c in expired:
+            c.close()
+        return conn
+
+    def put(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def size(self, key=None):
+        with self._lock:
+            if key is not None:
+                return len(self._idle.get(key, []))
+            return sum([len(idle) for idle in self._idle.values()])
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, last_used in conns:
+                conn.close()
+
+
+class PooledResponse(object):
+    """
+    File-like wrapper around an httplib response.
+    The underlying connection is handed back to its pool once the body has been fully read,
+    or discarded when the response is closed early.
+
+    """
+
+    def __init__(self, response, release):
+        self._response = response
+        self._release = release
+
+    def _done(self, reusable):
+        if self._release is not None:
+            release, self._release = self._release, None
+            release(reusable and not self._response.will_close)
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        if self._response.isclosed() or (amt is None or amt > 0) and not data:
+            self._done(True)
+        return data
+
+    def readline(self, limit=-1):
+        # httplib responses do not support readline on chunked bodies; buffer instead
+        chunks = []
+        while limit < 0 or len(chunks) < limit:
+            c = self.read(1)
+            if not c:
+                break
+            chunks.append(c)
+            if c == '\n':
+                break
+        return ''.join(chunks)
+
+    def readlines(self, sizehint=0):
+        return self.read().splitlines(True)
+
+    def fileno(self):
+        return None
+
+    def close(self):
+        if self._release is not None:
+            reusable = self._response.isclosed()
+            self._response.close()
+            self._done(reusable)
+
+
+class KeepAliveMixin(object):
+    """ Shared do_open implementation for keep-alive HTTP and HTTPS handlers. """
+
+    def __init__(self, session):
+        self._session = session
+
+    def do_keepalive_open(self, http_class, req, **http_conn_args):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        key = (http_class.__name__, host, req._tunnel_host)
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items() if k not in headers))
+        headers['Connection'] = 'keep-alive'
+        headers = dict((name.title(), val) for name, val in headers.items())
+        tunnel_headers = {}
+        if req._tunnel_host and 'Proxy-Authorization' in headers:
+            tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+
+        session = self._session
+        conn = session.pool.get(key)
+        while True:
+            reused = conn is not None
+            if not reused:
+                conn = http_class(host, timeout=req.timeout, **http_conn_args)
+                conn._create_connection = session.dns.create_connection
+                if req._tunnel_host:
+                    conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+            else:
+                conn.timeout = req.timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(req.timeout)
+            try:
+                conn.request(req.get_method(), req.get_selector(), req.data, headers)
+                r = conn.getresponse(buffering=True)
+            except (socket.error, httplib.HTTPException) as err:
+                conn.close()
+                if reused:
+                    # The server dropped an idle connection; retry on a fresh one
+                    session._count('stale_retries')
+                    conn = None
+                    continue
+                raise urllib2.URLError(err)
+            break
+        session._count('requests')
+        session._count('connections_reused' if reused else 'connections_opened')
+
+        def release(reusable):
+            if reusable:
+                session.pool.put(key, conn)
+            else:
+                conn.close()
+
+        fp = PooledResponse(r, release)
+        resp = urllib.addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+
+class KeepAliveHTTPHandler(KeepAliveMixin, urllib2.HTTPHandler):
+
+    def __init__(self, session, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        KeepAliveMixin.__init__(self, session)
+
+    def http_open(self, req):
+        return self.do_keepalive_open(httplib.HTTPConnection, req)
+
+
+if hasattr(httplib, 'HTTPS'):
+    class KeepAliveHTTPSHandler(KeepAliveMixin, urllib2.HTTPSHandler):
+
+        def __init__(self, session, debuglevel=0, context=None):
+            urllib2.HTTPSHandler.__init__(self, debuglevel)
+            KeepAliveMixin.__init__(self, session)
+            self._ssl_context = context
+
+        def https_open(self, req):
+            if self._ssl_context is not None:
+                return self.do_keepalive_open(httplib.HTTPSConnection, req, context=self._ssl_context)
+            return self.do_keepalive_open(httplib.HTTPSConnection, req)
+else:
+    KeepAliveHTTPSHandler = None
+
+
+class Session(object):
+    """
+    Persistent HTTP session, shared by all parsers of a Scraper.
+
+        -- pool_size        maximum number of idle connections kept per host
+        -- idle_timeout     seconds after which an idle connection is discarded
+        -- dns_ttl          seconds a resolved host address is cached for
+        -- ssl_context      optional ssl.SSLContext used for HTTPS connections
+        -- cache            optional cache.ResponseCache
+
+    """
+
+    def __init__(self, pool_size=10, idle_timeout=60, dns_ttl=300, ssl_context=None, cache=None):
+        self.pool = ConnectionPool(maxsize=pool_size, idle_timeout=idle_timeout)
+        self.dns = DNSCache(ttl=dns_ttl)
+        self.cache = cache
+        self._ssl_context = ssl_context
+        self._openers = {}
+        self._counters = {
+            'requests': 0,
+            'connections_opened': 0,
+            'connections_reused': 0,
+            'stale_retries': 0,
+        }
+        self._lock = threading.Lock()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def handlers(self):
+        """ Returns the keep-alive urllib2 handlers bound to this session. """
+        handlers = [KeepAliveHTTPHandler(self)]
+        if KeepAliveHTTPSHandler is not None:
+            handlers.append(KeepAliveHTTPSHandler(self, context=self._ssl_context))
+        if self.cache is not None:
+            handlers.append(self.cache)
+        return handlers
+
+    def opener(self, proxy=None):
+        """
+        Returns the (cached) urllib2 opener for the given proxy ("IP:port", used for http and https URLs).
+        Without a proxy, environment proxy settings apply, as with urllib2.build_opener().
+
+        """
+        with self._lock:
+            opener = self._openers.get(proxy)
+            if opener is None:
+                handlers = self.handlers()
+                if proxy is not None:
+                    # https requests are tunnelled through the proxy (CONNECT); connections are pooled per proxy
+                    handlers.insert(0, urllib2.ProxyHandler({'http': proxy, 'https': proxy}))
+                opener = urllib2.build_opener(*handlers)
+                self._openers[proxy] = opener
+        return opener
+
+    def open(self, request, proxy=None, timeout=10):
+        return self.opener(proxy).open(request, timeout=timeout)
+
+    def close(self):
+        """ Closes all idle connections. """
+        self.pool.clear()
+
+    def stats(self):
+        """ Returns request, connection reuse and DNS cache counters. """
+        with self._lock:
+            stats = dict(self._counters)
+        connections = stats['connections_opened'] + stats['connections_reused']
+        stats['reuse_rate'] = float(stats['connections_reused']) / connections if connections else 0.0
+        stats['idle_connections'] = self.pool.size()
+        stats['dns_hits'] = self.dns.hits
+        stats['dns_misses'] = self.dns.misses
+        return stats
@@ -0,0 +1,171 @@
+"""
+Volume tracking: polls live deals for their volatile fields (status, volume).
+
+    tracker = VolumeTracker(Scraper())
+    tracker.add(urls)
+    for sample in tracker.poll():
+        store(sample)           # Sample(rel_id='12345', timestamp=1358154000.0, volume=1234, status=1)
+    tracker.static(url)         # Deal captured on the first poll of url (merchant, addresses, prices)
+
+The first poll of a deal runs its model's get_deal, capturing the static
+fields; later polls run get_deal_status only, the model's lightweight
+extraction path (Groupon reads the status and sold amount off the raw page,
+without building the document tree, extracting prices or cleaning addresses).
+
+On capture, the lightweight path is checked against get_deal on the same
+page: deals it disagrees with keep being polled with get_deal. Expired deals
+(status 0) are reported once, then dropped, unless drop_expired is False.
+
+"""
+import collections
+import threading
+import time
+from libscraper.batch import run_batch
+from libscraper.exceptions import ElementMissing, FetchError, TargetPatternNotFound
+from libscraper.parser import Tree
+
+Sample = collections.namedtuple('Sample', 'rel_id timestamp volume status')
+SAMPLE_FIELDS = Sample._fields
+
+
+class TrackedDeal(object):
+
+    __slots__ = ('url', 'rel_id', 'static', 'full', 'last')
+
+    def __init__(self, url, rel_id):
+        self.url = url
+        self.rel_id = rel_id
+        self.static = None  # Deal captured by get_deal
+        self.full = False   # True when get_deal_status disagrees with get_deal
+        self.last = None    # last Sample
+
+
+class VolumeTracker(object):
+    """
+    Polls a set of deal pages for their status and volume.
+
+        -- scraper          Scraper used to fetch and extract the deals
+        -- workers          number of deals polled concurrently
+        -- per_host         maximum number of concurrent requests per host
+        -- drop_expired     stop tracking deals once reported expired (status 0)
+
+    """
+
+    def __init__(self, scraper, workers=8, per_host=4, drop_expired=True):
+        self.scraper = scraper
+        self.workers = workers
+        self.per_host = per_host
+        self.drop_expired = drop_expired
+        self.errors = {}    # url -> exception of its last poll, if it failed
+        self._deals = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, urls):
+        """
+        Starts tracking deal URLs (a URL or an iterable of URLs).
+        URLs not matching any target are recorded in errors, and not tracked.
+
+        """
+        if isinstance(urls, basestring):
+            urls = [urls]
+        for url in urls:
+            with self._lock:
+                if url in self._deals:
+                    continue
+            try:
+                rel_id = self.scraper.model(url).urlinfo(url).get('rel_id')
+            except TargetPatternNotFound as e:
+                self.errors[url] = e
+                continue
+            with self._lock:
+                self._deals.setdefault(url, TrackedDeal(url, rel_id))
+
+    def remove(self, url):
+        with self._lock:
+            self._deals.pop(url, None)
+
+    def urls(self):
+        with self._lock:
+            return self._deals.keys()
+
+    def __len__(self):
+        return len(self._deals)
+
+    def static(self, url):
+        """ Returns the deal captured on the first poll of url (None until then). """
+        with self._lock:
+            tracked = self._deals.get(url)
+        return tracked.static if tracked is not None else None
+
+    def last(self, url):
+        """ Returns the last Sample of url, or None. """
+        with self._lock:
+            tracked = self._deals.get(url)
+        return tracked.last if tracked is not None else None
+
+    def poll(self, changes_only=False):
+        """
+        Polls every tracked deal; yields Samples as they complete.
+        Failed polls are recorded in errors (and retried on the next poll).
+
+            -- changes_only     only yield samples whose volume or status changed since the last poll
+
+        """
+        for url, result in run_batch(self.poll_url, self.urls(), self.workers, self.per_host):
+            if isinstance(result, Exception):
+                self.scraper.logger.debug(' >> {:s}: {:s} {!s}'.format(url, type(result).__name__, result))
+                self.errors[url] = result
+                continue
+            self.errors.pop(url, None)
+            sample, previous = result
+            if self.drop_expired and sample.status == 0:
+                self.remove(url)
+            if not changes_only or previous is None or previous[2:] != sample[2:]:
+                yield sample
+
+    def poll_url(self, url):
+        """ Polls a tracked deal; returns its Sample and the previous one. """
+        with self._lock:
+            tracked = self._deals[url]
+        parser = self.scraper.model(url)
+        if tracked.static is None or tracked.full:
+            deal = self.capture(tracked, parser)
+        else:
+            deal = self.scraper.call(parser, 'get_deal_status', url)
+        if deal.get('status') is None:
+            # e.g. a page get_deal does not extract: an error, not a sample without values
+            raise ElementMissing('{:s}:status:'.format(url))
+        sample = Sample(tracked.rel_id, time.time(), deal.get('volume'), deal.get('status'))
+        previous, tracked.last = tracked.last, sample
+        return sample, previous
+
+    def capture(self, tracked, parser):
+        """ Runs get_deal on a tracked deal, keeping its static fields and checking get_deal_status against it. """
+        url = tracked.url
+        raw = parser.fetch(url)
+        if isinstance(raw, Tree):
+            raise FetchError(raw)
+        parser.prefetch(url, raw)
+        deal = self.scraper.call(parser, 'get_deal', url)
+        if deal and tracked.static is None:
+            parser.prefetch(url, raw)
+            light = parser.get_deal_status(url)
+            if (light.get('status'), light.get('volume')) != (deal.get('status'), deal.get('volume')):
+                self.scraper.logger.debug(' >> {:s}: get_deal_status disagrees with get_deal, polled with get_deal'.format(url))
+                tracked.full = True
+            tracked.static = deal
+        return deal
+
+    def run(self, interval=300, rounds=None, changes_only=False):
+        """
+        Polls the tracked deals every interval seconds (rounds times, or until none is left); yields Samples.
+
+        """
+        done = 0
+        while self._deals and (rounds is None or done < rounds):
+            start = time.time()
+            for sample in self.poll(changes_only):
+                yield sample
+            done += 1
+            if rounds is None or done < rounds:
+                time.sleep(max(0, interval - (time.time() - start)))
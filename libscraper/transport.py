@@ -0,0 +1,229 @@
+"""
+Transports: how BaseParser.parse() fetches URLs.
+
+A transport opens a urllib2.Request and returns a file-like response
+(read(), code, geturl(), info()), raising urllib2.HTTPError / URLError as
+urllib2 does:
+
+    UrllibTransport     urllib2 through the Scraper's Session (default)
+    RecordingTransport  archives every response fetched by another transport
+    ReplayTransport     serves responses from an archive, without any network access
+
+Record a run, then re-run extraction against the same pages:
+
+    archive = Archive('/var/lib/scraper/2013-01-14.idx')
+    Scraper(transport=RecordingTransport(archive)).get_deals(url)
+    Scraper(transport=ReplayTransport(archive)).get_deals(url)
+
+An Archive is an append-only data file of zlib-compressed responses (status,
+headers, body) and a SQLite index of their offsets, keyed by normalized URL;
+the last recorded response of a URL wins.
+
+"""
+import httplib
+import json
+import os
+import sqlite3
+import struct
+import threading
+import time
+import urllib
+import urllib2
+import zlib
+from cStringIO import StringIO
+from libscraper.cache import normalize_url
+from libscraper.utils import bytestr
+
+
+class ArchivedResponse(object):
+    """ A recorded response. """
+
+    def __init__(self, url, code, msg, headers, body):
+        self.url = bytestr(url)
+        self.code = code
+        self.msg = bytestr(msg)
+        self.headers = [bytestr(line) for line in headers]
+        self.body = body
+
+    def info(self):
+        return httplib.HTTPMessage(StringIO(''.join(self.headers)))
+
+    def response(self):
+        """ Returns a urllib2-like response, or raises the recorded HTTPError. """
+        if self.code >= 400:
+            raise urllib2.HTTPError(self.url, self.code, self.msg, self.info(), StringIO(self.body))
+        response = urllib.addinfourl(StringIO(self.body), self.info(), self.url)
+        response.code = self.code
+        response.msg = self.msg
+        return response
+
+    def serialize(self):
+        meta = json.dumps({'url': self.url, 'code': self.code, 'msg': self.msg, 'headers': self.headers})
+        return zlib.compress(struct.pack('<I', len(meta)) + meta + self.body)
+
+    @classmethod
+    def deserialize(cls, data):
+        data = zlib.decompress(data)
+        size = struct.unpack('<I', data[:4])[0]
+        meta = json.loads(data[4:4 + size])
+        return cls(body=data[4 + size:], **meta)
+
+
+class Archive(object):
+    """
+    Indexed on-disk store of responses.
+
+        -- path     index (SQLite database) path; data is appended to <path>.data
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses '
+                         '(url TEXT PRIMARY KEY, offset INTEGER, length INTEGER, recorded REAL)')
+        self._db.commit()
+        self._data = open(path + '.data', 'a+b')
+
+    def put(self, url, response):
+        """ Appends an ArchivedResponse for url. """
+        data = response.serialize()
+        with self._lock:
+            self._data.seek(0, os.SEEK_END)
+            offset = self._data.tell()
+            self._data.write(data)
+            self._data.flush()
+            self._db.execute('INSERT OR REPLACE INTO responses (url, offset, length, recorded) VALUES (?, ?, ?, ?)',
+                             (normalize_url(url), offset, len(data), time.time()))
+            self._db.commit()
+
+    def get(self, url):
+        """ Returns the ArchivedResponse recorded for url, or None. """
+        with self._lock:
+            row = self._db.execute('SELECT offset, length FROM responses WHERE url = ?',
+                                   (normalize_url(url),)).fetchone()
+            if row is None:
+                return None
+            self._data.seek(row[0])
+            data = self._data.read(row[1])
+        return ArchivedResponse.deserialize(data)
+
+    def __contains__(self, url):
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM responses WHERE url = ?', (normalize_url(url),)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def urls(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT url FROM responses ORDER BY recorded')]
+
+    def close(self):
+        with self._lock:
+            self._data.close()
+            self._db.close()
+
+
+class Transport(object):
+
+    def bind(self, session):
+        """ Called by the Scraper using the transport, with its Session. """
+        pass
+
+    def open(self, request, proxy=None, timeout=10):
+        """ Opens a urllib2.Request; returns a file-like response or raises urllib2.HTTPError / URLError. """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class UrllibTransport(Transport):
+    """ Fetches URLs with urllib2, through a Session (keep-alive connections, DNS and response caches). """
+
+    def __init__(self, session):
+        self.session = session
+
+    def open(self, request, proxy=None, timeout=10):
+        return self.session.open(request, proxy=proxy, timeout=timeout)
+
+    def close(self):
+        self.session.close()
+
+
+class RecordingTransport(Transport):
+    """
+    Archives the responses (including HTTP errors) fetched by another transport.
+
+        -- archive      Archive
+        -- transport    transport actually fetching URLs (defaults to urllib2 through the Scraper's Session)
+
+    """
+
+    def __init__(self, archive, transport=None):
+        self.archive = archive
+        self.transport = transport
+
+    def bind(self, session):
+        if self.transport is None:
+            self.transport = UrllibTransport(session)
+        self.transport.bind(session)
+
+    def open(self, request, proxy=None, timeout=10):
+        try:
+            response = self.transport.open(request, proxy=proxy, timeout=timeout)
+        except urllib2.HTTPError as e:
+            archived = ArchivedResponse(e.geturl(), e.code, e.msg, list(e.info().headers), e.read())
+            self._archive(request, archived)
+            return archived.response()
+        try:
+            archived = ArchivedResponse(response.geturl(), response.code, response.msg,
+                                        list(response.info().headers), response.read())
+        finally:
+            response.close()
+        self._archive(request, archived)
+        return archived.response()
+
+    def _archive(self, request, archived):
+        try:
+            self.archive.put(request.get_full_url(), archived)
+        except (IOError, OSError, ValueError):
+            pass # Unarchivable (e.g. non UTF-8 headers) or disk error: serve the response anyway
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class ReplayTransport(Transport):
+    """
+    Serves responses from an archive.
+
+        -- archive      Archive
+        -- fallback     transport used for URLs missing from the archive
+                        (by default, they fail with a URLError)
+
+    """
+
+    def __init__(self, archive, fallback=None):
+        self.archive = archive
+        self.fallback = fallback
+
+    def bind(self, session):
+        if self.fallback is not None:
+            self.fallback.bind(session)
+
+    def open(self, request, proxy=None, timeout=10):
+        archived = self.archive.get(request.get_full_url())
+        if archived is not None:
+            return archived.response()
+        if self.fallback is not None:
+            return self.fallback.open(request, proxy=proxy, timeout=timeout)
+        raise urllib2.URLError('not archived: {:s}'.format(request.get_full_url()))
+
+    def close(self):
+        if self.fallback is not None:
+            self.fallback.close()
@@ -0,0 +1,172 @@
+"""
+Long-running scraper worker: jobs served over a local socket or a pipe.
+
+A Worker keeps one Scraper warm between jobs: target patterns are compiled,
+models loaded and Session connections kept alive once, instead of once per
+process. Jobs and replies are JSON objects, one per line:
+
+    {"id": 1, "action": "get-deal", "url": "http://www.groupon.co.uk/deals/..."}
+    {"id": 1, "ok": true, "result": {...}, "latency": 0.0123}
+    {"id": 2, "ok": false, "error": "ElementMissing", "message": "...", "latency": 0.0101}
+
+Actions: get-deals, get-deal, get-urlinfo, ping, and stats (calls, total,
+min and max latency per action since the worker started). Latencies are in
+seconds.
+
+    worker = Worker(Scraper())
+    worker.serve_socket('/var/run/scraper.sock')    # or worker.serve_pipe(sys.stdin, sys.stdout)
+
+    client = WorkerClient('/var/run/scraper.sock')
+    reply = client.request('get-deal', url)
+
+Socket connections are served on threads of their own; the jobs of a
+connection run in order.
+
+"""
+import SocketServer
+import json
+import os
+import socket
+import time
+from libscraper.metrics import MemorySink
+from libscraper.output import json_default
+
+ACTIONS = ('get-deals', 'get-deal', 'get-urlinfo', 'ping', 'stats')
+
+
+class Worker(object):
+    """
+    Runs jobs against a Scraper.
+
+        -- scraper      Scraper kept warm between jobs
+
+    """
+
+    def __init__(self, scraper):
+        self.scraper = scraper
+        self.stats = MemorySink()
+        self.started = time.time()
+
+    def run(self, action, url):
+        """ Runs an action; returns its JSON-serializable result. """
+        scrpr = self.scraper
+        if action not in ACTIONS:
+            raise ValueError('Unknown action: {!s}'.format(action))
+        if action == 'ping':
+            return {'pid': os.getpid(), 'uptime': time.time() - self.started}
+        if action == 'stats':
+            return self.stats.snapshot()['timings']
+        if not url:
+            raise ValueError('URL must be given.')
+        # Scraper.model() does not change the Scraper's current model: jobs may run concurrently
+        parser = scrpr.model(url)
+        if action == 'get-urlinfo':
+            return parser.urlinfo(url)
+        if action == 'get-deals':
+            return scrpr.call(parser, 'get_deals', url) or []
+        return scrpr.call(parser, 'get_deal', url) or {}
+
+    def handle(self, job):
+        """ Runs a job (a dictionary with 'action', 'url' and an optional 'id'); returns the reply. """
+        action = job.get('action')
+        start = time.time()
+        try:
+            reply = {'ok': True, 'result': self.run(action, job.get('url'))}
+        except Exception as e:
+            reply = {'ok': False, 'error': type(e).__name__, 'message': str(e)}
+        latency = time.time() - start
+        reply['latency'] = latency
+        if 'id' in job:
+            reply['id'] = job['id']
+        if action in ACTIONS:
+            self.stats.timing(action, latency, {})
+            self.scraper.metrics.timing('job', latency, action=action)
+        self.scraper.logger.debug(' >> {!s} {!s}: {:s} ({:.1f} ms)'.format(
+            action, job.get('url', ''), 'ok' if reply['ok'] else reply['error'], latency * 1000))
+        return reply
+
+    def handle_line(self, line):
+        """ Runs a job read from a JSON line; returns the reply as a JSON line. """
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict):
+                raise ValueError('a job must be a JSON object')
+        except ValueError as e:
+            reply = {'ok': False, 'error': 'BadRequest', 'message': str(e), 'latency': 0.0}
+        else:
+            reply = self.handle(job)
+        return json.dumps(reply, default=json_default, separators=(',', ':')) + '\n'
+
+    def serve_pipe(self, stdin, stdout):
+        """ Serves jobs read from stdin until end of file, replying on stdout. """
+        for line in iter(stdin.readline, ''):
+            if not line.strip():
+                continue
+            stdout.write(self.handle_line(line))
+            stdout.flush()
+
+    def serve_socket(self, path):
+        """ Serves jobs on a Unix domain socket until interrupted. """
+        if os.path.exists(path):
+            os.unlink(path) # stale socket of a previous worker
+        server = WorkerServer(path, self)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(path)
+
+
+class WorkerHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        self.server.worker.serve_pipe(self.rfile, self.wfile)
+
+
+class WorkerServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, path, worker):
+        self.worker = worker
+        SocketServer.UnixStreamServer.__init__(self, path, WorkerHandler)
+
+
+class WorkerClient(object):
+    """
+    Submits jobs to a worker socket.
+
+        -- path     Unix domain socket path of the worker
+        -- timeout  socket timeout in seconds (None waits forever)
+
+    """
+
+    def __init__(self, path, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self._file = self.sock.makefile('rb')
+        self._id = 0
+
+    def request(self, action, url=None):
+        """ Runs a job on the worker; returns the reply dictionary. """
+        self._id += 1
+        job = {'id': self._id, 'action': action}
+        if url is not None:
+            job['url'] = url
+        self.sock.sendall(json.dumps(job) + '\n')
+        line = self._file.readline()
+        if not line:
+            raise IOError('worker closed the connection')
+        return json.loads(line)
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False